@@ -0,0 +1,323 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+"""
+Benchmark of the runner's fixture and output machinery.
+
+Generates a synthetic app (models, fixture files and TestCases with
+overlapping fixture lists), runs it with the runner on SQLite and appends
+wall time, flushes, loaded fixtures, queries and output overhead to a JSON
+lines file, comparing them with the last result of the same scenario::
+
+    python -m colortools.benchmark --cases 200 --fixtures 30 --repeat 3
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+DEFAULTS = {
+    'models': 5,
+    'fixtures': 20,
+    'rows': 20,
+    'cases': 50,
+    'tests': 4,
+    'fixtures_per_case': 3,
+    'overlap': 0.6,
+    'transaction': 0.2,
+    'seed': 1,
+}
+
+APP = 'colortools_benchmark'
+
+
+def fixture_lists(scenario):
+    """
+    returns a fixture list for every TestCase. Lists share a prefix of the
+    same fixtures with ``overlap`` probability, the rest is random.
+    """
+    rand = random.Random(scenario['seed'])
+    names = ['fixture%d' % i for i in range(scenario['fixtures'])]
+    shared = rand.sample(names, min(scenario['fixtures_per_case'], len(names)))
+    lists = []
+    for case in range(scenario['cases']):
+        size = rand.randint(0, min(scenario['fixtures_per_case'], len(names)))
+        fixtures = []
+        for position in range(size):
+            if rand.random() < scenario['overlap'] and shared[position] not in fixtures:
+                fixtures.append(shared[position])
+            else:
+                fixtures.append(rand.choice([name for name in names
+                                             if name not in fixtures]))
+        lists.append(fixtures)
+    return lists
+
+
+def generate_app(path, scenario):
+    """writes the synthetic app package into ``path``"""
+    rand = random.Random(scenario['seed'])
+    package = os.path.join(path, APP)
+    os.makedirs(os.path.join(package, 'fixtures'))
+    _write(os.path.join(package, '__init__.py'), '')
+
+    models = ['from django.db import models\n']
+    for model in range(scenario['models']):
+        models.append('\nclass Model%d(models.Model):\n'
+                      '    name = models.CharField(max_length=50)\n'
+                      '    value = models.IntegerField(db_index=True)\n' % model)
+    _write(os.path.join(package, 'models.py'), ''.join(models))
+
+    for fixture in range(scenario['fixtures']):
+        model = fixture % scenario['models']
+        objects = []
+        for row in range(scenario['rows']):
+            objects.append({
+                'model': '%s.model%d' % (APP, model),
+                'pk': fixture * scenario['rows'] + row + 1,
+                'fields': {'name': 'row %d' % row, 'value': rand.randint(0, 1000)},
+            })
+        _write(os.path.join(package, 'fixtures', 'fixture%d.json' % fixture),
+               simplejson.dumps(objects))
+
+    tests = ['from django.test import TestCase, TransactionTestCase\n',
+             'from %s.models import *\n' % APP]
+    for case, fixtures in enumerate(fixture_lists(scenario)):
+        base = rand.random() < scenario['transaction'] and 'TransactionTestCase' or 'TestCase'
+        tests.append('\nclass Case%d(%s):\n    fixtures = %r\n' % (case, base, fixtures))
+        for test in range(scenario['tests']):
+            model = rand.randrange(scenario['models'])
+            tests.append('\n    def test_%d(self):\n'
+                         '        Model%d.objects.create(name="new", value=%d)\n'
+                         '        self.assertTrue(Model%d.objects.filter(value__gte=0).count())\n'
+                         % (test, model, test, model))
+    _write(os.path.join(package, 'tests.py'), ''.join(tests))
+
+
+def _write(path, content):
+    stream = open(path, 'w')
+    try:
+        stream.write(content)
+    finally:
+        stream.close()
+
+
+def output_overhead(tests=10000):
+    """
+    milliseconds ColorTextTestResult spends writing results of 1000 tests,
+    measured over ``tests`` results
+    """
+    from colortools.test import ColorTextTestResult, _ColorDecorator
+
+    class Test(object):
+        def id(self):
+            return 'app.tests.Case.test'
+        def shortDescription(self):
+            return None
+
+    stream = open(os.devnull, 'w')
+    try:
+        result = ColorTextTestResult(_ColorDecorator(stream, colors=True), True, 1)
+        test = Test()
+        start = time.time()
+        for i in range(tests):
+            result.startTest(test)
+            result.addSuccess(test)
+            result.stopTest(test)
+        result.stream._flush()
+        return (time.time() - start) * 1000 / tests
+    finally:
+        stream.close()
+
+
+class _Silenced(object):
+    """redirects stdout and stderr file descriptors to /dev/null"""
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [os.dup(1), os.dup(2)]
+        null = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(null, 1)
+        os.dup2(null, 2)
+        os.close(null)
+
+    def __exit__(self, *exc_info):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved in zip((1, 2), self.saved):
+            os.dup2(saved, fd)
+            os.close(saved)
+
+
+def _run_tests(settings):
+    """runs the generated app silenced, returns the runner and its failures"""
+    from django.test.utils import get_runner
+
+    runner = get_runner(settings)(verbosity=1, interactive=False)
+    silenced = _Silenced()
+    silenced.__enter__()
+    try:
+        failures = runner.run_tests([APP])
+    finally:
+        silenced.__exit__()
+    return runner, failures
+
+
+def run_scenario(scenario, runner_class, options=None, repeat=1):
+    """
+    runs the generated app ``repeat`` times and returns measurements. Queries
+    are counted by another run - cursor wrappers counting them would add to
+    the measured time (unless TEST_QUERIES is among ``options``). Django
+    settings are configured here, so it can run once per process.
+    """
+    from django.conf import settings
+
+    path = tempfile.mkdtemp()
+    try:
+        generate_app(path, scenario)
+        sys.path.insert(0, path)
+        configuration = {
+            'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                      'NAME': os.path.join(path, 'db.sqlite')}},
+            'INSTALLED_APPS': ('django.contrib.contenttypes', 'django.contrib.sites',
+                               APP),
+            'TEST_RUNNER': runner_class,
+            'TEST_DURATIONS_FILE': '',
+        }
+        configuration.update(options or {})
+        settings.configure(**configuration)
+
+        walls = []
+        for run in range(repeat):
+            start = time.time()
+            runner, failures = _run_tests(settings)
+            walls.append(time.time() - start)
+
+        counted = runner
+        if not getattr(settings, 'TEST_QUERIES', 0):
+            settings.TEST_QUERIES = 1
+            counted = _run_tests(settings)[0]
+
+        queries = 0
+        if getattr(counted, 'query_log', None) is not None:
+            statistics = counted.query_log.statistics()
+            queries = sum([stats.count for bucket in statistics.values()
+                           for stats in bucket.values()])
+        return {
+            'wall': sorted(walls)[len(walls) // 2],
+            'walls': walls,
+            'failures': failures,
+            'tests': scenario['cases'] * scenario['tests'],
+            'flushes': runner.flushes + getattr(runner, 'transaction_flushes', 0),
+            'fixtures_loaded': runner.fixtures + getattr(runner, 'transaction_fixtures', 0),
+            'fixtures_prevented': runner.fixtures_prevented,
+            'fixture_setup': sum(runner.fixture_timings.values()),
+            'queries': queries,
+            'output_per_1000': output_overhead(),
+        }
+    finally:
+        if path in sys.path:
+            sys.path.remove(path)
+        shutil.rmtree(path)
+
+
+def scenario_id(scenario, runner_class, options):
+    return md5_constructor(simplejson.dumps([scenario, runner_class, options],
+                                            sort_keys=True)).hexdigest()[:12]
+
+
+class ResultsFile(object):
+    """Benchmark results - a JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def results(self):
+        if not os.path.exists(self.path):
+            return []
+        stream = open(self.path, 'r')
+        try:
+            return [simplejson.loads(line) for line in stream if line.strip()]
+        finally:
+            stream.close()
+
+    def previous(self, scenario):
+        """returns the last result of a scenario with the given id"""
+        results = [result for result in self.results()
+                   if result.get('scenario_id') == scenario]
+        return results and results[-1] or None
+
+    def append(self, result):
+        stream = open(self.path, 'a')
+        try:
+            stream.write(simplejson.dumps(result, sort_keys=True))
+            stream.write('\n')
+        finally:
+            stream.close()
+
+
+METRICS = ('wall', 'fixture_setup', 'flushes', 'fixtures_loaded', 'queries',
+           'output_per_1000')
+
+
+def compare(result, previous):
+    """returns lines comparing metrics of two results"""
+    lines = []
+    for metric in METRICS:
+        value = result[metric]
+        line = '%-16s %12.4f' % (metric, value)
+        if previous is not None and previous.get(metric):
+            change = (value - previous[metric]) * 100.0 / previous[metric]
+            line += ' %+8.1f%% (was %.4f)' % (change, previous[metric])
+        lines.append(line)
+    return lines
+
+
+def main(argv=None):
+    parser = OptionParser(usage='python -m colortools.benchmark [options]')
+    for name, default in sorted(DEFAULTS.items()):
+        parser.add_option('--%s' % name.replace('_', '-'), dest=name,
+                          default=default, type=type(default).__name__)
+    parser.add_option('--runner', default='colortools.test.ColorDjangoTestSuiteRunner')
+    parser.add_option('--set', dest='settings', action='append', default=[],
+                      metavar='NAME=VALUE', help='additional setting, e.g. TEST_PARALLEL=4')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--output', default='.benchmarks.jsonl')
+    options, args = parser.parse_args(argv)
+
+    import ast
+    import colortools
+    scenario = dict([(name, getattr(options, name)) for name in DEFAULTS])
+    settings = dict([(item.split('=', 1)[0], ast.literal_eval(item.split('=', 1)[1]))
+                     for item in options.settings])
+
+    result = run_scenario(scenario, options.runner, settings, options.repeat)
+    result.update({
+        'scenario': scenario,
+        'scenario_id': scenario_id(scenario, options.runner, settings),
+        'runner': options.runner,
+        'settings': settings,
+        'revision': colortools.__build__,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    results = ResultsFile(options.output)
+    previous = results.previous(result['scenario_id'])
+    results.append(result)
+
+    print("Scenario %s: %s tests, %s failed" % (result['scenario_id'],
+                                                 result['tests'], result['failures']))
+    for line in compare(result, previous):
+        print("    %s" % line)
+    return result['failures']
+
+
+if __name__ == '__main__':
+    sys.exit(main() and 1 or 0)
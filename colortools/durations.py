@@ -0,0 +1,152 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+
+def test_class_name(test):
+    return '%s.%s' % (test.__class__.__module__, test.__class__.__name__)
+
+
+def fixtures_key(fixtures):
+    """history key of the time spent setting up a fixture set"""
+    return 'fixtures:%s' % ','.join(fixtures)
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class DurationHistory(object):
+    """
+    Test durations of recent runs stored in a JSON file - a list of the last
+    ``size`` durations for every test id.
+    """
+
+    def __init__(self, path, size=10):
+        self.path = path
+        self.size = size
+        self.durations = {}
+        if os.path.exists(path):
+            stream = open(path, 'r')
+            try:
+                try:
+                    self.durations = simplejson.load(stream)
+                except ValueError:
+                    self.durations = {}
+            finally:
+                stream.close()
+
+    def median(self, key):
+        return median(self.durations.get(key, []))
+
+    def fingerprint(self):
+        """digest of the durations - equal on nodes sharing the history"""
+        return md5_constructor(simplejson.dumps(self.durations, sort_keys=True)
+                               ).hexdigest()[:12]
+
+    def record(self, key, seconds):
+        durations = self.durations.setdefault(key, [])
+        durations.append(round(seconds, 4))
+        del durations[:-self.size]
+
+    def save(self):
+        stream = open(self.path, 'w')
+        try:
+            simplejson.dump(self.durations, stream)
+        finally:
+            stream.close()
+
+
+class DurationReport(object):
+    """Slowest tests, TestCases and fixture sets of a single run"""
+
+    def __init__(self, timings, fixture_timings, history=None,
+                 factor=2.0, threshold=0.05):
+        self.timings = timings
+        self.fixture_timings = fixture_timings
+        self.history = history
+        self.factor = factor
+        self.threshold = threshold
+
+        self.classes = {}
+        for test, seconds in timings:
+            name = test_class_name(test)
+            self.classes[name] = self.classes.get(name, 0) + seconds
+
+        self.regressions = []
+        if history is not None:
+            for test, seconds in timings:
+                previous = history.median(test.id())
+                if (previous is not None and seconds > previous * factor
+                        and seconds - previous > threshold):
+                    self.regressions.append((test, seconds, previous))
+
+    def total(self):
+        return sum([seconds for test, seconds in self.timings])
+
+    def fixture_total(self):
+        return sum(self.fixture_timings.values())
+
+    def slowest_tests(self, count=10):
+        return sorted(self.timings, key=lambda item: -item[1])[:count]
+
+    def slowest_classes(self, count=10):
+        return sorted(self.classes.items(), key=lambda item: -item[1])[:count]
+
+    def slowest_fixtures(self, count=10):
+        return sorted(self.fixture_timings.items(),
+                      key=lambda item: -item[1])[:count]
+
+    def update_history(self):
+        for test, seconds in self.timings:
+            self.history.record(test.id(), seconds)
+        for fixtures, seconds in self.fixture_timings.items():
+            self.history.record(fixtures_key(fixtures), seconds)
+        self.history.save()
+
+    def write(self, stream, count=10):
+        """writes report to a stream decorated with _ColorDecorator"""
+        stream.writeln()
+        stream.writeln("Slowest tests (%.3fs in tests, %.3fs in fixture setup):" % (
+                        self.total(), self.fixture_total()))
+        for test, seconds in self.slowest_tests(count):
+            stream.color('SLOW')
+            stream.write("    %8.3fs" % seconds)
+            stream.colorClear()
+            stream.writeln(" %s" % test.id())
+
+        stream.writeln("Slowest TestCases:")
+        for name, seconds in self.slowest_classes(count):
+            stream.color('SLOW')
+            stream.write("    %8.3fs" % seconds)
+            stream.colorClear()
+            stream.writeln(" %s" % name)
+
+        if self.fixture_timings:
+            stream.writeln("Slowest fixture sets:")
+            for fixtures, seconds in self.slowest_fixtures(count):
+                stream.color('SLOW')
+                stream.write("    %8.3fs" % seconds)
+                stream.colorClear()
+                stream.writeln(" %s" % list(fixtures))
+
+        if self.regressions:
+            stream.writeln("Slower than the median of previous runs:")
+            for test, seconds, previous in self.regressions:
+                stream.color('FAIL')
+                stream.write("    %8.3fs" % seconds)
+                stream.colorClear()
+                stream.writeln(" (median %.3fs) %s" % (previous, test.id()))
+        stream.writeln()
@@ -0,0 +1,192 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import re
+import threading
+
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.backends import util
+
+from colortools.snapshots import dump_tables
+
+_WRITE = re.compile(r'^\s*(?:INSERT\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)'
+                    r'\s+[`"]?([^`"\s(]+)', re.IGNORECASE)
+
+
+def written_table(sql):
+    """returns name of the table a statement writes to or None"""
+    match = _WRITE.match(sql)
+    return match and match.group(1) or None
+
+
+class _TrackingCursor(util.CursorWrapper):
+    """Cursor wrapper collecting names of tables written to"""
+
+    def __init__(self, cursor, db, tables):
+        super(_TrackingCursor, self).__init__(cursor, db)
+        self.tables = tables
+
+    def execute(self, sql, params=()):
+        self._track(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self._track(sql)
+        return self.cursor.executemany(sql, param_list)
+
+    def _track(self, sql):
+        table = written_table(sql)
+        if table is not None:
+            self.tables.add(table)
+
+
+def clear_tables(db, tables, rows):
+    """
+    deletes all rows of given tables and inserts back their rows from
+    ``rows`` - a dict of table names and (columns, rows) tuples
+    """
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+
+    if connection.vendor == 'mysql':
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 0;')
+    for table in tables:
+        cursor.execute('DELETE FROM %s' % qn(table))
+    for table in tables:
+        if table not in rows:
+            continue
+        columns, values = rows[table]
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                            qn(table),
+                            ', '.join([qn(column) for column in columns]),
+                            ', '.join(['%s'] * len(columns))), values)
+    if connection.vendor == 'mysql':
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 1;')
+
+    models = connection.introspection.installed_models(tables)
+    for statement in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(statement)
+
+    transaction.commit_unless_managed(using=db)
+
+
+_flush_lock = threading.Lock()
+
+
+def flush_database(db):
+    """
+    runs the flush command. Handlers of post_syncdb signal it sends (content
+    types, permissions) always use the default database, so flushes of
+    concurrently processed databases have to wait for each other.
+    """
+    _flush_lock.acquire()
+    try:
+        call_command('flush', verbosity=0, interactive=False, database=db)
+    finally:
+        _flush_lock.release()
+
+
+class TableTracker(object):
+    """
+    Keeps track of tables written since the last full flush.
+
+    Rows left in the databases by the full flush (initial data, content
+    types, permissions) are remembered, so a flush can be replaced by
+    clearing just the written tables and restoring their remembered rows.
+    Writes are tracked only between begin and end - fixture loading is the
+    only thing committing data in TestCases. Anything else writing committed
+    data should call invalidate so the next flush is a full one, done by
+    ``full_flush`` (the flush command by default). Statements not matching
+    INSERT, REPLACE, UPDATE or DELETE (TRUNCATE, triggers, procedures) go
+    unnoticed.
+    """
+
+    def __init__(self, full_flush=None):
+        self.full_flush = full_flush or flush_database
+        self.baseline = {}
+        self.written = {}
+        self.full_flushes = 0
+        self.partial_flushes = 0
+        self.cleared_tables = 0
+        self._cursors = {}
+
+    def begin(self, databases, written=None):
+        """
+        starts tracking writes to ``databases`` into ``written`` (a dict of
+        sets keyed by database, tables written since the last flush when
+        not given)
+        """
+        if written is None:
+            written = self.written
+        for db in databases:
+            connection = connections[db]
+            tables = written.setdefault(db, set())
+            self._cursors[db] = connection.cursor
+            connection.cursor = (lambda cursor=connection.cursor,
+                                        connection=connection, tables=tables:
+                                 _TrackingCursor(cursor(), connection, tables))
+
+    def end(self, databases=None):
+        if databases is None:
+            databases = self._cursors.keys()
+        for db in databases:
+            del self._cursors[db]
+            if 'cursor' in connections[db].__dict__:
+                del connections[db].cursor
+
+    def restored(self, db, tables):
+        """
+        marks tables written by restoring a snapshot - every table of the
+        snapshot and all tables emptied by it
+        """
+        written = self.written.setdefault(db, set())
+        written.update([table for table, columns, rows in tables])
+        written.update(self.baseline.get(db, {}).keys())
+
+    def state(self, db):
+        """baseline and tables written since it was taken - for snapshots"""
+        return self.baseline.get(db), set(self.written.get(db, ()))
+
+    def restore(self, snapshot, db):
+        """
+        restores a snapshot of ``db``. Only tables written before the snapshot
+        was taken or since then are cleared and get its rows, unless the
+        baseline changed in between - then the whole database is restored.
+        """
+        baseline, written = snapshot.states.get(db, (None, None))
+        if baseline is None or baseline is not self.baseline.get(db):
+            snapshot.restore([db])
+            self.restored(db, snapshot.tables[db])
+            return
+        tables = sorted(self.written.get(db, set()) | written)
+        clear_tables(db, tables, dict([(table, (columns, rows)) for table, columns, rows
+                                       in snapshot.tables[db]]))
+        self.cleared_tables += len(tables)
+        self.written[db] = set(written)
+
+    def invalidate(self, db=None):
+        """makes the next flush of ``db`` (or of all databases) a full one"""
+        if db is None:
+            self.baseline = {}
+        else:
+            self.baseline.pop(db, None)
+
+    def flush(self, db):
+        """clears written tables or flushes the database when that's not possible"""
+        if db not in self.baseline:
+            self.full_flush(db)
+            self.full_flushes += 1
+            self.baseline[db] = dict([(table, (columns, rows))
+                                      for table, columns, rows in dump_tables(db)])
+        else:
+            tables = sorted(self.written.get(db, ()))
+            if tables:
+                clear_tables(db, tables, self.baseline[db])
+                self.cleared_tables += len(tables)
+            self.partial_flushes += 1
+        self.written[db] = set()
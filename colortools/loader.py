@@ -0,0 +1,302 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import copy
+import os
+import threading
+
+from django.conf import settings
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.core.serializers.base import DeserializedObject
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.db import connections, router, transaction
+from django.db.models import get_apps, get_model
+from django.db.models.fields.related import ForeignKey, ManyToManyField
+from django.utils import simplejson
+
+BATCH_SIZE = 500
+
+
+def _parse_json(stream):
+    return simplejson.load(stream)
+
+
+def _parse_yaml(stream):
+    import yaml
+    return yaml.load(stream)
+
+_PARSERS = {
+    'json': _parse_json,
+    'yaml': _parse_yaml,
+}
+
+
+def _uses_natural_keys(object_list):
+    """
+    checks if any of the related fields refers to objects by natural keys.
+    Those are resolved against the database during deserialization.
+    """
+    for data in object_list:
+        model = get_model(*data['model'].split('.'))
+        if model is None:
+            continue
+        for field_name, value in data.get('fields', {}).items():
+            try:
+                field = model._meta.get_field(field_name)
+            except Exception:
+                continue
+            if isinstance(field, ForeignKey) and isinstance(value, (list, tuple)):
+                return True
+            if isinstance(field, ManyToManyField) and \
+                    [v for v in value if isinstance(v, (list, tuple))]:
+                return True
+    return False
+
+
+def fixture_dirs():
+    app_module_paths = []
+    for app in get_apps():
+        if hasattr(app, '__path__'):
+            app_module_paths.extend(app.__path__)
+        else:
+            app_module_paths.append(app.__file__)
+    return ([os.path.join(os.path.dirname(path), 'fixtures')
+             for path in app_module_paths] +
+            list(settings.FIXTURE_DIRS) + [''])
+
+
+class _CachedFixture(object):
+
+    def __init__(self, path, mtime, size, object_list):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.object_list = object_list
+        self.objects = None
+        if not _uses_natural_keys(object_list):
+            self.objects = list(PythonDeserializer(object_list))
+
+    def deserialize(self, db):
+        if self.objects is not None:
+            # saving changes instances (pk, state), the cached ones stay intact
+            return [_copy(obj) for obj in self.objects]
+        return PythonDeserializer(self.object_list, using=db)
+
+
+def _copy(obj):
+    instance = copy.copy(obj.object)
+    instance._state = copy.copy(obj.object._state)
+    return DeserializedObject(instance, obj.m2m_data)
+
+
+class FixtureLoader(object):
+    """
+    Replacement for loaddata keeping parsed fixture files in memory.
+
+    Files are cached by path and modification time. Deserialized objects are
+    cached as well unless a fixture uses natural keys. New objects are
+    inserted in batches - model save() and its signals are not called for
+    them. Fixtures in other formats or compressed ones are loaded by
+    loaddata.
+
+    ``max_size`` limits the sum of sizes of cached files, not the memory
+    their parsed objects take - that is usually several times more. Loads
+    into several databases may run in threads at the same time.
+    """
+
+    def __init__(self, max_size=50 * 1024 * 1024):
+        self.max_size = max_size
+        self.cache = {}
+        self.order = []
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._dirs = None
+        self._lock = threading.Lock()
+
+    def find(self, label, db):
+        """
+        returns a list of (path, format) tuples the label refers to or None
+        if the label should be handled by loaddata
+        """
+        parts = label.split('.')
+        if len(parts) == 1:
+            name, formats = label, serializers.get_public_serializer_formats()
+        else:
+            name, formats = '.'.join(parts[:-1]), [parts[-1]]
+
+        if os.path.isabs(name):
+            dirs = [name]
+        else:
+            if self._dirs is None:
+                self._dirs = fixture_dirs()
+            dirs = self._dirs
+
+        found = []
+        for fixture_dir in dirs:
+            for database in (db, None):
+                for format in formats:
+                    file_name = '.'.join([p for p in (name, database, format) if p])
+                    path = os.path.join(fixture_dir, file_name)
+                    if os.path.exists(path):
+                        if format not in _PARSERS:
+                            return None
+                        found.append((path, format))
+                    elif [ext for ext in ('gz', 'zip', 'bz2')
+                          if os.path.exists('%s.%s' % (path, ext))]:
+                        return None
+        return found or None
+
+    def parse(self, path, format):
+        self._lock.acquire()
+        try:
+            return self._parse(path, format)
+        finally:
+            self._lock.release()
+
+    def _parse(self, path, format):
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached is not None and cached.mtime == stat.st_mtime:
+            self.hits += 1
+            self.order.remove(path)
+            self.order.append(path)
+            return cached
+
+        self.misses += 1
+        if cached is not None:
+            self._evict(path)
+        stream = open(path, 'r')
+        try:
+            cached = _CachedFixture(path, stat.st_mtime, stat.st_size,
+                                    _PARSERS[format](stream))
+        finally:
+            stream.close()
+
+        if stat.st_size <= self.max_size:
+            self.cache[path] = cached
+            self.order.append(path)
+            self.size += stat.st_size
+            while self.size > self.max_size:
+                self._evict(self.order[0])
+        return cached
+
+    def _evict(self, path):
+        self.size -= self.cache.pop(path).size
+        self.order.remove(path)
+
+    def load(self, labels, db, commit=True):
+        """
+        loads fixtures like loaddata does. With commit=False the data becomes
+        part of the transaction in place.
+        """
+        fixtures = []
+        for label in labels:
+            found = self.find(label, db)
+            if found is None:
+                fixtures.append((label, None))
+            else:
+                fixtures.extend([(label, self.parse(path, format))
+                                 for path, format in found])
+
+        connection = connections[db]
+        if commit:
+            transaction.commit_unless_managed(using=db)
+            transaction.enter_transaction_management(using=db)
+            transaction.managed(True, using=db)
+        try:
+            models = set()
+            for label, cached in fixtures:
+                if cached is None:
+                    call_command('loaddata', label, verbosity=0,
+                                 commit=False, database=db)
+                else:
+                    models.update(self.insert(cached.deserialize(db), db))
+
+            cursor = connection.cursor()
+            for line in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(line)
+            if commit:
+                transaction.commit(using=db)
+        except:
+            if commit:
+                transaction.rollback(using=db)
+            raise
+        finally:
+            if commit:
+                transaction.leave_transaction_management(using=db)
+
+    def insert(self, objects, db):
+        """
+        saves deserialized objects. Runs of objects of the same model with new
+        primary keys are inserted in batches, others are saved one by one so
+        the order of the fixture is kept. Returns saved models.
+        """
+        models = set()
+        batch = {}
+        batch_model = None
+        for obj in objects:
+            model = obj.object.__class__
+            if not router.allow_syncdb(db, model):
+                continue
+            models.add(model)
+            if model is not batch_model:
+                self._save_batch(batch_model, batch, db)
+                batch, batch_model = {}, model
+            if model._meta.proxy or obj.object.pk is None:
+                obj.save(using=db)
+            else:
+                # later objects with the same primary key win like in loaddata
+                batch[obj.object.pk] = obj
+        self._save_batch(batch_model, batch, db)
+        return models
+
+    def _save_batch(self, model, objects, db):
+        if not objects:
+            return
+        existing = self._existing(model, objects.keys(), db)
+        new = []
+        for pk, obj in objects.items():
+            if pk in existing:
+                obj.save(using=db)
+            else:
+                new.append(obj)
+        for start in range(0, len(new), BATCH_SIZE):
+            self._insert_batch(model, new[start:start + BATCH_SIZE], db)
+
+    def _existing(self, model, pks, db):
+        existing = set()
+        for start in range(0, len(pks), BATCH_SIZE):
+            existing.update(model._base_manager.using(db).filter(
+                pk__in=pks[start:start + BATCH_SIZE]).values_list('pk', flat=True))
+        return existing
+
+    def _insert_batch(self, model, objects, db):
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        fields = model._meta.local_fields
+        cursor = connection.cursor()
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                            qn(model._meta.db_table),
+                            ', '.join([qn(f.column) for f in fields]),
+                            ', '.join(['%s'] * len(fields))),
+                           [[f.get_db_prep_save(getattr(obj.object, f.attname),
+                                                connection=connection)
+                             for f in fields] for obj in objects])
+
+        for obj in objects:
+            obj.object._state.db = db
+            obj.object._state.adding = False
+            for accessor_name, object_list in (obj.m2m_data or {}).items():
+                field = model._meta.get_field(accessor_name)
+                through = field.rel.through._meta
+                if object_list:
+                    cursor.executemany('INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+                                        qn(through.db_table),
+                                        qn(field.m2m_column_name()),
+                                        qn(field.m2m_reverse_name())),
+                                       [(obj.object.pk, pk) for pk in object_list])
@@ -0,0 +1,163 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import gc
+import os
+import sys
+
+# without /proc only the peak size is known - growth of a test is then how
+# much it raised the peak
+PEAK_ONLY = not os.path.exists('/proc/self/statm')
+
+
+def peak_memory():
+    """largest resident set size of this process so far in bytes"""
+    import resource
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return size
+    return size * 1024  # kilobytes on Linux and BSD
+
+
+def resident_memory():
+    """resident set size of this process in bytes (peak one if PEAK_ONLY)"""
+    if PEAK_ONLY:
+        return peak_memory()
+    stream = open('/proc/self/statm')
+    try:
+        pages = int(stream.read().split()[1])
+    finally:
+        stream.close()
+    import resource
+    return pages * resource.getpagesize()
+
+
+def type_name(kind):
+    if kind.__module__ == '__builtin__':
+        return kind.__name__
+    return '%s.%s' % (kind.__module__, kind.__name__)
+
+
+def object_counts():
+    """
+    returns numbers of live objects tracked by the garbage collector (so no
+    strings or numbers) by type
+    """
+    gc.collect()
+    counts = {}
+    for obj in gc.get_objects():
+        kind = type(obj)
+        counts[kind] = counts.get(kind, 0) + 1
+    return dict([(type_name(kind), count) for kind, count in counts.items()])
+
+
+def _kilobytes(size):
+    return size // 1024
+
+
+class MemoryLog(object):
+    """
+    Resident memory growth of every test and every fixture setup.
+
+    Works as a test result listener. Every ``sample``-th test (none when 0)
+    also has live objects counted by type before and after it - object
+    growth is kept for the ``keep`` sampled tests that grew the most.
+    """
+
+    def __init__(self, sample=0, keep=5):
+        self.sample = sample
+        self.keep = keep
+        self.tests = {}
+        self.fixtures = {}
+        self.objects = {}
+        self.count = 0
+        self._started = None
+        self._counts = None
+        self._fixture = None
+
+    def begin(self, key):
+        self._fixture = (key, resident_memory())
+
+    def end(self):
+        key, size = self._fixture
+        self.fixtures[key] = self.fixtures.get(key, 0) + resident_memory() - size
+        self._fixture = None
+
+    def startTest(self, test):
+        self.count += 1
+        self._counts = None
+        if self.sample and self.count % self.sample == 0:
+            self._counts = object_counts()
+        self._started = resident_memory()
+
+    def stopTest(self, test):
+        if self._started is None:
+            return
+        growth = resident_memory() - self._started
+        self.tests[test.id()] = growth
+        self._started = None
+        if self._counts is not None:
+            before, self._counts = self._counts, None
+            objects = [(count - before.get(name, 0), name)
+                       for name, count in object_counts().items()
+                       if count > before.get(name, 0)]
+            self.objects[test.id()] = (growth, sorted(objects, reverse=True)[:10])
+            self._trim()
+
+    def _trim(self):
+        while len(self.objects) > self.keep:
+            smallest = min(self.objects.items(), key=lambda item: item[1][0])
+            del self.objects[smallest[0]]
+
+    def statistics(self):
+        return {'tests': self.tests, 'fixtures': self.fixtures,
+                'objects': self.objects}
+
+    def merge(self, statistics):
+        self.tests.update(statistics['tests'])
+        for key, size in statistics['fixtures'].items():
+            self.fixtures[key] = self.fixtures.get(key, 0) + size
+        self.objects.update(statistics['objects'])
+        self._trim()
+
+    def write(self, stream, count=10):
+        """writes report to a stream decorated with _ColorDecorator"""
+        tests = sorted(self.tests.items(), key=lambda item: -item[1])
+        fixtures = sorted(self.fixtures.items(), key=lambda item: -item[1])
+
+        stream.writeln()
+        stream.writeln("Memory growth (%d KB in tests, %d KB in fixture setup%s):" % (
+                        _kilobytes(sum([size for key, size in tests])),
+                        _kilobytes(sum([size for key, size in fixtures])),
+                        PEAK_ONLY and ", of peak size" or ""))
+        for test_id, size in tests[:count]:
+            if size <= 0:
+                break
+            stream.color('SLOW')
+            stream.write("    %8d KB" % _kilobytes(size))
+            stream.colorClear()
+            stream.writeln(" %s" % test_id)
+
+        if [size for key, size in fixtures if size > 0]:
+            stream.writeln("Fixture setup memory growth:")
+            for key, size in fixtures[:count]:
+                if size <= 0:
+                    break
+                stream.color('SLOW')
+                stream.write("    %8d KB" % _kilobytes(size))
+                stream.colorClear()
+                stream.writeln(" %s" % list(key))
+
+        if self.objects:
+            stream.writeln("Objects left by sampled tests that grew the most:")
+            for test_id, (size, objects) in sorted(self.objects.items(),
+                                                   key=lambda item: -item[1][0]):
+                stream.color('FAIL')
+                stream.write("    %8d KB" % _kilobytes(size))
+                stream.colorClear()
+                stream.writeln(" %s" % test_id)
+                for growth, name in objects:
+                    stream.writeln("            %+8d %s" % (growth, name))
+        stream.writeln()
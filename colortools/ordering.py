@@ -0,0 +1,181 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+
+def normalize_fixtures(fixtures):
+    """
+    returns fixtures as a tuple so lists and tuples declared on TestCases
+    compare equal
+    """
+    return tuple(fixtures or ())
+
+
+class _FixtureNode(object):
+    """Single node of the fixture trie - one fixture prefix"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.tests = []
+        self.children = {}
+
+    def child(self, fixture):
+        node = self.children.get(fixture)
+        if node is None:
+            node = _FixtureNode(self.prefix + (fixture,))
+            self.children[fixture] = node
+        return node
+
+    def branches(self):
+        """number of nodes in this subtree the runner returns to after a flush"""
+        count = len(self.children) > 1 and 1 or 0
+        return count + sum([child.branches() for child in self.children.values()])
+
+    def walk(self):
+        """
+        yields nodes carrying tests in pre-order - a node's own tests go before
+        its children so that the loaded fixtures are only extended while
+        walking down a branch. Every order of children costs the same flushes
+        and loads, but the snapshot of this node is needed again after each
+        child but the last one - children snapshotting the fewest branches go
+        first so that it is least likely evicted in between.
+        """
+        if self.tests:
+            yield self
+        for fixture in sorted(self.children,
+                              key=lambda fixture: (self.children[fixture].branches(),
+                                                   fixture)):
+            for node in self.children[fixture].walk():
+                yield node
+
+
+class FixturePlan(object):
+    """Predicted fixture loading cost for a sequence of fixture lists"""
+
+    def __init__(self, flushes=0, fixtures=0, fixtures_prevented=0, sets=0,
+                 restores=0):
+        self.flushes = flushes
+        self.fixtures = fixtures
+        self.fixtures_prevented = fixtures_prevented
+        self.sets = sets
+        self.restores = restores
+
+    def __repr__(self):
+        return '<FixturePlan flushes=%s fixtures=%s prevented=%s restores=%s>' % (
+                self.flushes, self.fixtures, self.fixtures_prevented, self.restores)
+
+
+def simulate(fixture_lists, snapshots=0, targets=()):
+    """
+    counts flushes and loaded fixtures the runner will need for the given
+    sequence of fixture lists. Mirrors the prefix reuse rule from
+    ColorDjangoTestSuiteRunner.wrap_tests and, given the size of the
+    snapshot cache and the prefixes it keeps, its LRU eviction (the row
+    limit is not known beforehand).
+    """
+    plan = FixturePlan()
+    targets = set([normalize_fixtures(target) for target in targets])
+    cached = []
+    current = ()
+    for fixtures in fixture_lists:
+        fixtures = normalize_fixtures(fixtures)
+        if fixtures[:len(current)] == current:
+            loaded = current
+        else:
+            plan.flushes += 1
+            loaded = ()
+            for end in range(len(fixtures), 0, -1):
+                if fixtures[:end] in cached:
+                    loaded = fixtures[:end]
+                    cached.remove(loaded)
+                    cached.append(loaded)
+                    plan.restores += 1
+                    break
+        plan.fixtures_prevented += len(loaded)
+        loaddata = fixtures[len(loaded):]
+        if loaddata:
+            plan.fixtures += len(loaddata)
+            plan.sets += 1
+        for end in range(len(loaded) + 1, len(fixtures) + 1):
+            if snapshots and fixtures[:end] in targets and fixtures[:end] not in cached:
+                cached.append(fixtures[:end])
+                del cached[:-snapshots]
+        current = fixtures
+    return plan
+
+
+class FixtureTrie(object):
+    """
+    Prefix tree of fixture lists used to order TestCases.
+
+    Walking the trie depth first visits every test sharing a fixture prefix
+    in one go, so the runner only flushes when leaving a branch and only
+    reloads the fixtures that are not already part of the loaded prefix.
+    ``snapshots`` is the size of the runner's snapshot cache.
+    """
+
+    def __init__(self, tests=(), snapshots=0):
+        self.root = _FixtureNode(())
+        self.snapshots = snapshots
+        self.count = 0
+        for test in tests:
+            self.add(test)
+
+    def add(self, test):
+        node = self.root
+        for fixture in normalize_fixtures(getattr(test, 'fixtures', None)):
+            node = node.child(fixture)
+        node.tests.append(test)
+        self.count += 1
+
+    def nodes(self):
+        return self.root.walk()
+
+    def groups(self):
+        """yields (fixtures, tests) pairs in loading order"""
+        for node in self.nodes():
+            yield node.prefix, list(node.tests)
+
+    def tests(self):
+        ordered = []
+        for fixtures, tests in self.groups():
+            ordered.extend(tests)
+        return ordered
+
+    def segments(self):
+        """
+        splits ordered tests into lists that run without a flush in between.
+        Each of them starts from an empty database.
+        """
+        segments = []
+        current = None
+        for fixtures, tests in self.groups():
+            if current is None or fixtures[:len(current)] != current:
+                segments.append([])
+            segments[-1].extend(tests)
+            current = fixtures
+        return segments
+
+    def branch_prefixes(self):
+        """
+        returns fixture prefixes the runner returns to after a flush - the
+        ones shared by more than one branch of the trie
+        """
+        prefixes = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.prefix and len(node.children) > 1:
+                prefixes.add(node.prefix)
+            stack.extend(node.children.values())
+        return prefixes
+
+    def plan(self):
+        fixture_lists = []
+        for fixtures, tests in self.groups():
+            fixture_lists.extend([fixtures] * len(tests))
+        return simulate(fixture_lists, self.snapshots, self.branch_prefixes())
+
+    def __len__(self):
+        return self.count
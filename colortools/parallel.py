@@ -0,0 +1,403 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+import sys
+import shutil
+import time
+import threading
+import Queue
+
+from django.db import connections
+from django.utils import unittest
+
+from colortools.snapshots import dump_tables, restore_tables
+
+
+def _in_memory(connection):
+    return (connection.vendor == 'sqlite' and
+            connection.settings_dict['NAME'] in ('', ':memory:'))
+
+
+def for_each_database(function, databases, thread_setup=()):
+    """
+    calls function for every database alias. Aliases of independent
+    databases are processed concurrently, each in its own thread with its own
+    connection. In memory SQLite databases exist only in connections of this
+    thread so they are processed here. Every thread calls ``thread_setup``
+    callables first - connections are thread locals, so whatever was set on
+    them here has to be set there again.
+    """
+    local = []
+    shared = {}
+    for db in databases:
+        connection = connections[db]
+        if _in_memory(connection):
+            local.append(db)
+            continue
+        settings_dict = connection.settings_dict
+        key = (connection.vendor, settings_dict['HOST'], settings_dict['PORT'],
+               settings_dict['NAME'])
+        shared.setdefault(key, []).append(db)
+
+    groups = sorted(shared.values())
+    if len(groups) < 2:
+        local = list(databases)
+        groups = []
+
+    errors = []
+
+    def process(aliases):
+        try:
+            for setup in thread_setup:
+                setup()
+            for db in aliases:
+                try:
+                    function(db)
+                finally:
+                    connections[db].close()
+        except:
+            errors.append(sys.exc_info())
+
+    threads = []
+    for aliases in groups:
+        for db in aliases:
+            # don't let open transactions of this thread block the others
+            connections[db].close()
+        thread = threading.Thread(target=process, args=(aliases,))
+        thread.start()
+        threads.append(thread)
+    for db in local:
+        function(db)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def worker_database_name(name, number):
+    return '%s_%d' % (name, number)
+
+
+def clone_test_databases(workers):
+    """
+    clones current test databases for every worker. In memory SQLite
+    databases are shared by forking and backends without a cheap copy
+    are created by the workers themselves. Returns a list of (alias, name)
+    clones to remove afterwards.
+    """
+    clones = []
+    names = set()
+    for alias in connections:
+        connection = connections[alias]
+        name = connection.settings_dict['NAME']
+        connection.close()
+        if _in_memory(connection) or name in names:
+            continue
+        names.add(name)
+        for number in range(1, workers + 1):
+            clone = worker_database_name(name, number)
+            if connection.vendor == 'sqlite':
+                shutil.copyfile(name, clone)
+            elif connection.vendor == 'postgresql':
+                _clone_postgresql(connection, name, clone)
+            else:
+                continue
+            clones.append((alias, clone))
+    return clones
+
+
+def _close_connections(names):
+    """closes connections of all aliases (mirrors too) using given databases"""
+    for alias in connections:
+        if connections[alias].settings_dict['NAME'] in names:
+            connections[alias].close()
+
+
+def _clone_postgresql(connection, name, clone):
+    # neither the template nor the dropped clone can be in use
+    _close_connections((name, clone))
+    # connect to the maintenance database
+    current = connection.settings_dict['NAME']
+    connection.settings_dict['NAME'] = 'postgres'
+    try:
+        cursor = connection.cursor()
+        connection.creation.set_autocommit()
+        qn = connection.ops.quote_name
+        cursor.execute('DROP DATABASE IF EXISTS %s' % qn(clone))
+        cursor.execute('CREATE DATABASE %s TEMPLATE %s' % (qn(clone), qn(name)))
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = current
+
+
+def destroy_test_database_clones(clones):
+    for alias, clone in clones:
+        connection = connections[alias]
+        if connection.vendor == 'sqlite':
+            if os.path.exists(clone):
+                os.remove(clone)
+        else:
+            connection.creation._destroy_test_db(clone, verbosity=0)
+
+
+def setup_worker_databases(number):
+    """
+    points connections of a forked worker to its own database clone.
+    Returns aliases and old names of databases created by the worker.
+    """
+    created = []
+    for alias in connections:
+        connection = connections[alias]
+        if _in_memory(connection):
+            continue
+        # parent's connection was closed before forking
+        connection.connection = None
+        name = connection.settings_dict['NAME']
+        clone = worker_database_name(name, number)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            connection.settings_dict['NAME'] = clone
+        else:
+            connection.settings_dict['TEST_NAME'] = clone
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            created.append((alias, name))
+    return created
+
+
+class DatabaseTemplate(object):
+    """
+    Copy of a test database used to bring it back to the state it had when
+    the copy was taken. SQLite files are copied, PostgreSQL databases are
+    cloned with CREATE DATABASE ... TEMPLATE and other databases keep a dump
+    of their tables. Restoring works on whatever database the connection
+    points to - a clone of a parallel worker as well.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.name = None
+        self.tables = None
+        connection = connections[db]
+        name = connection.settings_dict['NAME']
+        connection.close()
+        if connection.vendor == 'sqlite' and not _in_memory(connection):
+            self.name = '%s_template' % name
+            shutil.copyfile(name, self.name)
+        elif connection.vendor == 'postgresql':
+            self.name = '%s_template' % name
+            _clone_postgresql(connection, name, self.name)
+        else:
+            self.tables = dump_tables(db)
+
+    def restore(self):
+        connection = connections[self.db]
+        if self.tables is not None:
+            return restore_tables(self.db, self.tables)
+        connection.close()
+        name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            shutil.copyfile(self.name, name)
+        else:
+            _clone_postgresql(connection, self.name, name)
+
+    def destroy(self):
+        if self.name is None:
+            return
+        connection = connections[self.db]
+        if connection.vendor == 'sqlite':
+            if os.path.exists(self.name):
+                os.remove(self.name)
+        else:
+            connection.creation._destroy_test_db(self.name, verbosity=0)
+
+
+class _WorkerResult(unittest.TestResult):
+    """Test result of a worker process - sends every event to the parent"""
+
+    def __init__(self, events, group, tests, listeners=(), failfast=False):
+        super(_WorkerResult, self).__init__()
+        self.failfast = failfast
+        self.events = events
+        self.group = group
+        self.listeners = listeners
+        self.positions = dict([(id(test), position)
+                               for position, test in enumerate(tests)])
+
+    def _send(self, event, test, *args):
+        self.events.put((event, self.group,
+                         self.positions.get(id(test)), args))
+
+    def _notify(self, event, test):
+        for listener in self.listeners:
+            method = getattr(listener, event, None)
+            if method is not None:
+                method(test)
+
+    def startTest(self, test):
+        super(_WorkerResult, self).startTest(test)
+        self._started = time.time()
+        self._notify('startTest', test)
+        self._send('startTest', test)
+
+    def stopTest(self, test):
+        super(_WorkerResult, self).stopTest(test)
+        self._notify('stopTest', test)
+        self._send('addDuration', test, time.time() - self._started)
+        self._send('stopTest', test)
+
+    def addSuccess(self, test):
+        for listener in self.listeners:
+            message = getattr(listener, 'verify', None) and listener.verify(test)
+            if message:
+                return self._send('addFailure', test, message)
+        self._send('addSuccess', test)
+
+    def addError(self, test, err):
+        self._send('addError', test, self._exc_info_to_string(err, test))
+        if self.failfast:
+            self.stop()
+
+    def addFailure(self, test, err):
+        self._send('addFailure', test, self._exc_info_to_string(err, test))
+        if self.failfast:
+            self.stop()
+
+    def addSkip(self, test, reason):
+        self._send('addSkip', test, reason)
+
+    def addExpectedFailure(self, test, err):
+        self._send('addExpectedFailure', test,
+                   self._exc_info_to_string(err, test))
+
+    def addUnexpectedSuccess(self, test):
+        self._send('addUnexpectedSuccess', test)
+
+
+class ParallelSuite(object):
+    """
+    Runs groups of tests in forked worker processes.
+
+    A group is a list of tests that share fixtures so fixture loading is
+    still optimized inside of a worker. Results of all workers are replayed
+    on the result object the suite is called with. Tests a worker didn't
+    report because it died (or no worker was left to run them) are reported
+    as errors.
+    """
+
+    def __init__(self, runner, groups, workers):
+        self.runner = runner
+        self.groups = groups
+        self.workers = min(workers, len(groups))
+        self.failfast = False
+
+    def countTestCases(self):
+        return sum([len(group) for group in self.groups])
+
+    def __call__(self, result):
+        return self.run(result)
+
+    def run(self, result):
+        import multiprocessing
+
+        # workers are forked with it
+        self.failfast = getattr(result, 'failfast', False)
+        tasks = multiprocessing.Queue()
+        events = multiprocessing.Queue()
+        for index in range(len(self.groups)):
+            tasks.put(index)
+        for number in range(self.workers):
+            tasks.put(None)
+
+        clones = clone_test_databases(self.workers)
+        processes = []
+        try:
+            for number in range(1, self.workers + 1):
+                process = multiprocessing.Process(target=self._worker,
+                                                  args=(number, tasks, events))
+                process.start()
+                processes.append(process)
+            self._collect(result, events, processes)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            destroy_test_database_clones(clones)
+        if not result.shouldStop:
+            self._report_lost(result, processes)
+        return result
+
+    def _collect(self, result, events, processes):
+        self.taken = {}
+        self.started = set()
+        self.stopped = set()
+        running = len(processes)
+        while running:
+            try:
+                event, group, position, args = events.get(timeout=1)
+            except Queue.Empty:
+                if not [p for p in processes if p.is_alive()]:
+                    break
+                continue
+
+            if event == 'done':
+                running -= 1
+                self.runner.merge_fixture_statistics(args[0])
+                continue
+            if event == 'group':
+                self.taken[group] = args[0]
+                continue
+
+            test = self.groups[group][position]
+            if event == 'startTest':
+                self.started.add((group, position))
+            elif event == 'stopTest':
+                self.stopped.add((group, position))
+            getattr(result, event)(test, *args)
+            if result.shouldStop:
+                break
+
+    def _report_lost(self, result, processes):
+        """reports tests without results as errors"""
+        for group, tests in enumerate(self.groups):
+            number = self.taken.get(group)
+            if number is None:
+                message = "No worker process was left to run this test"
+            else:
+                message = ("Worker process %s running this test exited with "
+                           "code %s" % (number, processes[number - 1].exitcode))
+            for position, test in enumerate(tests):
+                if (group, position) in self.stopped:
+                    continue
+                if (group, position) not in self.started:
+                    result.startTest(test)
+                result.addError(test, message)
+                result.stopTest(test)
+
+    def _worker(self, number, tasks, events):
+        created = setup_worker_databases(number)
+        for alias, name in created:
+            # databases created by the worker don't have global fixtures
+            template = self.runner.database_templates.get(alias)
+            if template is not None:
+                template.restore()
+            if self.runner.table_tracker is not None:
+                self.runner.table_tracker.invalidate(alias)
+        try:
+            for index in iter(tasks.get, None):
+                events.put(('group', index, None, (number,)))
+                group = self.groups[index]
+                result = _WorkerResult(events, index, group,
+                                       self.runner.test_listeners(),
+                                       self.failfast)
+                unittest.TestSuite(group)(result)
+                if result.shouldStop:
+                    break
+        finally:
+            self.runner.reset_fixture_layers()
+            for alias, name in created:
+                connections[alias].creation.destroy_test_db(name, verbosity=0)
+            events.put(('done', None, None,
+                        (self.runner.fixture_statistics(),)))
@@ -0,0 +1,131 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import time
+
+from django.utils import simplejson
+
+
+def _parent(path):
+    return '/' in path and path.rsplit('/', 1)[0] or None
+
+
+class PhaseTimer(object):
+    """
+    Wall time spent in phases of a test run.
+
+    Phases nest - a phase begun while another one runs is stored under its
+    path (``tests/fixture setup/flush``) and its time is a part of the
+    parent's time. Works as a test result listener timing test bodies too -
+    fixture setup and teardown run outside of startTest and stopTest.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self.order = []
+        self.processes = 1
+        self._stack = []
+
+    def begin(self, name):
+        self._stack.append((name, time.time()))
+
+    def end(self):
+        name, start = self._stack.pop()
+        path = '/'.join([parent for parent, started in self._stack] + [name])
+        self.add(path, time.time() - start)
+
+    def add(self, path, seconds, count=1):
+        if path not in self.seconds:
+            self.order.append(path)
+            self.seconds[path] = 0
+            self.counts[path] = 0
+        self.seconds[path] += seconds
+        self.counts[path] += count
+
+    def startTest(self, test):
+        self.begin('test bodies')
+
+    def stopTest(self, test):
+        self.end()
+
+    def children(self, path=None):
+        return [child for child in self.order if _parent(child) == path]
+
+    def exclusive(self, path):
+        """time of a phase not spent in its subphases"""
+        return self.seconds[path] - sum([self.seconds[child]
+                                         for child in self.children(path)])
+
+    def total(self):
+        return sum([self.seconds[path] for path in self.children()])
+
+    def statistics(self):
+        return {'seconds': self.seconds, 'counts': self.counts,
+                'order': self.order}
+
+    def merge(self, statistics):
+        """
+        adds phases of a parallel worker. Only phases inside of the phase
+        running here are taken - the worker inherited the rest when forked.
+        """
+        prefix = '/'.join([name for name, started in self._stack])
+        for path in statistics['order']:
+            if not prefix or path.startswith(prefix + '/'):
+                self.add(path, statistics['seconds'][path],
+                         statistics['counts'][path])
+        self.processes += 1
+
+    def write(self, stream):
+        """writes report to a stream decorated with _ColorDecorator"""
+        total = self.total()
+        exclusive = dict([(path, self.exclusive(path)) for path in self.order])
+        slowest = exclusive and max(exclusive.items(), key=lambda item: item[1])[0]
+
+        stream.writeln()
+        if self.processes > 1:
+            stream.writeln("Phases (%.3fs, tests summed over %s processes):" % (
+                            total, self.processes))
+        else:
+            stream.writeln("Phases (%.3fs):" % total)
+
+        def write(name, seconds, depth, color):
+            share = total and seconds * 100.0 / total or 0
+            stream.color(color)
+            stream.write("    %9.3fs %5.1f%%" % (seconds, share))
+            stream.colorClear()
+            stream.writeln(" %s%s" % ('    ' * depth, name))
+
+        def write_tree(path, depth):
+            # the phase to attack first is the one with most time of its own
+            children = self.children(path)
+            write(path.rsplit('/', 1)[-1], self.seconds[path], depth,
+                  path == slowest and not children and 'FAIL' or 'SLOW')
+            for child in children:
+                write_tree(child, depth + 1)
+            if children and exclusive[path] >= 0.0005:
+                write('other', exclusive[path], depth + 1,
+                      path == slowest and 'FAIL' or 'SLOW')
+
+        for path in self.children():
+            write_tree(path, 0)
+        stream.writeln()
+
+    def export(self, path):
+        """writes phases with their total and exclusive times to a JSON file"""
+        data = {
+            'total': self.total(),
+            'processes': self.processes,
+            'phases': [{'phase': phase,
+                        'seconds': self.seconds[phase],
+                        'exclusive': self.exclusive(phase),
+                        'count': self.counts[phase]}
+                       for phase in self.order],
+        }
+        stream = open(path, 'w')
+        try:
+            simplejson.dump(data, stream, indent=2)
+        finally:
+            stream.close()
@@ -0,0 +1,204 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+import time
+import cProfile
+import pstats
+
+import unipath
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_app
+from django.utils import termcolors
+
+
+class ColorStats(pstats.Stats):
+    def __init__(self, *args, **kwargs):
+        pstats.Stats.__init__(self, *args, **kwargs)
+
+        class dummy(object): pass
+        style = dummy()
+        style.LONGRUN = termcolors.make_style(opts=('bold',), fg='red')
+        style.NAME = termcolors.make_style(opts=('bold',), fg='cyan')
+        style.FILE = termcolors.make_style(opts=('bold',), fg='yellow')
+        style.APP = termcolors.make_style(opts=('bold',), fg='white')
+        self.style = style
+
+    def print_title(self):
+        print >> self.stream, 'calls  cumtime  percall',
+        print >> self.stream, 'filename:lineno(function)'
+
+    def print_line(self, func):  # hack : should print percentages
+        cc, nc, tt, ct, callers = self.stats[func] #@UnusedVariable
+        c = str(nc)
+        if nc != cc:
+            c = c + '/' + str(cc)
+        print >> self.stream, c.rjust(5),
+        print >> self.stream, pstats.f8(ct),
+        if cc == 0:
+            print >> self.stream, ' '*8,
+        else:
+            percall = float(ct) / cc
+            result = pstats.f8(percall)
+            if percall > 0.1:
+                result = self.style.LONGRUN(result)
+            print >> self.stream, result,
+        print >> self.stream, self.func_std_string(func)
+
+    def func_std_string(self, func_name): # match what old profile produced
+        if func_name[:2] == ('~', 0):
+            # special case for built-in functions
+            name = func_name[2]
+            if name.startswith('<') and name.endswith('>'):
+                return '{%s}' % name[1:-1]
+            else:
+                return name
+        else:
+            file, line, name = func_name
+            file = unipath.Path(file)
+            return ("%s (%s:%d [%s])" %
+                (self.style.NAME(name),
+                 self.style.FILE(file.name), line,
+                 self.style.APP(file.parent.parent.name)))
+
+
+def matches_label(test, label):
+    """
+    checks if a test is selected by a test label in the form used by the test
+    command: app, app.TestClass or app.TestClass.test_method. Tests of an app
+    are the ones defined in the package of its models module.
+    """
+    parts = label.split('.')
+    try:
+        package = get_app(parts[0]).__name__.rsplit('.', 1)[0]
+    except ImproperlyConfigured:
+        return False
+    module = test.__class__.__module__
+    if module != package and not module.startswith(package + '.'):
+        return False
+    if len(parts) > 1 and parts[1] != test.__class__.__name__:
+        return False
+    if len(parts) > 2 and parts[2] != getattr(test, '_testMethodName', None):
+        return False
+    return True
+
+
+class TestProfiler(object):
+    """
+    Profiles every selected test on its own.
+
+    ``scope`` decides what is profiled - only the test method (``test``),
+    the method with setUp and tearDown (``setup``) or everything including
+    fixture loading (``fixtures``). Profiles of tests running at least
+    ``threshold`` seconds are written to separate pstats files, all of them
+    are merged into one summary. ``profile_factory`` creates profiles -
+    cProfile.Profile or a SamplingProfile that also writes collapsed stacks
+    for flame graphs.
+    """
+
+    def __init__(self, directory, scope='test', threshold=0, profile_factory=None):
+        self.directory = directory
+        self.scope = scope
+        self.threshold = threshold
+        self.profile_factory = profile_factory or cProfile.Profile
+        self.merged = None
+        self.collapsed = None
+        self.files = []
+        self.profiled = 0
+        self._profile = None
+        self._started = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def install(self, tests, selected=None):
+        """
+        wraps given tests. When a list of test ids is given only those tests
+        are profiled.
+        """
+        for test in tests:
+            if selected is None or test.id() in selected:
+                self.wrap(test)
+
+    def wrap(self, test):
+        if self.scope == 'fixtures' and hasattr(test, '_pre_setup'):
+            self._wrap_around(test, '_pre_setup', '_post_teardown')
+        elif self.scope in ('setup', 'fixtures'):
+            self._wrap_around(test, 'run', 'run')
+        else:
+            name = getattr(test, '_testMethodName', 'runTest')
+            self._wrap_around(test, name, name)
+
+    def _wrap_around(self, test, first, last):
+        start_method = getattr(test, first)
+        stop_method = getattr(test, last)
+        profiler = self
+
+        def start(*args, **kwargs):
+            profiler.start()
+            try:
+                result = start_method(*args, **kwargs)
+            except:
+                profiler.stop(test)
+                raise
+            if first == last:
+                profiler.stop(test)
+            return result
+
+        def stop(*args, **kwargs):
+            try:
+                return stop_method(*args, **kwargs)
+            finally:
+                profiler.stop(test)
+
+        setattr(test, first, start)
+        if first != last:
+            setattr(test, last, stop)
+
+    def start(self):
+        self._profile = self.profile_factory()
+        self._started = time.time()
+        self._profile.enable()
+
+    def stop(self, test):
+        if self._profile is None:
+            return
+        self._profile.disable()
+        elapsed = time.time() - self._started
+        profile, self._profile = self._profile, None
+        self.add(test, profile, elapsed)
+
+    def add(self, test, profile, elapsed):
+        profile.create_stats()
+        self.profiled += 1
+        if not profile.stats:
+            # sampling profile of a test shorter than the sampling interval
+            return
+        if elapsed >= self.threshold:
+            path = os.path.join(self.directory, '%s.pstats' % test.id())
+            profile.dump_stats(path)
+            self.files.append((elapsed, path))
+            if hasattr(profile, 'dump_collapsed'):
+                profile.dump_collapsed(os.path.join(self.directory,
+                                                    '%s.collapsed' % test.id()))
+        if self.merged is None:
+            self.merged = pstats.Stats(profile)
+        else:
+            self.merged.add(profile)
+        if hasattr(profile, 'dump_collapsed'):
+            if self.collapsed is None:
+                self.collapsed = profile
+            else:
+                self.collapsed.merge(profile)
+
+    def dump_merged(self):
+        """writes merged stats and returns their path"""
+        if self.merged is None:
+            return None
+        path = os.path.join(self.directory, 'merged.pstats')
+        self.merged.dump_stats(path)
+        if self.collapsed is not None:
+            self.collapsed.dump_collapsed(os.path.join(self.directory,
+                                                       'merged.collapsed'))
+        return path
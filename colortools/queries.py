@@ -0,0 +1,187 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import threading
+from time import time
+
+from django.db import connections
+from django.db.backends import util
+
+
+class _QueryCursor(util.CursorWrapper):
+    """Cursor wrapper reporting every executed query to a QueryLog"""
+
+    def __init__(self, cursor, db, log):
+        super(_QueryCursor, self).__init__(cursor, db)
+        self.log = log
+
+    def execute(self, sql, params=()):
+        start = time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.log.record(sql, time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.log.record(sql, time() - start)
+
+
+class QueryStats(object):
+    """Number and time of queries - per SQL statement with placeholders"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+
+    def add(self, sql, seconds):
+        self.count += 1
+        self.time += seconds
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.time += other.time
+        for sql, count in other.statements.items():
+            self.statements[sql] = self.statements.get(sql, 0) + count
+
+    def repeated(self, threshold):
+        """statements executed at least threshold times - N+1 candidates"""
+        return sorted([(count, sql) for sql, count in self.statements.items()
+                       if count >= threshold], reverse=True)
+
+
+def query_limit(test):
+    """
+    returns the maximum number of queries of a test from its ``max_queries``
+    attribute - a number or a dict of test method names and numbers
+    """
+    limit = getattr(test, 'max_queries', None)
+    if isinstance(limit, dict):
+        limit = limit.get(getattr(test, '_testMethodName', None))
+    return limit
+
+
+class QueryLog(object):
+    """
+    Counts queries of every test and every fixture setup.
+
+    Installed on all connections through their debug cursor hook, without
+    collecting ``connection.queries`` - threads loading databases
+    concurrently call setup_thread. Works as a test result listener: queries
+    between startTest and stopTest belong to the test.
+    """
+
+    def __init__(self, repeated=5, max_queries=None):
+        self.repeated = repeated
+        self.max_queries = max_queries
+        self.tests = {}
+        self.fixtures = {}
+        self.current = None
+        self.installed = False
+        self._lock = threading.Lock()
+
+    def install(self):
+        self.installed = True
+        for alias in connections:
+            connection = connections[alias]
+            connection.use_debug_cursor = True
+            connection.make_debug_cursor = (lambda cursor, connection=connection:
+                                            _QueryCursor(cursor, connection, self))
+
+    def setup_thread(self):
+        """installs the log on connections of another thread"""
+        if self.installed:
+            self.install()
+
+    def uninstall(self):
+        self.installed = False
+        for alias in connections:
+            connection = connections[alias]
+            connection.use_debug_cursor = None
+            if 'make_debug_cursor' in connection.__dict__:
+                del connection.make_debug_cursor
+
+    def record(self, sql, seconds):
+        current = self.current
+        if current is not None:
+            self._lock.acquire()
+            try:
+                current.add(sql, seconds)
+            finally:
+                self._lock.release()
+
+    def begin(self, bucket, key):
+        self.current = bucket.setdefault(key, QueryStats())
+
+    def end(self):
+        self.current = None
+
+    def startTest(self, test):
+        self.begin(self.tests, test.id())
+
+    def stopTest(self, test):
+        self.end()
+
+    def verify(self, test):
+        """returns failure message when a test exceeded its query limit"""
+        limit = query_limit(test)
+        if limit is None:
+            limit = self.max_queries
+        stats = self.tests.get(test.id())
+        if limit is None or stats is None or stats.count <= limit:
+            return None
+        return "QueryLimitExceeded: %s executed %d queries, limit is %d" % (
+                test.id(), stats.count, limit)
+
+    def statistics(self):
+        return {'tests': self.tests, 'fixtures': self.fixtures}
+
+    def merge(self, statistics):
+        for name in ('tests', 'fixtures'):
+            bucket = getattr(self, name)
+            for key, stats in statistics[name].items():
+                bucket.setdefault(key, QueryStats()).merge(stats)
+
+    def write(self, stream, count=10):
+        """writes report to a stream decorated with _ColorDecorator"""
+        tests = sorted(self.tests.items(), key=lambda item: -item[1].count)
+        fixtures = sorted(self.fixtures.items(), key=lambda item: -item[1].count)
+
+        stream.writeln()
+        stream.writeln("Queries (%d in tests, %d in fixture setup):" % (
+                        sum([s.count for k, s in tests]),
+                        sum([s.count for k, s in fixtures])))
+        for test_id, stats in tests[:count]:
+            stream.color('SLOW')
+            stream.write("    %6d %8.3fs" % (stats.count, stats.time))
+            stream.colorClear()
+            stream.writeln(" %s" % test_id)
+
+        if fixtures:
+            stream.writeln("Fixture setup queries:")
+            for key, stats in fixtures[:count]:
+                stream.color('SLOW')
+                stream.write("    %6d %8.3fs" % (stats.count, stats.time))
+                stream.colorClear()
+                stream.writeln(" %s" % list(key))
+
+        repeated = []
+        for test_id, stats in tests:
+            for times, sql in stats.repeated(self.repeated):
+                repeated.append((times, test_id, sql))
+        if repeated:
+            stream.writeln("Repeated queries:")
+            for times, test_id, sql in sorted(repeated, reverse=True)[:count]:
+                stream.color('FAIL')
+                stream.write("    %6dx" % times)
+                stream.colorClear()
+                stream.writeln(" %s" % test_id)
+                stream.writeln("            %s" % sql[:200])
+        stream.writeln()
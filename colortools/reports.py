@@ -0,0 +1,207 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import re
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+from django.utils import simplejson
+
+from colortools.durations import test_class_name
+
+BUFFER_SIZE = 64 * 1024
+
+# characters not allowed in XML 1.0 documents
+_INVALID_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# status of a test with several outcomes is the first of them here
+_SEVERITY = ('error', 'failure', 'unexpected_success', 'expected_failure',
+             'skip', 'success')
+
+
+class _ResultWriter(object):
+    """
+    Test result listener writing a record for every finished test.
+
+    All outcomes of a test are kept - a failed test may error in tearDown
+    too. Errors reported outside of startTest and stopTest - of fixture setup
+    (``_pre_setup``), of ``_post_teardown`` after stopTest or of setUpClass -
+    get a record of their own, a test may have two records then.
+
+    Output is buffered and flushed at most every ``flush_interval`` seconds
+    so the file can be followed while tests are running.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stream = open(path, 'w', BUFFER_SIZE)
+        self._flushed = time.time()
+        self._running = False
+        self._reset()
+
+    def _reset(self):
+        self.outcomes = []
+        self.duration = None
+
+    @property
+    def status(self):
+        return self._outcome()[0]
+
+    @property
+    def details(self):
+        return self._outcome()[1]
+
+    def _outcome(self):
+        """the most severe outcome - (status, traceback or reason)"""
+        if not self.outcomes:
+            return None, None
+        return min(self.outcomes, key=lambda outcome: _SEVERITY.index(outcome[0]))
+
+    def _add(self, test, status, details=None):
+        self.outcomes.append((status, details))
+        if not self._running:
+            self._write(test)
+
+    def startTest(self, test):
+        self._reset()
+        self._running = True
+
+    def addDuration(self, test, seconds):
+        self.duration = seconds
+
+    def addSuccess(self, test):
+        self._add(test, 'success')
+
+    def addFailure(self, test, err):
+        self._add(test, 'failure', err)
+
+    def addError(self, test, err):
+        self._add(test, 'error', err)
+
+    def addSkip(self, test, reason):
+        self._add(test, 'skip', reason)
+
+    def addExpectedFailure(self, test, err):
+        self._add(test, 'expected_failure', err)
+
+    def addUnexpectedSuccess(self, test):
+        self._add(test, 'unexpected_success')
+
+    def stopTest(self, test):
+        self._running = False
+        self._write(test)
+
+    def _write(self, test):
+        self.write(test)
+        self._reset()
+        if time.time() - self._flushed >= self.flush_interval:
+            self.stream.flush()
+            self._flushed = time.time()
+
+    def write(self, test):
+        """writes a record of a test - nothing here, subclasses add formats"""
+
+    def close(self):
+        self.stream.close()
+
+
+class JSONLinesWriter(_ResultWriter):
+    """
+    Writes a JSON object per line for every finished test. Status, traceback
+    and reason are of its most severe outcome, ``outcomes`` lists all of them.
+    """
+
+    def write(self, test):
+        record = {
+            'id': test.id(),
+            'status': self.status,
+            'duration': self.duration,
+            'fixtures': list(getattr(test, 'fixtures', None) or []),
+            'traceback': None,
+            'reason': None,
+            'outcomes': [{'status': status, 'details': details}
+                         for status, details in self.outcomes],
+        }
+        if self.status == 'skip':
+            record['reason'] = self.details
+        else:
+            record['traceback'] = self.details
+        self.stream.write(simplejson.dumps(record))
+        self.stream.write('\n')
+
+
+def _text(value):
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    return _INVALID_XML.sub(u'?', value)
+
+
+def _xml(value):
+    return escape(_text(value)).encode('utf-8')
+
+
+def _attr(value):
+    return quoteattr(_text(value)).encode('utf-8')
+
+
+class JUnitXMLWriter(_ResultWriter):
+    """
+    Writes a JUnit XML report test by test. Totals are not known until the
+    end so the header holds fixed width placeholders which are overwritten
+    when the writer is closed. Every failure and error of a test is a child
+    of its testcase.
+    """
+
+    _WIDTH = 10
+    _TOTALS = ('tests', 'failures', 'errors', 'skipped')
+
+    def __init__(self, path, name='tests', flush_interval=1.0):
+        super(JUnitXMLWriter, self).__init__(path, flush_interval)
+        self.totals = dict([(total, 0) for total in self._TOTALS])
+        self.time = 0.0
+        self.stream.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self.stream.write('<testsuite name=%s' % _attr(name))
+        self._header = self.stream.tell()
+        self.stream.write(self._totals_attributes())
+        self.stream.write('>\n')
+
+    def _totals_attributes(self):
+        attributes = ['%s="%0*d"' % (total, self._WIDTH, self.totals[total])
+                      for total in self._TOTALS]
+        attributes.append('time="%0*.3f"' % (self._WIDTH + 4, self.time))
+        return ' ' + ' '.join(attributes)
+
+    def write(self, test):
+        duration = self.duration or 0.0
+        self.totals['tests'] += 1
+        self.time += duration
+        name = getattr(test, '_testMethodName', None) or test.id()
+        self.stream.write('  <testcase classname=%s name=%s time="%.3f"' % (
+                          _attr(test_class_name(test)), _attr(name), duration))
+        failed = [(status, details) for status, details in self.outcomes
+                  if status in ('failure', 'error')]
+        if failed:
+            self.stream.write('>\n')
+            for status in set([status for status, details in failed]):
+                self.totals[status + 's'] += 1
+            for status, details in failed:
+                message = (details or '').strip().splitlines()
+                self.stream.write('    <%s message=%s>%s</%s>\n' % (
+                                  status, _attr(message and message[-1] or ''),
+                                  _xml(details or ''), status))
+            self.stream.write('  </testcase>\n')
+        elif self.status == 'skip':
+            self.totals['skipped'] += 1
+            self.stream.write('>\n    <skipped message=%s/>\n  </testcase>\n' % (
+                              _attr(self.details or '')))
+        else:
+            self.stream.write('/>\n')
+
+    def close(self):
+        self.stream.write('</testsuite>\n')
+        self.stream.seek(self._header)
+        self.stream.write(self._totals_attributes())
+        super(JUnitXMLWriter, self).close()
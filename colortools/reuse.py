@@ -0,0 +1,119 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+
+import django
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import get_apps, get_models
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+from colortools.loader import fixture_dirs
+
+
+def _model_definition(model, connection):
+    opts = model._meta
+    fields = []
+    for field in opts.local_fields + opts.local_many_to_many:
+        rel = getattr(field, 'rel', None)
+        fields.append((field.name, field.column, field.db_type(connection=connection),
+                       field.null, field.unique, field.db_index,
+                       rel and rel.to._meta.db_table or None))
+    return (opts.app_label, opts.object_name, opts.db_table, fields)
+
+
+def _data_files():
+    """files with fixtures and custom SQL of installed apps"""
+    dirs = [path for path in fixture_dirs() if path]
+    for app in get_apps():
+        dirs.append(os.path.join(os.path.dirname(app.__file__), 'sql'))
+    files = []
+    for directory in dirs:
+        if os.path.isdir(directory):
+            files.extend([os.path.join(directory, name)
+                          for name in sorted(os.listdir(directory))])
+    return [path for path in files if os.path.isfile(path)]
+
+
+def schema_fingerprint(db):
+    """
+    returns a digest of everything a new test database is built from: models
+    synced to the database, fixtures, custom SQL and global fixtures
+    """
+    connection = connections[db]
+    digest = md5_constructor()
+    digest.update(repr((django.VERSION, connection.vendor,
+                        list(getattr(settings, 'TEST_GLOBAL_FIXTURES', [])))))
+    for model in get_models(include_auto_created=True):
+        if router.allow_syncdb(db, model):
+            digest.update(repr(_model_definition(model, connection)))
+    for path in _data_files():
+        stream = open(path, 'rb')
+        try:
+            digest.update(path)
+            digest.update(stream.read())
+        finally:
+            stream.close()
+    return digest.hexdigest()
+
+
+def reuse_test_db(connection):
+    """
+    points connection to its existing test database. Returns the name of the
+    database or None if it doesn't exist.
+    """
+    name = connection.creation._get_test_db_name()
+    old_name = connection.settings_dict['NAME']
+    connection.close()
+    if connection.vendor == 'sqlite' and not os.path.exists(name):
+        return None
+    connection.settings_dict['NAME'] = name
+    try:
+        connection.cursor()
+    except Exception:
+        connection.close()
+        connection.settings_dict['NAME'] = old_name
+        return None
+    connection.features.confirm()
+    return name
+
+
+class DatabaseFingerprints(object):
+    """
+    Schema fingerprints of test databases kept between runs in a JSON file.
+    A fingerprint is stored only after the database was cleaned up at the
+    end of a run, so interrupted runs leave nothing to reuse.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        if os.path.exists(path):
+            stream = open(path, 'r')
+            try:
+                try:
+                    self.fingerprints = simplejson.load(stream)
+                except ValueError:
+                    self.fingerprints = {}
+            finally:
+                stream.close()
+
+    def get(self, name):
+        return self.fingerprints.get(name)
+
+    def set(self, name, fingerprint):
+        self.fingerprints[name] = fingerprint
+
+    def discard(self, name):
+        self.fingerprints.pop(name, None)
+
+    def save(self):
+        stream = open(self.path, 'w')
+        try:
+            simplejson.dump(self.fingerprints, stream)
+        finally:
+            stream.close()
@@ -0,0 +1,138 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import sys
+import time
+import marshal
+import signal
+import threading
+
+
+def _frame_stack(frame):
+    """returns (filename, firstlineno, name) tuples from outermost frame"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class SamplingProfile(object):
+    """
+    Statistical profiler with the interface of cProfile.Profile.
+
+    Stack of the profiled thread is sampled every ``interval`` seconds either
+    from a SIGPROF handler (``signal`` - measures CPU time of the process) or
+    from a background thread (``thread`` - measures wall clock time, including
+    time spent waiting for the database). Stats written by dump_stats can be
+    read by pstats - call counts are replaced with numbers of samples.
+    """
+
+    def __init__(self, interval=0.005, mode='thread'):
+        self.interval = interval
+        self.mode = mode
+        self.stacks = {}
+        self.samples = 0
+        self.stats = {}
+        self._thread = None
+        self._running = False
+        self._thread_id = None
+
+    def _sample(self, frame):
+        stack = _frame_stack(frame)
+        if stack:
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def _signal_handler(self, signum, frame):
+        self._sample(frame)
+
+    def _thread_loop(self):
+        while self._running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None and self._running:
+                self._sample(frame)
+
+    def enable(self):
+        self._running = True
+        if self.mode == 'signal':
+            self._old_handler = signal.signal(signal.SIGPROF, self._signal_handler)
+            # don't interrupt system calls of profiled code
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._thread_id = threading.currentThread().ident
+            self._thread = threading.Thread(target=self._thread_loop)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def disable(self):
+        self._running = False
+        if self.mode == 'signal':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._old_handler)
+        elif self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def runcall(self, func, *args, **kwargs):
+        self.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.disable()
+
+    def merge(self, other):
+        for stack, count in other.stacks.items():
+            self.stacks[stack] = self.stacks.get(stack, 0) + count
+        self.samples += other.samples
+
+    def create_stats(self):
+        """builds pstats compatible stats out of collected samples"""
+        stats = {}
+        interval = self.interval
+        for stack, count in self.stacks.items():
+            seen = set()
+            for position, func in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                if position == len(stack) - 1:
+                    tt += count * interval
+                if func not in seen:
+                    seen.add(func)
+                    cc += count
+                    nc += count
+                    ct += count * interval
+                if position:
+                    caller = stack[position - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + count, c_nc + count,
+                                       c_tt, c_ct + count * interval)
+                stats[func] = (cc, nc, tt, ct, callers)
+        self.stats = stats
+
+    def dump_stats(self, path):
+        self.create_stats()
+        stream = open(path, 'wb')
+        try:
+            marshal.dump(self.stats, stream)
+        finally:
+            stream.close()
+
+    def dump_collapsed(self, path):
+        """
+        writes stacks in the collapsed format used by flamegraph.pl:
+        ``frame;frame;frame count`` per line
+        """
+        stream = open(path, 'w')
+        try:
+            for stack, count in sorted(self.stacks.items()):
+                stream.write('%s %d\n' % (';'.join(['%s (%s:%d)' % (name, filename, line)
+                                                    for filename, line, name in stack]),
+                                          count))
+        finally:
+            stream.close()
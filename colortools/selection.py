@@ -0,0 +1,223 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+import sys
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import get_apps
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+from colortools.reuse import schema_fingerprint
+
+VERSION = 1
+
+
+def file_digest(path):
+    stream = open(path, 'rb')
+    try:
+        return md5_constructor(stream.read()).hexdigest()
+    finally:
+        stream.close()
+
+
+def data_files(root):
+    """
+    files other than Python sources in directories of apps under ``root``
+    and in TEMPLATE_DIRS - templates, static and other data tests may read
+    """
+    root = os.path.abspath(root) + os.sep
+    dirs = [os.path.abspath(os.path.dirname(app.__file__)) for app in get_apps()]
+    dirs = [path for path in dirs if (path + os.sep).startswith(root)]
+    dirs.extend(getattr(settings, 'TEMPLATE_DIRS', ()))
+    files = set()
+    for directory in dirs:
+        for path, names, filenames in os.walk(directory):
+            names[:] = [name for name in names if not name.startswith('.')]
+            files.update([os.path.join(path, name) for name in filenames
+                          if not name.startswith('.') and
+                          os.path.splitext(name)[1] not in ('.py', '.pyc', '.pyo')])
+    return sorted(files)
+
+
+def suite_fingerprint(root=None):
+    """
+    returns a digest of what every test depends on without executing it -
+    database schemas, fixtures, the settings module and data files of apps
+    under ``root``
+    """
+    digest = md5_constructor()
+    for db in sorted(connections):
+        digest.update(schema_fingerprint(db))
+    if root is not None:
+        for path in data_files(root):
+            digest.update(path)
+            digest.update(file_digest(path))
+    module = sys.modules.get(getattr(settings, 'SETTINGS_MODULE', None) or '')
+    path = getattr(module, '__file__', None)
+    if path:
+        path = path[:-1] if path.endswith('.pyc') else path
+        if os.path.exists(path):
+            digest.update(file_digest(path))
+    return digest.hexdigest()
+
+
+class CoverageMap(object):
+    """
+    Source files executed by every test, kept between runs in a JSON file.
+
+    Tests are traced from their fixture setup (``startSetup``) to stopTest
+    - function calls only, not lines - and files under ``root`` are
+    recorded. Module level code runs on import, before any test, so it is
+    never recorded. Files are stored once with their mtime and digest and
+    tests refer to them by position. The map is stale when ``fingerprint``
+    differs from the one it was saved with.
+    """
+
+    def __init__(self, path, root, fingerprint):
+        self.path = path
+        self.root = os.path.abspath(root) + os.sep
+        self.fingerprint = fingerprint
+        self.files = {}
+        self.tests = {}
+        self.failed = set()
+        self.recorded = {}
+        self.valid = False
+        self._previous = None
+        self._executed = None
+
+        if os.path.exists(path):
+            stream = open(path, 'r')
+            try:
+                try:
+                    data = simplejson.load(stream)
+                except ValueError:
+                    data = {}
+            finally:
+                stream.close()
+            if (data.get('version') == VERSION
+                    and data.get('fingerprint') == fingerprint):
+                self.valid = True
+                files = data['files']
+                self.files = dict([(path, (mtime, digest))
+                                   for path, mtime, digest in files])
+                self.tests = dict([(test_id, set([files[i][0] for i in indexes]))
+                                   for test_id, indexes in data['tests'].items()])
+                self.failed = set(data['failed'])
+
+    def _trace(self, frame, event, arg):
+        if event == 'call':
+            self._executed.add(frame.f_code.co_filename)
+        return None
+
+    def setup_thread(self):
+        """traces a thread loading fixtures into other databases"""
+        if self._executed is not None:
+            sys.settrace(self._trace)
+
+    def startSetup(self):
+        """starts tracing fixture setup of the next test"""
+        if self._executed is None:
+            self._previous = sys.gettrace()
+            sys.settrace(self._trace)
+        # whatever a failed setup executed is forgotten
+        self._executed = set()
+
+    def startTest(self, test):
+        if self._executed is None:
+            self.startSetup()
+
+    def stopTest(self, test):
+        executed = self._executed
+        self.stop()
+        self.recorded[test.id()] = self.source_files(executed)
+
+    def stop(self):
+        """stops tracing - also a setup that failed, so its test never started"""
+        if self._executed is not None:
+            sys.settrace(self._previous)
+            self._executed = None
+
+    def source_files(self, paths):
+        files = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            if (path.startswith(self.root) and path.endswith('.py')
+                    and 'site-packages' not in path):
+                files.add(path)
+        return files
+
+    def changed_files(self):
+        """files changed since they were stored - mtime first, then content"""
+        changed = set()
+        for path, (mtime, digest) in self.files.items():
+            if not os.path.exists(path):
+                changed.add(path)
+            elif (os.path.getmtime(path) != mtime
+                    and file_digest(path) != digest):
+                changed.add(path)
+        return changed
+
+    def affected(self, tests, changed):
+        """
+        returns tests that executed changed files, failed last time or are
+        not in the map yet
+        """
+        return [test for test in tests
+                if test.id() not in self.tests or test.id() in self.failed
+                or self.tests[test.id()] & changed]
+
+    def merge(self, recorded):
+        """adds files recorded by a parallel worker"""
+        self.recorded.update(recorded)
+
+    def save(self, failed=()):
+        """
+        stores recorded files and states of files. A changed file keeps its
+        old state until every test that executed it was run.
+        """
+        changed = self.changed_files()
+        pending = set()
+        for test_id, files in self.tests.items():
+            if test_id not in self.recorded:
+                pending.update(files & changed)
+        self.tests.update(self.recorded)
+        self.failed = (self.failed - set(self.recorded)) | set(failed)
+
+        paths = set()
+        for files in self.tests.values():
+            paths.update(files)
+        files = []
+        for path in sorted(paths):
+            if path in pending:
+                mtime, digest = self.files[path]
+            elif os.path.exists(path):
+                mtime, digest = os.path.getmtime(path), None
+                if path in self.files and self.files[path][0] == mtime:
+                    digest = self.files[path][1]
+                digest = digest or file_digest(path)
+            else:
+                continue
+            files.append((path, mtime, digest))
+        self.files = dict([(path, (mtime, digest)) for path, mtime, digest in files])
+
+        positions = dict([(file[0], i) for i, file in enumerate(files)])
+        data = {
+            'version': VERSION,
+            'fingerprint': self.fingerprint,
+            'files': files,
+            'tests': dict([(test_id, sorted([positions[path] for path in test_files
+                                             if path in positions]))
+                           for test_id, test_files in self.tests.items()]),
+            'failed': sorted(self.failed),
+        }
+        stream = open(self.path, 'w')
+        try:
+            simplejson.dump(data, stream, separators=(',', ':'))
+        finally:
+            stream.close()
+        self.valid = True
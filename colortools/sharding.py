@@ -0,0 +1,93 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+from colortools.durations import fixtures_key, median
+
+
+def parse_shard(value):
+    """returns (index, count) from 'i/N' - shards are numbered from 1"""
+    if isinstance(value, basestring):
+        try:
+            index, count = [int(part) for part in value.split('/')]
+        except ValueError:
+            raise ValueError("shard should look like 'i/N', not %r" % value)
+    else:
+        index, count = value
+    if not 1 <= index <= count:
+        raise ValueError("shard %s is not within 1..%s" % (index, count))
+    return index, count
+
+
+class ShardPlan(object):
+    """
+    Splits groups of tests between ``count`` shards balancing durations
+    predicted from history - medians of test durations and of the time spent
+    setting up their fixture sets. Groups are never split, so tests sharing
+    fixtures stay on the same shard. The split depends only on the groups and
+    the history, so nodes compute the same one only when they read the same
+    history. When ``fingerprint`` is given and the history doesn't match it
+    (or there is none) shards are balanced by test count instead.
+    """
+
+    def __init__(self, groups, count, history=None, default=1.0, fingerprint=None):
+        self.groups = groups
+        self.count = count
+        self.fingerprint = history is not None and history.fingerprint() or None
+        self.expected = fingerprint
+        if fingerprint is not None and self.fingerprint != fingerprint:
+            history = None
+        self.history = history
+        self.default = self._default_duration(default)
+        self.costs = [self.cost(group) for group in groups]
+
+        self.shards = [[] for shard in range(count)]
+        self.predicted = [0.0] * count
+        # longest groups first, each to the least loaded shard
+        order = sorted(range(len(groups)),
+                       key=lambda i: (-self.costs[i], groups[i][0].id()))
+        for i in order:
+            shard = self.predicted.index(min(self.predicted))
+            self.shards[shard].append(i)
+            self.predicted[shard] += self.costs[i]
+
+    def _default_duration(self, default):
+        """duration of tests without history - median of the known ones"""
+        if self.history is None:
+            return default
+        known = [self.history.median(test.id())
+                 for group in self.groups for test in group]
+        known = median([seconds for seconds in known if seconds is not None])
+        if known is None:
+            return default
+        return known
+
+    def cost(self, group):
+        seconds = 0.0
+        fixture_sets = set()
+        for test in group:
+            duration = None
+            if self.history is not None:
+                duration = self.history.median(test.id())
+            if duration is None:
+                duration = self.default
+            seconds += duration
+            fixtures = getattr(test, 'fixtures', None)
+            if fixtures:
+                fixture_sets.add(tuple(fixtures))
+        if self.history is not None:
+            for fixtures in fixture_sets:
+                seconds += self.history.median(fixtures_key(fixtures)) or 0
+        return seconds
+
+    def by_count(self):
+        """tells if durations were not used"""
+        return self.history is None
+
+    def tests(self, index):
+        """tests of the shard (numbered from 1) in their original order"""
+        tests = []
+        for i in sorted(self.shards[index - 1]):
+            tests.extend(self.groups[i])
+        return tests
@@ -0,0 +1,162 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+from colortools.ordering import normalize_fixtures
+
+
+def dump_tables(db, names=None):
+    """
+    returns a list of (table, columns, rows) tuples for every non empty
+    django table (or table from ``names``) in the given database
+    """
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    tables = []
+    if names is None:
+        names = connection.introspection.django_table_names(only_existing=True)
+    for table in sorted(names):
+        cursor.execute('SELECT * FROM %s' % qn(table))
+        rows = cursor.fetchall()
+        if rows:
+            columns = [column[0] for column in cursor.description]
+            tables.append((table, columns, rows))
+    return tables
+
+
+def restore_tables(db, tables):
+    """
+    empties all django tables in the given database and inserts rows
+    previously returned by dump_tables
+    """
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    style = no_style()
+    cursor = connection.cursor()
+
+    all_tables = connection.introspection.django_table_names(only_existing=True)
+    statements = connection.ops.sql_flush(style, all_tables,
+                                          connection.introspection.sequence_list())
+    if connection.vendor == 'mysql':
+        statements.append('SET FOREIGN_KEY_CHECKS = 0;')
+
+    for statement in statements:
+        cursor.execute(statement)
+
+    for table, columns, rows in tables:
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                            qn(table),
+                            ', '.join([qn(column) for column in columns]),
+                            ', '.join(['%s'] * len(columns))), rows)
+
+    if connection.vendor == 'mysql':
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 1;')
+
+    models = connection.introspection.installed_models(all_tables)
+    for statement in connection.ops.sequence_reset_sql(style, models):
+        cursor.execute(statement)
+
+    transaction.commit_unless_managed(using=db)
+
+
+class FixtureSnapshot(object):
+    """
+    Committed state of given databases after loading fixtures. ``states``
+    keeps what a TableTracker knew about each database when it was taken.
+    """
+
+    def __init__(self, fixtures, databases, tracker=None):
+        self.fixtures = normalize_fixtures(fixtures)
+        self.tables = {}
+        self.states = {}
+        self.rows = 0
+        for db in databases:
+            if tracker is not None:
+                self.states[db] = tracker.state(db)
+            self.tables[db] = dump_tables(db)
+            for table, columns, rows in self.tables[db]:
+                self.rows += len(rows)
+
+    def covers(self, databases):
+        return not [db for db in databases if db not in self.tables]
+
+    def restore(self, databases=None):
+        if databases is None:
+            databases = self.tables.keys()
+        for db in databases:
+            restore_tables(db, self.tables[db])
+
+
+class SnapshotCache(object):
+    """
+    LRU cache of fixture snapshots keyed by fixture list.
+
+    Restoring a snapshot replaces a database flush followed by loaddata of
+    the whole fixture set. Only fixture sets from ``targets`` are snapshotted
+    - those are the prefixes the runner is going to return to after a flush.
+    Snapshots remember the state of ``tracker`` so they can be restored by
+    TableTracker.restore.
+    """
+
+    def __init__(self, size=10, max_rows=100000, targets=None, tracker=None):
+        self.size = size
+        self.max_rows = max_rows
+        self.targets = set(targets or [])
+        self.tracker = tracker
+        self.snapshots = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    @property
+    def rows(self):
+        return sum([snapshot.rows for snapshot in self.snapshots.values()])
+
+    def wants(self, fixtures):
+        return self.size > 0 and normalize_fixtures(fixtures) in self.targets
+
+    def lookup(self, fixtures, databases=()):
+        """
+        returns the snapshot of the longest cached prefix of fixtures taken
+        from all given databases
+        """
+        fixtures = normalize_fixtures(fixtures)
+        for end in range(len(fixtures), 0, -1):
+            snapshot = self.snapshots.get(fixtures[:end])
+            if snapshot is not None and snapshot.covers(databases):
+                self.hits += 1
+                self.order.remove(snapshot.fixtures)
+                self.order.append(snapshot.fixtures)
+                return snapshot
+        self.misses += 1
+        return None
+
+    def store(self, fixtures, databases):
+        fixtures = normalize_fixtures(fixtures)
+        if fixtures in self.snapshots:
+            if self.snapshots[fixtures].covers(databases):
+                return self.snapshots[fixtures]
+            # taken from other databases
+            del self.snapshots[fixtures]
+            self.order.remove(fixtures)
+
+        snapshot = FixtureSnapshot(fixtures, databases, self.tracker)
+        if snapshot.rows > self.max_rows:
+            return None
+
+        self.snapshots[fixtures] = snapshot
+        self.order.append(fixtures)
+        while self.order and (len(self.order) > self.size
+                              or self.rows > self.max_rows):
+            del self.snapshots[self.order.pop(0)]
+            self.evictions += 1
+        return snapshot
@@ -3,6 +3,7 @@
 # Author: Szymon Rajchman
 #
 
+import os
 import time
 
 from django.test import TestCase
@@ -13,10 +14,31 @@ from django.test.simple import DjangoTestSuiteRunner
 from django.utils.unittest.runner import TextTestResult, TextTestRunner, registerResult
 from django.utils import termcolors
 from django.utils import unittest
-from django.test.testcases import connections_support_transactions, disable_transaction_methods
+from django.test.testcases import (connections_support_transactions,
+            disable_transaction_methods, restore_transaction_methods,
+            TransactionTestCase)
 from django.db import DEFAULT_DB_ALIAS
 from django.contrib.contenttypes.models import ContentType
 
+from colortools.ordering import FixtureTrie, FixturePlan
+from colortools.snapshots import SnapshotCache, dump_tables
+from colortools.parallel import ParallelSuite, DatabaseTemplate, for_each_database
+from colortools.loader import FixtureLoader
+from colortools.durations import DurationHistory, DurationReport
+from colortools.queries import QueryLog
+from colortools.reports import JSONLinesWriter, JUnitXMLWriter
+from colortools.flushing import TableTracker, clear_tables, flush_database
+from colortools.reuse import DatabaseFingerprints, reuse_test_db, schema_fingerprint
+from colortools.sharding import ShardPlan, parse_shard
+from colortools.selection import CoverageMap, suite_fingerprint
+from colortools.memory import MemoryLog
+from colortools.phases import PhaseTimer
+
+_fixture_teardown = TestCase._fixture_teardown
+_post_teardown = TestCase._post_teardown
+_transaction_fixture_setup = TransactionTestCase._fixture_setup
+_transaction_post_teardown = TransactionTestCase._post_teardown
+
 _COLORS = {
     'FAIL': {'fg': 'red', 'opts': ('bold', 'noreset')},
     'SUCCESS': {'fg': 'green', 'opts': ('bold', 'noreset')},
@@ -24,32 +46,107 @@ _COLORS = {
     'UNEXPECTED': {'fg': 'magenta', 'opts': ('bold', 'noreset')},
     'SKIP': {'fg': 'yellow', 'opts': ('bold', 'noreset')},
     'ERROR': {'fg': 'yellow', 'opts': ('bold', 'noreset')},
+    'SLOW': {'fg': 'yellow', 'opts': ('noreset',)},
 }
 
 class _ColorDecorator(object):
-    """Used to decorate output with ANSI colors"""
-
-    def __init__(self, stream):
-        self.stream = stream
-        self.style = {}
+    """
+    Used to decorate output with ANSI colors.
 
-        for code, params in _COLORS.items():
-            self.style[code] = termcolors.make_style(**params)
+    Escape sequences are rendered once. Output is buffered and written when
+    ``flush_interval`` seconds passed or ``buffer_size`` characters piled
+    up and right after a failure or an error - flush (called by unittest
+    after every dot) writes only then too, ``_flush`` always does. Colors
+    are used on terminals only unless ``colors`` says otherwise.
+    """
 
-        self.reset = termcolors.make_style(opts=('reset'))
+    def __init__(self, stream, colors=None, flush_interval=0.5, buffer_size=8192):
+        self.stream = stream
+        isatty = getattr(stream, 'isatty', None)
+        self.tty = bool(isatty and isatty())
+        if colors is None:
+            colors = self.tty
+        self.colors = colors
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.escapes = {}
+        self.reset = ''
+
+        if colors:
+            for code, params in _COLORS.items():
+                self.escapes[code] = termcolors.make_style(**params)('')
+            self.reset = termcolors.make_style(opts=('reset',))('')
+
+        self._buffer = []
+        self._size = 0
+        self._pending = None
+        self._urgent = False
+        self._flushed = time.time()
+        self._progressed = 0
 
     def __getattr__(self, attr):
         if attr in ('stream', '__getstate__'):
             raise AttributeError(attr) # pragma: no cover
         return getattr(self.stream, attr)
 
+    def write(self, text):
+        if self._pending:
+            text = self._pending + text
+        self._pending = None
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self._flush()
+
+    def writeln(self, text=None):
+        if text:
+            self.write(text)
+        self.write('\n')
+
+    def flush(self):
+        if self._urgent or self._size >= self.buffer_size or self.due():
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+        self.stream.flush()
+        self._urgent = False
+        self._flushed = time.time()
+
+    def due(self):
+        """tells if flush_interval passed since the last flush"""
+        return time.time() - self._flushed >= self.flush_interval
+
+    def progress_due(self):
+        """
+        tells if flush_interval passed since the last progress line - other
+        output is flushed in between
+        """
+        return time.time() - self._progressed >= self.flush_interval
+
     def color(self, code):
-        style = self.style.get(code, self.reset)
-        self.stream.write(style(''))
+        if code in ('FAIL', 'ERROR'):
+            self._urgent = True
+        # written along with the first colored text
+        self._pending = self.escapes.get(code, self.reset)
 
     def colorClear(self):
-        self.stream.write(self.reset(''))
-        self.stream.flush()
+        if self._pending is None:
+            self.write(self.reset)
+        self._pending = None
+        self.flush()
+
+    def progress(self, line):
+        """replaces the progress line on terminals, adds a new one elsewhere"""
+        if self.tty:
+            self.write('\r%s\x1b[K' % line)
+        else:
+            self.writeln(line)
+        self._flush()
+        self._progressed = time.time()
 
 
 class ColorTextTestResult(TextTestResult):
@@ -60,36 +157,113 @@ class ColorTextTestResult(TextTestResult):
 
     def __init__(self, *args, **kwargs):
         super(ColorTextTestResult, self).__init__(*args, **kwargs)
+        self.test_timings = []
+        self.listeners = []
+        self.progress = False
+        self.total = None
+        self._test_started = None
+
+    def _notify(self, event, test, *args):
+        """
+        passes test events to listeners implementing them. Errors are passed
+        as formatted tracebacks and stopTest is preceded by addDuration.
+        """
+        for listener in self.listeners:
+            method = getattr(listener, event, None)
+            if method is not None:
+                method(test, *args)
+
+    def _notify_error(self, event, test, err):
+        if self.listeners:
+            self._notify(event, test, self._exc_info_to_string(err, test))
+
+    def _verify(self, test):
+        """returns first failure message listeners found for a passed test"""
+        for listener in self.listeners:
+            verify = getattr(listener, 'verify', None)
+            message = verify is not None and verify(test)
+            if message:
+                return message
+        return None
+
+    def startTest(self, test):
+        self._test_started = time.time()
+        super(ColorTextTestResult, self).startTest(test)
+        self._notify('startTest', test)
+
+    def stopTest(self, test):
+        if self._test_started is not None:
+            self.addDuration(test, time.time() - self._test_started)
+        self._notify('stopTest', test)
+        super(ColorTextTestResult, self).stopTest(test)
+        if self.progress and (self.stream.progress_due() or self.testsRun == self.total):
+            self.writeProgress(test)
+
+    def writeProgress(self, test):
+        """writes a single line with the number of run and failed tests"""
+        total = str(self.total or '?')
+        line = '[%*d/%s]' % (len(total), self.testsRun, total)
+        failed = len(self.failures) + len(self.errors)
+        if failed:
+            line += ' %s%d failed%s' % (self.stream.escapes.get('FAIL', ''),
+                                       failed, self.stream.reset)
+        self.stream.progress('%s %s' % (line, test.id()))
+
+    def addDuration(self, test, seconds):
+        """records duration of a test - measured elsewhere in parallel runs"""
+        self.test_timings.append((test, seconds))
+        self._test_started = None
+        self._notify('addDuration', test, seconds)
 
     def addSuccess(self, test):
+        message = self._verify(test)
+        if message:
+            return self.addFailure(test, message)
         self.stream.color('SUCCESS')
         super(ColorTextTestResult, self).addSuccess(test)
         self.stream.colorClear()
+        self._notify('addSuccess', test)
 
     def addError(self, test, err):
         self.stream.color('ERROR')
         super(ColorTextTestResult, self).addError(test, err)
         self.stream.colorClear()
+        self._notify_error('addError', test, err)
 
     def addFailure(self, test, err):
         self.stream.color('FAIL')
         super(ColorTextTestResult, self).addFailure(test, err)
         self.stream.colorClear()
+        self._notify_error('addFailure', test, err)
 
     def addSkip(self, test, reason):
         self.stream.color('SKIP')
         super(ColorTextTestResult, self).addSkip(test, reason)
         self.stream.colorClear()
+        self._notify('addSkip', test, reason)
 
     def addExpectedFailure(self, test, err):
         self.stream.color('EXPECTED')
         super(ColorTextTestResult, self).addExpectedFailure(test, err)
         self.stream.colorClear()
+        self._notify_error('addExpectedFailure', test, err)
 
     def addUnexpectedSuccess(self, test):
         self.stream.color('UNEXPECTED')
         super(ColorTextTestResult, self).addUnexpectedSuccess(test)
         self.stream.colorClear()
+        self._notify('addUnexpectedSuccess', test)
+
+    def _exc_info_to_string(self, err, test):
+        if isinstance(err, basestring):
+            # already formatted by a parallel worker
+            return err
+        return super(ColorTextTestResult, self)._exc_info_to_string(err, test)
+
+    def printErrors(self):
+        if self.progress:
+            self.stream.writeln()
+        super(ColorTextTestResult, self).printErrors()
 
     def printErrorList(self, flavour, errors):
         for test, err in errors:
@@ -107,14 +281,24 @@ class ColorTextTestRunner(TextTestRunner):
     resultclass = ColorTextTestResult
 
     def __init__(self, *args, **kwargs):
+        self.listeners = kwargs.pop('listeners', [])
+        self.progress = kwargs.pop('progress', False)
+        colors = kwargs.pop('colors', None)
+        flush_interval = kwargs.pop('flush_interval', 0.5)
         super(ColorTextTestRunner, self).__init__(*args, **kwargs)
-        self.stream = _ColorDecorator(self.stream)
+        self.stream = _ColorDecorator(self.stream, colors, flush_interval)
 
     def run(self, test):
         "Run the given test case or test suite."
         result = self._makeResult()
         result.failfast = self.failfast
         result.buffer = self.buffer
+        result.listeners = list(self.listeners)
+        if self.progress:
+            # a single line replaces dots and test descriptions
+            result.progress = True
+            result.dots = result.showAll = False
+            result.total = test.countTestCases()
         registerResult(result)
 
         startTime = time.time()
@@ -169,6 +353,7 @@ class ColorTextTestRunner(TextTestRunner):
         else:
             self.stream.write("\n")
         self.stream.colorClear()
+        self.stream._flush()
         return result
 
 def fixture_list(fixtures, global_fixtures=[]):
@@ -188,58 +373,113 @@ class ColorDjangoTestSuiteRunner(DjangoTestSuiteRunner):
     """
     Support for coloring error output
     """
+    coverage_map = None
+    query_log = None
+    phase_timer = None
+
     def wrap_tests(self, suite):
         """
-        monkeypatches TestCase tests. Sorts them by fixtures and then
-        optimizes fixture loading.
+        monkeypatches TestCase tests. Orders them by walking a trie of their
+        fixture lists and then optimizes fixture loading.
         """
 
-        self.currernt_fixtures = []
-        self.flushes = 0
-        self.fixtures = 0
-        self.fixtures_prevented = 0
-        self.fixtures_sets = []
+        self.reset_fixture_state()
 
         def fast_fixture_setup(instance):
+            if self.coverage_map is not None:
+                self.coverage_map.startSetup()
+            start = time.time()
+            key = tuple(getattr(instance, 'fixtures', None) or ())
+            if self.query_log is not None:
+                self.query_log.begin(self.query_log.fixtures, key)
+            if self.memory_log is not None:
+                self.memory_log.begin(key)
+            self.begin_phase('fixture setup')
+            try:
+                return setup_fixtures(instance)
+            finally:
+                self.end_phase()
+                self.fixture_timings[key] = (self.fixture_timings.get(key, 0) +
+                                             time.time() - start)
+                if self.query_log is not None:
+                    self.query_log.end()
+                if self.memory_log is not None:
+                    self.memory_log.end()
+
+        def setup_fixtures(instance):
+            # states kept for TransactionTestCases are not known anymore
+            self.end_transaction_tracking()
+            self.transaction_states = {}
             if not connections_support_transactions():
-                return super(TestCase, instance)._fixture_setup()
+                # not the patched method - setup is measured already
+                return setup_transaction_fixtures(instance)
+
+            fixtures = list(getattr(instance, 'fixtures', None) or [])
 
-            fixtures = getattr(instance, 'fixtures', [])
+            if self.use_fixture_savepoints():
+                self.setup_fixture_layers(fixtures)
+                for db in connections:
+                    self.test_savepoints[db] = transaction.savepoint(using=db)
+                disable_transaction_methods()
 
-            loaddata = fixtures
-            flush_db = True
-            if len(self.currernt_fixtures) <= len(fixtures):
-                if fixtures[:len(self.currernt_fixtures)] == self.currernt_fixtures:
+                from django.contrib.sites.models import Site
+                Site.objects.clear_cache()
+                return
+
+            # only databases used by the test are flushed and loaded
+            databases = self.fixture_databases(instance)
+            loads = {}
+            flush = []
+            for db in databases:
+                current = self.database_fixtures.get(db, [])
+                if current is not None and fixtures[:len(current)] == current:
                     # current fixtures are still OK
-                    loaddata = fixtures[len(self.currernt_fixtures):]
-                    self.fixtures_prevented += len(self.currernt_fixtures)
-                    flush_db = False
+                    loads[db] = fixtures[len(current):]
+                else:
+                    flush.append(db)
 
-            if flush_db:
+            if flush:
                 ContentType.objects.clear_cache()
                 self.flushes += 1
-                self.currernt_fixtures = []
-                for db in connections:
-                    call_command('flush', verbosity=0, interactive=False, database=db)
-
+                snapshot = None
+                if self.fixture_snapshots.size:
+                    snapshot = self.fixture_snapshots.lookup(fixtures, flush)
+                if snapshot is not None:
+                    # restored state already contains a prefix of fixtures
+                    self.begin_phase('flush')
+                    try:
+                        if self.table_tracker is not None:
+                            for db in flush:
+                                self.table_tracker.restore(snapshot, db)
+                        else:
+                            snapshot.restore(flush)
+                    finally:
+                        self.end_phase()
+                    restored = len(snapshot.fixtures)
+                else:
+                    self.flush_databases(flush)
+                    restored = 0
+                for db in flush:
+                    loads[db] = fixtures[restored:]
+
+            # statistics follow the default database like the predictions do
+            loaddata = loads[DEFAULT_DB_ALIAS]
+            self.fixtures_prevented += len(fixtures) - len(loaddata)
             if len(loaddata):
                 self.fixtures += len(loaddata)
-                self.fixtures_sets.append(self.currernt_fixtures + loaddata)
-                for db in connections:
-                    call_command('loaddata', *loaddata, **{
-                                                        'verbosity': 0,
-                                                        'commit': True,
-                                                        'database': db
-                                                        })
+                self.fixtures_sets.append(fixtures)
+
+            pending = {}
+            for db, loaddata in loads.items():
+                if loaddata:
+                    pending.setdefault(tuple(loaddata), []).append(db)
+            for loaddata, dbs in sorted(pending.items()):
+                self.load_fixtures(list(loaddata), dbs,
+                                   fixtures[:len(fixtures) - len(loaddata)])
+            for db in databases:
+                self.database_fixtures[db] = fixtures
             self.currernt_fixtures = fixtures
 
-            # If the test case has a multi_db=True flag, setup all databases.
-            # Otherwise, just use default.
-            if getattr(self, 'multi_db', False):
-                databases = connections
-            else:
-                databases = [DEFAULT_DB_ALIAS]
-
             for db in databases:
                 transaction.enter_transaction_management(using=db)
                 transaction.managed(True, using=db)
@@ -248,50 +488,664 @@ class ColorDjangoTestSuiteRunner(DjangoTestSuiteRunner):
             from django.contrib.sites.models import Site
             Site.objects.clear_cache()
 
+        def fast_fixture_teardown(instance):
+            if self.fixture_layers is None:
+                return _fixture_teardown(instance)
+
+            restore_transaction_methods()
+            for db, sid in self.test_savepoints.items():
+                transaction.savepoint_rollback(sid, using=db)
+
+        def fast_post_teardown(instance):
+            self.begin_phase('fixture teardown')
+            try:
+                return post_teardown(instance)
+            finally:
+                self.end_phase()
+
+        def post_teardown(instance):
+            if self.fixture_layers is None:
+                return _post_teardown(instance)
+
+            # closing connections would drop transactions holding the layers
+            instance._fixture_teardown()
+            instance._urlconf_teardown()
+
+        def transaction_fixture_setup(instance):
+            if self.coverage_map is not None:
+                self.coverage_map.startSetup()
+            if self.memory_log is not None:
+                self.memory_log.begin(tuple(getattr(instance, 'fixtures', None) or ()))
+            self.begin_phase('fixture setup')
+            try:
+                return setup_transaction_fixtures(instance)
+            finally:
+                self.end_phase()
+                if self.memory_log is not None:
+                    self.memory_log.end()
+
+        def setup_transaction_fixtures(instance):
+            # transaction based tests commit what they write
+            self.reset_fixture_layers()
+            databases = self.fixture_databases(instance)
+            if self.table_tracker is None:
+                return stock_transaction_fixture_setup(instance, databases)
+
+            start = time.time()
+            fixtures = list(getattr(instance, 'fixtures', None) or [])
+            for db in databases:
+                self.restore_transaction_state(db, fixtures)
+            key = tuple(fixtures)
+            self.fixture_timings[key] = (self.fixture_timings.get(key, 0) +
+                                         time.time() - start)
+            self.transaction_written = {}
+            self.table_tracker.begin(databases, self.transaction_written)
+
+            from django.contrib.sites.models import Site
+            Site.objects.clear_cache()
+
+        def stock_transaction_fixture_setup(instance, databases):
+            for db in databases:
+                self.database_fixtures[db] = None
+            if not self.database_templates:
+                return _transaction_fixture_setup(instance)
+
+            # flush would remove global fixtures
+            for db in databases:
+                self.begin_phase('flush')
+                try:
+                    self.flush_database(db)
+                finally:
+                    self.end_phase()
+                if getattr(instance, 'fixtures', None):
+                    self.begin_phase('loaddata')
+                    try:
+                        call_command('loaddata', *instance.fixtures, **{
+                                                            'verbosity': 0,
+                                                            'database': db
+                                                            })
+                    finally:
+                        self.end_phase()
+
+        def transaction_post_teardown(instance):
+            self.begin_phase('fixture teardown')
+            try:
+                self.end_transaction_tracking()
+                return _transaction_post_teardown(instance)
+            finally:
+                self.end_phase()
+
         setattr(TestCase, '_fixture_setup', fast_fixture_setup)
+        setattr(TestCase, '_fixture_teardown', fast_fixture_teardown)
+        setattr(TestCase, '_post_teardown', fast_post_teardown)
+        setattr(TransactionTestCase, '_fixture_setup', transaction_fixture_setup)
+        setattr(TransactionTestCase, '_post_teardown', transaction_post_teardown)
         new_suite = unittest.TestSuite()
 
+        TEST_GLOBAL_FIXTURES = getattr(settings, 'TEST_GLOBAL_FIXTURES', [])
         other_tests = []
         test_cases = []
+        transaction_tests = []
         for test in suite:
+            if TEST_GLOBAL_FIXTURES and getattr(test, 'fixtures', None):
+                # global fixtures are loaded once into databases
+                test.fixtures = fixture_list(list(test.fixtures),
+                                             list(TEST_GLOBAL_FIXTURES))
             if isinstance(test, TestCase):
                 # optimize only TestCases - transaction based tests
                 test._runner = self
                 test_cases.append(test)
+            elif isinstance(test, TransactionTestCase):
+                # ordered by fixtures too, they restore them on their own
+                transaction_tests.append(test)
             else:
                 other_tests.append(test)
 
-        def comparator(tc1, tc2):
-            tc1_fixtures = getattr(tc1, 'fixtures', [])
-            tc2_fixtures = getattr(tc2, 'fixtures', [])
-            if tc1_fixtures == tc2_fixtures:
-                return 0
+        snapshots = getattr(settings, 'TEST_FIXTURE_SNAPSHOTS', 0)
+        trie = FixtureTrie(test_cases, snapshots)
+        transaction_trie = FixtureTrie(transaction_tests)
+        self.shard_plan = None
+        TEST_SHARD = getattr(settings, 'TEST_SHARD', None)
+        if TEST_SHARD:
+            # groups starting from an empty database are never split
+            self.shard = parse_shard(TEST_SHARD)
+            self.shard_plan = ShardPlan(
+                    self.group_tests(trie, transaction_trie, other_tests),
+                    self.shard[1], self.duration_history(),
+                    fingerprint=getattr(settings, 'TEST_SHARD_FINGERPRINT', None))
+            selected = set(self.shard_plan.tests(self.shard[0]))
+            trie = FixtureTrie([test for test in test_cases if test in selected],
+                               snapshots)
+            transaction_trie = FixtureTrie([test for test in transaction_tests
+                                            if test in selected])
+            other_tests = [test for test in other_tests if test in selected]
+
+        self.fixture_plan = trie.plan()
+        self.fixture_snapshots = SnapshotCache(
+                size=snapshots,
+                max_rows=getattr(settings, 'TEST_FIXTURE_SNAPSHOT_ROWS', 100000),
+                targets=trie.branch_prefixes(),
+                tracker=self.table_tracker)
+
+        self.test_groups = self.group_tests(trie, transaction_trie, other_tests)
+
+        new_suite.addTests(trie.tests() + transaction_trie.tests() + other_tests)
+
+        return new_suite
+
+    @staticmethod
+    def group_tests(trie, transaction_trie, other_tests):
+        """
+        returns lists of tests that share fixture state - segments of
+        TestCases, TransactionTestCases with the same fixtures and single
+        other tests
+        """
+        return (trie.segments()
+                + [tests for fixtures, tests in transaction_trie.groups() if tests]
+                + [[test] for test in other_tests])
+
+    def reset_fixture_state(self):
+        self.currernt_fixtures = []
+        self.database_fixtures = {}
+        self.flushes = 0
+        self.fixtures = 0
+        self.fixtures_prevented = 0
+        self.fixtures_sets = []
+        self.fixture_timings = {}
+        self.rollbacks = 0
+        self.fixture_layers = None
+        self.test_savepoints = {}
+        self.fixture_plan = FixturePlan()
+        self.fixture_snapshots = SnapshotCache(size=0)
+        self.fixture_loader = None
+        TEST_FIXTURE_CACHE = getattr(settings, 'TEST_FIXTURE_CACHE', 0)
+        if TEST_FIXTURE_CACHE:
+            self.fixture_loader = FixtureLoader(max_size=TEST_FIXTURE_CACHE)
+        self.database_templates = {}
+        self.transaction_states = {}
+        self.transaction_written = None
+        self.transaction_flushes = 0
+        self.transaction_fixtures = 0
+        self.transaction_restores = 0
+        self.transaction_tables = 0
+        self.table_tracker = None
+        if getattr(settings, 'TEST_SELECTIVE_FLUSH', False):
+            self.table_tracker = TableTracker(full_flush=self.flush_database)
+        self.query_log = None
+        if getattr(settings, 'TEST_QUERIES', 0):
+            self.query_log = QueryLog(
+                    repeated=getattr(settings, 'TEST_QUERIES_REPEATED', 5),
+                    max_queries=getattr(settings, 'TEST_MAX_QUERIES', None))
+        self.memory_log = None
+        if getattr(settings, 'TEST_MEMORY', 0):
+            self.memory_log = MemoryLog(
+                    sample=getattr(settings, 'TEST_MEMORY_SAMPLE', 0),
+                    keep=getattr(settings, 'TEST_MEMORY_OBJECTS', 5))
+
+    @staticmethod
+    def fixture_databases(instance):
+        """
+        If the test case has a multi_db=True flag, setup all databases.
+        Otherwise, just use default.
+        """
+        if getattr(instance, 'multi_db', False):
+            return list(connections)
+        return [DEFAULT_DB_ALIAS]
+
+    def restore_transaction_state(self, db, fixtures):
+        """
+        brings a database to the state right after loading ``fixtures`` for
+        a TransactionTestCase. Tables written by previous tests with the same
+        fixtures get their rows back, otherwise tables written since the last
+        flush are cleared and fixtures are loaded.
+        """
+        ContentType.objects.clear_cache()
+        state = self.transaction_states.get(db)
+        if state is not None and state[0] == fixtures:
+            loaded, rows, dirty = state
+            if dirty:
+                self.begin_phase('flush')
+                try:
+                    clear_tables(db, sorted(dirty), rows)
+                finally:
+                    self.end_phase()
+                self.transaction_tables += len(dirty)
+                dirty.clear()
+            self.transaction_restores += 1
+        else:
+            # rows of tables written before tracking began are not known
+            if (self.database_fixtures.get(db) != fixtures or
+                    db not in self.table_tracker.baseline):
+                self.flush_databases([db])
+                self.transaction_flushes += 1
+                if fixtures:
+                    self._loaddata(fixtures, databases=[db])
+                    self.transaction_fixtures += len(fixtures)
+            rows = dict(self.table_tracker.baseline.get(db, {}))
+            for table, columns, values in dump_tables(
+                                    db, self.table_tracker.written.get(db, ())):
+                rows[table] = (columns, values)
+            self.transaction_states[db] = (fixtures, rows, set())
+        self.database_fixtures[db] = fixtures
+
+    def end_transaction_tracking(self):
+        """
+        stops tracking writes of a TransactionTestCase. Databases it wrote to
+        no longer hold just their fixtures, neither may the ones it didn't
+        track.
+        """
+        written = self.transaction_written
+        if written is None:
+            return
+        self.transaction_written = None
+        self.table_tracker.end(written.keys())
+        for db in connections:
+            if db not in written:
+                self.table_tracker.invalidate(db)
+                self.database_fixtures[db] = None
+        for db, tables in written.items():
+            if not tables:
+                continue
+            self.table_tracker.written.setdefault(db, set()).update(tables)
+            if db in self.transaction_states:
+                self.transaction_states[db][2].update(tables)
+            self.database_fixtures[db] = None
+
+    def flush_databases(self, databases=None):
+        """
+        clears tables written by fixtures since the last flush, flushes
+        everything when those are not known or TEST_SELECTIVE_FLUSH is off
+        """
+        def flush(db):
+            if self.table_tracker is not None:
+                self.table_tracker.flush(db)
             else:
-                return tc1_fixtures > tc2_fixtures and 1 or - 1
+                self.flush_database(db)
 
-        test_cases.sort(comparator)
+        if databases is None:
+            databases = list(connections)
+        self.begin_phase('flush')
+        try:
+            for_each_database(flush, databases, self.thread_setup())
+        finally:
+            self.end_phase()
 
-        new_suite.addTests(test_cases + other_tests)
+    def flush_database(self, db):
+        """
+        empties a database. Databases with global fixtures are restored from
+        their templates instead.
+        """
+        template = self.database_templates.get(db)
+        if template is not None:
+            template.restore()
+        else:
+            flush_database(db)
 
-        return new_suite
+    def load_fixtures(self, fixtures, databases=None, loaded=()):
+        """
+        loads and commits fixtures on top of ``loaded`` fixtures. Fixture sets
+        the snapshot cache asks for are snapshotted on the way.
+        """
+        loaded = list(loaded)
+        chunk = []
+        for fixture in fixtures:
+            chunk.append(fixture)
+            if self.fixture_snapshots.wants(loaded + chunk):
+                self._loaddata(chunk, databases=databases)
+                loaded += chunk
+                chunk = []
+                self.fixture_snapshots.store(loaded, databases or connections)
+        if chunk:
+            self._loaddata(chunk, databases=databases)
+
+    def _loaddata(self, fixtures, commit=True, databases=None):
+        """
+        loads fixtures into databases. Committed loads of independent
+        databases run concurrently.
+        """
+        def load(db):
+            tracking = commit and self.table_tracker is not None
+            if tracking:
+                self.table_tracker.begin([db])
+            try:
+                if self.fixture_loader is not None:
+                    self.fixture_loader.load(fixtures, db, commit=commit)
+                    return
+                call_command('loaddata', *fixtures, **{
+                                                    'verbosity': 0,
+                                                    'commit': commit,
+                                                    'database': db
+                                                    })
+            finally:
+                if tracking:
+                    self.table_tracker.end([db])
+
+        if databases is None:
+            databases = list(connections)
+        self.begin_phase('loaddata')
+        try:
+            if commit:
+                for_each_database(load, databases, self.thread_setup())
+            else:
+                # uncommitted data belongs to transactions of this thread
+                for db in databases:
+                    load(db)
+        finally:
+            self.end_phase()
+
+    def use_fixture_savepoints(self):
+        """
+        fixture layers are used when TEST_FIXTURE_SAVEPOINTS is set and all
+        databases support savepoints
+        """
+        if self.fixture_layers is not None:
+            return True
+        if not getattr(settings, 'TEST_FIXTURE_SAVEPOINTS', False):
+            return False
+        for db in connections:
+            if not connections[db].features.uses_savepoints:
+                return False
+        return True
+
+    def setup_fixture_layers(self, fixtures):
+        """
+        Keeps every loaded fixture in its own savepoint of a transaction that
+        is never committed. Only the layers that are not shared with the
+        fixtures are rolled back, then the missing fixtures are loaded.
+        """
+        if self.fixture_layers is None:
+            ContentType.objects.clear_cache()
+            self.flush_databases()
+            for db in connections:
+                transaction.enter_transaction_management(using=db)
+                transaction.managed(True, using=db)
+            self.fixture_layers = []
+
+        common = 0
+        for (fixture, sids), wanted in zip(self.fixture_layers, fixtures):
+            if fixture != wanted:
+                break
+            common += 1
+        self.fixtures_prevented += common
+
+        if common < len(self.fixture_layers):
+            if common:
+                self.rollbacks += 1
+            else:
+                ContentType.objects.clear_cache()
+                self.flushes += 1
+            for db, sid in self.fixture_layers[common][1].items():
+                transaction.savepoint_rollback(sid, using=db)
+            del self.fixture_layers[common:]
+
+        loaddata = fixtures[common:]
+        if loaddata:
+            self.fixtures += len(loaddata)
+            self.fixtures_sets.append(fixtures)
+        for fixture in loaddata:
+            sids = {}
+            for db in connections:
+                sids[db] = transaction.savepoint(using=db)
+            self._loaddata([fixture], commit=False)
+            self.fixture_layers.append((fixture, sids))
+        self.currernt_fixtures = fixtures
+
+    def reset_fixture_layers(self):
+        """rolls back all fixture layers and leaves their transactions"""
+        self.end_transaction_tracking()
+        if self.fixture_layers is None:
+            return
+        for db in connections:
+            transaction.rollback(using=db)
+            transaction.leave_transaction_management(using=db)
+        self.fixture_layers = None
+        self.currernt_fixtures = []
+        self.database_fixtures = {}
+
+    def fixture_statistics(self):
+        return {
+            'flushes': self.flushes,
+            'fixtures': self.fixtures,
+            'fixtures_prevented': self.fixtures_prevented,
+            'fixtures_sets': self.fixtures_sets,
+            'rollbacks': self.rollbacks,
+            'fixture_timings': self.fixture_timings,
+            'snapshot_hits': self.fixture_snapshots.hits,
+            'snapshot_misses': self.fixture_snapshots.misses,
+            'snapshot_evictions': self.fixture_snapshots.evictions,
+            'loader_hits': self.fixture_loader and self.fixture_loader.hits or 0,
+            'loader_misses': self.fixture_loader and self.fixture_loader.misses or 0,
+            'queries': self.query_log and self.query_log.statistics(),
+            'full_flushes': self.table_tracker and self.table_tracker.full_flushes or 0,
+            'partial_flushes': self.table_tracker and self.table_tracker.partial_flushes or 0,
+            'cleared_tables': self.table_tracker and self.table_tracker.cleared_tables or 0,
+            'transaction_flushes': self.transaction_flushes,
+            'transaction_fixtures': self.transaction_fixtures,
+            'transaction_restores': self.transaction_restores,
+            'transaction_tables': self.transaction_tables,
+            'coverage': self.coverage_map and self.coverage_map.recorded,
+            'memory': self.memory_log and self.memory_log.statistics(),
+            'phases': self.phase_timer and self.phase_timer.statistics(),
+        }
+
+    def merge_fixture_statistics(self, statistics):
+        """adds fixture statistics collected by a parallel worker"""
+        self.flushes += statistics['flushes']
+        self.fixtures += statistics['fixtures']
+        self.fixtures_prevented += statistics['fixtures_prevented']
+        self.fixtures_sets.extend(statistics['fixtures_sets'])
+        self.rollbacks += statistics['rollbacks']
+        for key, seconds in statistics['fixture_timings'].items():
+            self.fixture_timings[key] = self.fixture_timings.get(key, 0) + seconds
+        self.fixture_snapshots.hits += statistics['snapshot_hits']
+        self.fixture_snapshots.misses += statistics['snapshot_misses']
+        self.fixture_snapshots.evictions += statistics['snapshot_evictions']
+        if self.fixture_loader is not None:
+            self.fixture_loader.hits += statistics['loader_hits']
+            self.fixture_loader.misses += statistics['loader_misses']
+        if self.query_log is not None:
+            self.query_log.merge(statistics['queries'])
+        if self.table_tracker is not None:
+            self.table_tracker.full_flushes += statistics['full_flushes']
+            self.table_tracker.partial_flushes += statistics['partial_flushes']
+            self.table_tracker.cleared_tables += statistics['cleared_tables']
+        self.transaction_flushes += statistics['transaction_flushes']
+        self.transaction_fixtures += statistics['transaction_fixtures']
+        self.transaction_restores += statistics['transaction_restores']
+        self.transaction_tables += statistics['transaction_tables']
+        if self.coverage_map is not None:
+            self.coverage_map.merge(statistics['coverage'])
+        if self.memory_log is not None:
+            self.memory_log.merge(statistics['memory'])
+        if self.phase_timer is not None:
+            self.phase_timer.merge(statistics['phases'])
+
+    def parallel_workers(self):
+        """number of worker processes from TEST_PARALLEL setting"""
+        workers = getattr(settings, 'TEST_PARALLEL', 0)
+        if workers == 'auto':
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        return int(workers or 0)
 
     def print_fixture_statistics(self):
         print("")
         print("Fixture statistics:")
-        print("    Number of fixtures loaded for TestCases: %s" % self.fixtures)
+        print("    Number of fixtures loaded for TestCases: %s (predicted %s)" % (
+                self.fixtures, self.fixture_plan.fixtures))
         print("    Number of fixtures prevented from "\
-                "loading for TestCases: %s" % self.fixtures_prevented)
-        print("    Number of database flushes: %s" % self.flushes)
+                "loading for TestCases: %s (predicted %s)" % (
+                self.fixtures_prevented, self.fixture_plan.fixtures_prevented))
+        print("    Number of database flushes: %s (predicted %s)" % (
+                self.flushes, self.fixture_plan.flushes))
+        if self.rollbacks:
+            print("    Number of partial rollbacks to fixture "\
+                    "savepoints: %s" % self.rollbacks)
+        if self.fixture_snapshots.size:
+            print("    Fixture snapshots: %s hits (predicted %s), %s misses, "\
+                    "%s evictions" % (
+                self.fixture_snapshots.hits, self.fixture_plan.restores,
+                self.fixture_snapshots.misses, self.fixture_snapshots.evictions))
+        if self.fixture_loader is not None:
+            print("    Fixture file cache: %s hits, %s misses" % (
+                self.fixture_loader.hits, self.fixture_loader.misses))
+        for db, action, seconds in getattr(self, 'database_setup', []):
+            print("    Test database for alias '%s' %s in %.3fs" % (db, action, seconds))
+        if self.table_tracker is not None and self.table_tracker.partial_flushes:
+            print("    Selective flushes: %s (%s tables cleared), %s full flushes" % (
+                self.table_tracker.partial_flushes,
+                self.table_tracker.cleared_tables,
+                self.table_tracker.full_flushes))
+        if self.transaction_flushes or self.transaction_restores:
+            print("    TransactionTestCases: %s fixtures loaded, %s flushes, "\
+                    "%s restores (%s tables cleared)" % (
+                    self.transaction_fixtures, self.transaction_flushes,
+                    self.transaction_restores, self.transaction_tables))
         print("    Fixture sets:")
         for set in self.fixtures_sets:
             print("        %s" % set)
         print("")
 
     def run_suite(self, suite, **kwargs):
-        result = ColorTextTestRunner(verbosity=self.verbosity,
-                                       failfast=self.failfast).run(suite)
+        listeners = self.test_listeners()
+        workers = self.parallel_workers()
+        groups = getattr(self, 'test_groups', [])
+        if workers > 1 and len(groups) > 1:
+            # tests are observed by listeners in worker processes
+            suite = ParallelSuite(self, groups, workers)
+            listeners = []
+        writers = self.result_writers()
+        colors = getattr(settings, 'TEST_COLORS', 'auto')
+        if colors == 'auto':
+            # only on terminals
+            colors = None
+        runner = ColorTextTestRunner(verbosity=self.verbosity,
+                                     failfast=self.failfast,
+                                     listeners=listeners + writers,
+                                     colors=colors,
+                                     progress=getattr(settings, 'TEST_OUTPUT', 'dots') == 'progress',
+                                     flush_interval=getattr(settings, 'TEST_OUTPUT_FLUSH', 0.5))
+        if self.query_log is not None:
+            self.query_log.install()
+        started = time.time()
+        self.begin_phase('tests')
+        try:
+            result = runner.run(suite)
+        finally:
+            if self.coverage_map is not None:
+                self.coverage_map.stop()
+            self.reset_fixture_layers()
+            self.end_phase()
+            if self.query_log is not None:
+                self.query_log.uninstall()
+            for writer in writers:
+                writer.close()
+        self.begin_phase('reports')
+        try:
+            if getattr(self, 'shard_plan', None) is not None:
+                self.report_shard(runner.stream, result.testsRun, time.time() - started)
+            if self.coverage_map is not None:
+                self.coverage_map.save([test.id() for test, err in
+                                        result.failures + result.errors])
+            self.report_durations(result, runner.stream)
+            if self.query_log is not None:
+                self.query_log.write(runner.stream, getattr(settings, 'TEST_QUERIES'))
+            if self.memory_log is not None:
+                self.memory_log.write(runner.stream, getattr(settings, 'TEST_MEMORY'))
+        finally:
+            self.end_phase()
+        if self.phase_timer is not None and getattr(settings, 'TEST_PHASES', False):
+            self.phase_timer.write(runner.stream)
+        runner.stream._flush()
         return result
 
+    def result_writers(self):
+        """
+        listeners writing machine readable results as tests finish - JSON
+        lines to TEST_RESULTS_JSONL and JUnit XML to TEST_RESULTS_JUNIT
+        """
+        writers = []
+        path = getattr(settings, 'TEST_RESULTS_JSONL', None)
+        if path:
+            writers.append(JSONLinesWriter(path))
+        path = getattr(settings, 'TEST_RESULTS_JUNIT', None)
+        if path:
+            writers.append(JUnitXMLWriter(path))
+        return writers
+
+    def test_listeners(self):
+        """
+        objects observing tests in the process running them - they get
+        ColorTextTestResult events (startTest, stopTest, addSuccess, ...) and
+        may fail passed tests from their verify method
+        """
+        return [listener for listener in (self.query_log, self.memory_log,
+                                          self.coverage_map, self.phase_timer)
+                if listener is not None]
+
+    def thread_setup(self):
+        """callables preparing threads that load databases concurrently"""
+        return [listener.setup_thread for listener in (self.query_log, self.coverage_map)
+                if listener is not None]
+
+    def begin_phase(self, name):
+        """
+        hook called when a phase of the run begins, ``end_phase`` ends the
+        phase begun last. Phases are timed when TEST_PHASES or
+        TEST_PHASES_FILE is set.
+        """
+        if self.phase_timer is not None:
+            self.phase_timer.begin(name)
+
+    def end_phase(self):
+        if self.phase_timer is not None:
+            self.phase_timer.end()
+
+    def report_shard(self, stream, tests, seconds):
+        index, count = self.shard
+        predicted = self.shard_plan.predicted[index - 1]
+        stream.writeln("Shard %s/%s: %s tests, predicted %.3fs, took %.3fs" % (
+                        index, count, tests, predicted, seconds))
+        if self.shard_plan.by_count():
+            if self.shard_plan.expected is not None:
+                stream.color('FAIL')
+                stream.write("Durations file %s doesn't match TEST_SHARD_FINGERPRINT %s" % (
+                              self.shard_plan.fingerprint, self.shard_plan.expected))
+                stream.colorClear()
+                stream.writeln()
+            stream.writeln("Shards were balanced by test count")
+        else:
+            stream.writeln("Shards were balanced by durations %s" % self.shard_plan.fingerprint)
+
+    def report_durations(self, result, stream):
+        """
+        prints the slowest tests when TEST_DURATIONS is set to a number of
+        tests to show. Durations are kept in TEST_DURATIONS_FILE (defaults to
+        .durations in APPLICATION_ROOT) and compared with previous runs.
+        Sharded runs only read the history - nodes writing their own parts
+        of it would split the next run differently.
+        """
+        count = getattr(settings, 'TEST_DURATIONS', 0)
+        if not count:
+            return
+
+        history = self.duration_history()
+        report = DurationReport(result.test_timings, self.fixture_timings, history,
+                    factor=getattr(settings, 'TEST_DURATIONS_REGRESSION', 2.0))
+        report.write(stream, count)
+        if history is not None and getattr(self, 'shard_plan', None) is None:
+            report.update_history()
+
+    def duration_history(self):
+        path = getattr(settings, 'TEST_DURATIONS_FILE', None)
+        if path is None and hasattr(settings, 'APPLICATION_ROOT'):
+            import unipath
+            path = unipath.Path(settings.APPLICATION_ROOT).child('.durations')
+        if not path:
+            return None
+        return DurationHistory(str(path),
+                size=getattr(settings, 'TEST_DURATIONS_HISTORY', 10))
+
     def build_suite(self, test_labels, extra_tests=None, **kwargs):
         """
         if no test labels has been defined for this test run then try to test
@@ -303,15 +1157,167 @@ class ColorDjangoTestSuiteRunner(DjangoTestSuiteRunner):
         if not test_labels and TEST_APPS:
             test_labels = TEST_APPS
 
-        return self.wrap_tests(super(ColorDjangoTestSuiteRunner, self).build_suite(test_labels, **kwargs))
+        self.phase_timer = None
+        if (getattr(settings, 'TEST_PHASES', False)
+                or getattr(settings, 'TEST_PHASES_FILE', None)):
+            self.phase_timer = PhaseTimer()
+        self.begin_phase('discovery')
+        try:
+            suite = super(ColorDjangoTestSuiteRunner, self).build_suite(test_labels, **kwargs)
+            self.coverage_map = None
+            if getattr(settings, 'TEST_CHANGED', False):
+                suite = self.select_changed(suite)
+        finally:
+            self.end_phase()
+        self.begin_phase('ordering')
+        try:
+            return self.wrap_tests(suite)
+        finally:
+            self.end_phase()
+
+    def select_changed(self, suite):
+        """
+        returns tests affected by source files changed since the last run
+        according to the coverage map in TEST_CHANGED_FILE (defaults to
+        .test-coverage in APPLICATION_ROOT). Missing or stale map runs all
+        tests and records it.
+        """
+        root = getattr(settings, 'APPLICATION_ROOT', None) or os.getcwd()
+        path = getattr(settings, 'TEST_CHANGED_FILE', None)
+        if path is None:
+            path = os.path.join(str(root), '.test-coverage')
+        self.coverage_map = CoverageMap(str(path), str(root), suite_fingerprint(str(root)))
+        tests = list(suite)
+        if not self.coverage_map.valid:
+            if self.verbosity >= 1:
+                print("Coverage map missing or stale, running all %s tests" % len(tests))
+            return suite
+        changed = self.coverage_map.changed_files()
+        affected = self.coverage_map.affected(tests, changed)
+        if self.verbosity >= 1:
+            print("Running %s of %s tests affected by %s changed files" % (
+                    len(affected), len(tests), len(changed)))
+        return unittest.TestSuite(affected)
 
     def setup_databases(self, **kwargs):
         """
         calls super setup_databases and then loads global fixtures for all databases
-        from TEST_GLOBAL_FIXTURES setting
+        from TEST_GLOBAL_FIXTURES setting. Databases are copied to templates
+        afterwards - flushes restore them instead of reloading global fixtures.
         """
+        self.begin_phase('database setup')
+        try:
+            return self._setup_databases(**kwargs)
+        finally:
+            self.end_phase()
+
+    def _setup_databases(self, **kwargs):
+        self.database_setup = []
+        self.database_fingerprints = {}
+        patched = []
+        if getattr(settings, 'TEST_REUSE_DB', False):
+            fingerprints = DatabaseFingerprints(self.fingerprints_path())
+            for db in connections:
+                creation = connections[db].creation
+                if creation._get_test_db_name() not in ('', ':memory:'):
+                    creation.create_test_db = self._reusing_create_test_db(
+                                                        db, fingerprints)
+                    patched.append(creation)
+        try:
+            old_config = super(ColorDjangoTestSuiteRunner, self).setup_databases(**kwargs)
+        finally:
+            for creation in patched:
+                del creation.create_test_db
+
+        if patched:
+            # reusable databases are kept
+            old_names, mirrors = old_config
+            kept = [creation.connection for creation in patched]
+            old_config = ([(connection, name, destroy and connection not in kept)
+                           for connection, name, destroy in old_names], mirrors)
+        if self.verbosity >= 1:
+            for db, action, seconds in self.database_setup:
+                print("%s test database for alias '%s' in %.3fs" % (
+                        action.capitalize(), db, seconds))
 
-        return super(ColorDjangoTestSuiteRunner, self).setup_databases(**kwargs)
+        TEST_GLOBAL_FIXTURES = getattr(settings, 'TEST_GLOBAL_FIXTURES', [])
+        if TEST_GLOBAL_FIXTURES:
+            # reused databases have them already
+            reused = [db for db, action, seconds in self.database_setup
+                      if action == 'reused']
+            loaded = [db for db in connections if db not in reused]
+            if loaded:
+                self._loaddata(list(TEST_GLOBAL_FIXTURES), databases=loaded)
+            templates = {}
+            for db in connections:
+                # aliases of the same database (mirrors) share the template
+                settings_dict = connections[db].settings_dict
+                key = (settings_dict['ENGINE'], settings_dict['NAME'])
+                if settings_dict['NAME'] in ('', ':memory:'):
+                    key = db
+                if key not in templates:
+                    templates[key] = DatabaseTemplate(db)
+                self.database_templates[db] = templates[key]
+        return old_config
+
+    def _reusing_create_test_db(self, db, fingerprints):
+        """
+        returns create_test_db replacement reusing the test database when its
+        fingerprint matches the one stored by the previous run
+        """
+        connection = connections[db]
+        create_test_db = connection.creation.create_test_db
+
+        def reusing_create_test_db(verbosity=1, autoclobber=False):
+            start = time.time()
+            fingerprint = schema_fingerprint(db)
+            name = connection.creation._get_test_db_name()
+            action = 'rebuilt'
+            if fingerprints.get(name) == fingerprint and reuse_test_db(connection):
+                action = 'reused'
+            else:
+                name = create_test_db(verbosity, autoclobber=True)
+            fingerprints.discard(name)
+            fingerprints.save()
+            self.database_fingerprints[db] = (fingerprints, name, fingerprint)
+            self.database_setup.append((db, action, time.time() - start))
+            return name
+
+        return reusing_create_test_db
+
+    def fingerprints_path(self):
+        path = getattr(settings, 'TEST_REUSE_DB_FILE', None)
+        if path is None and hasattr(settings, 'APPLICATION_ROOT'):
+            import unipath
+            path = unipath.Path(settings.APPLICATION_ROOT).child('.test-databases')
+        return str(path or '.test-databases')
+
+    def teardown_databases(self, old_config, **kwargs):
+        """
+        destroys test databases and then exports phases of the run to
+        TEST_PHASES_FILE - after their teardown was timed too
+        """
+        self.begin_phase('database teardown')
+        try:
+            self._teardown_databases(old_config, **kwargs)
+        finally:
+            self.end_phase()
+        path = getattr(settings, 'TEST_PHASES_FILE', None)
+        if path and self.phase_timer is not None:
+            self.phase_timer.export(str(path))
+
+    def _teardown_databases(self, old_config, **kwargs):
+        if getattr(self, 'database_fingerprints', None):
+            # kept databases are left in the state they had after setup
+            self.flush_databases()
+            for fingerprints, name, fingerprint in self.database_fingerprints.values():
+                fingerprints.set(name, fingerprint)
+                fingerprints.save()
+            self.database_fingerprints = {}
+        for template in set(self.database_templates.values()):
+            template.destroy()
+        self.database_templates = {}
+        super(ColorDjangoTestSuiteRunner, self).teardown_databases(old_config, **kwargs)
 
 
     @staticmethod
@@ -326,16 +1332,18 @@ class ColorProfilerDjangoTestSuiteRunner(ColorDjangoTestSuiteRunner):
     Support for coloring error output
     """
     def run_suite(self, suite, **kwargs):
-        import cProfile
         import unipath
         import StringIO
 
         use_profiler = True
         try:
-            import pstats
+            from colortools.profiling import ColorStats
         except:
             use_profiler = False
 
+        if use_profiler and getattr(settings, 'TEST_PROFILE', 'run') == 'test':
+            return self.run_suite_profiling_tests(suite, **kwargs)
+
         result = []
         def _profile_run():
             result.append(super(ColorProfilerDjangoTestSuiteRunner,
@@ -345,56 +1353,11 @@ class ColorProfilerDjangoTestSuiteRunner(ColorDjangoTestSuiteRunner):
             root = unipath.Path(settings.APPLICATION_ROOT)
             profile_file = root.child('.profiler')
 
-            class ColorStats(pstats.Stats):
-                def __init__(self, *args, **kwargs):
-                    pstats.Stats.__init__(self, *args, **kwargs)
-
-                    class dummy(object): pass
-                    style = dummy()
-                    style.LONGRUN = termcolors.make_style(opts=('bold',), fg='red')
-                    style.NAME = termcolors.make_style(opts=('bold',), fg='cyan')
-                    style.FILE = termcolors.make_style(opts=('bold',), fg='yellow')
-                    style.APP = termcolors.make_style(opts=('bold',), fg='white')
-                    self.style = style
-
-                def print_title(self):
-                    print >> self.stream, 'calls  cumtime  percall',
-                    print >> self.stream, 'filename:lineno(function)'
-
-                def print_line(self, func):  # hack : should print percentages
-                    cc, nc, tt, ct, callers = self.stats[func] #@UnusedVariable
-                    c = str(nc)
-                    if nc != cc:
-                        c = c + '/' + str(cc)
-                    print >> self.stream, c.rjust(5),
-                    print >> self.stream, pstats.f8(ct),
-                    if cc == 0:
-                        print >> self.stream, ' '*8,
-                    else:
-                        percall = float(ct) / cc
-                        result = pstats.f8(percall)
-                        if percall > 0.1:
-                            result = self.style.LONGRUN(result)
-                        print >> self.stream, result,
-                    print >> self.stream, self.func_std_string(func)
-
-                def func_std_string(self, func_name): # match what old profile produced
-                    if func_name[:2] == ('~', 0):
-                        # special case for built-in functions
-                        name = func_name[2]
-                        if name.startswith('<') and name.endswith('>'):
-                            return '{%s}' % name[1:-1]
-                        else:
-                            return name
-                    else:
-                        file, line, name = func_name
-                        file = unipath.Path(file)
-                        return ("%s (%s:%d [%s])" %
-                            (self.style.NAME(name),
-                             self.style.FILE(file.name), line,
-                             self.style.APP(file.parent.parent.name)))
-
-            cProfile.runctx('profile_run()', {'profile_run':_profile_run}, {}, str(profile_file))
+            profile = self.profile_factory()()
+            profile.runcall(_profile_run)
+            profile.dump_stats(str(profile_file))
+            if hasattr(profile, 'dump_collapsed'):
+                profile.dump_collapsed(str(profile_file) + '.collapsed')
 
             results = StringIO.StringIO()
             stats = ColorStats(str(profile_file), stream=results)
@@ -408,3 +1371,138 @@ class ColorProfilerDjangoTestSuiteRunner(ColorDjangoTestSuiteRunner):
         self.print_fixture_statistics()
 
         return result[0]
+
+    def profile_factory(self):
+        """
+        returns profile class for TEST_PROFILER setting - 'cprofile' (default)
+        or 'sampling' for a low overhead statistical profiler sampling stacks
+        every TEST_PROFILE_INTERVAL seconds
+        """
+        if getattr(settings, 'TEST_PROFILER', 'cprofile') == 'sampling':
+            from colortools.sampling import SamplingProfile
+            interval = getattr(settings, 'TEST_PROFILE_INTERVAL', 0.005)
+            mode = getattr(settings, 'TEST_PROFILE_SAMPLER', 'thread')
+            return lambda: SamplingProfile(interval, mode)
+
+        import cProfile
+        return cProfile.Profile
+
+    def run_suite_profiling_tests(self, suite, **kwargs):
+        """
+        Profiles tests one by one. Only TEST_PROFILE_SLOWEST tests with the
+        longest durations recorded in previous runs or tests matching
+        TEST_PROFILE_LABELS are profiled if those settings are given.
+        """
+        import unipath
+        import StringIO
+        from colortools.profiling import ColorStats, TestProfiler, matches_label
+
+        directory = getattr(settings, 'TEST_PROFILE_DIR', None)
+        if directory is None:
+            directory = unipath.Path(settings.APPLICATION_ROOT).child('.profiler-tests')
+        profiler = TestProfiler(str(directory),
+                scope=getattr(settings, 'TEST_PROFILE_SCOPE', 'test'),
+                threshold=getattr(settings, 'TEST_PROFILE_THRESHOLD', 0),
+                profile_factory=self.profile_factory())
+
+        tests = list(suite)
+        labels = getattr(settings, 'TEST_PROFILE_LABELS', None)
+        if labels:
+            tests = [test for test in tests
+                     if [label for label in labels if matches_label(test, label)]]
+
+        selected = None
+        slowest = getattr(settings, 'TEST_PROFILE_SLOWEST', 0)
+        history = self.duration_history()
+        if slowest and history is not None:
+            durations = [(history.median(test.id()) or 0, test.id())
+                         for test in tests]
+            durations.sort(reverse=True)
+            selected = set([test_id for seconds, test_id in durations[:slowest]])
+        profiler.install(tests, selected)
+
+        # profiles are collected in this process
+        self.test_groups = []
+        result = super(ColorProfilerDjangoTestSuiteRunner, self).run_suite(suite, **kwargs)
+
+        merged = profiler.dump_merged()
+        if merged is not None:
+            results = StringIO.StringIO()
+            stats = ColorStats(merged, stream=results)
+            stats.sort_stats('cumulative')
+            stats.print_stats(getattr(settings, 'TEST_PROFILE_LINES', 40))
+            print results.getvalue()
+
+        print("Profiled %s tests, profiles written for %s of them:" % (
+                profiler.profiled, len(profiler.files)))
+        for elapsed, path in sorted(profiler.files, reverse=True):
+            print("    %8.3fs %s" % (elapsed, path))
+
+        self.print_fixture_statistics()
+
+        return result
+
+
+class ColorWatchDjangoTestSuiteRunner(ColorDjangoTestSuiteRunner):
+    """
+    Keeps the interpreter and test databases between runs. Tests are run
+    again whenever a module under APPLICATION_ROOT or a fixture changes -
+    changed and test modules are reloaded first. Stop it with Ctrl-C.
+    """
+
+    def run_tests(self, test_labels, extra_tests=None, **kwargs):
+        import traceback
+        from colortools.watch import SourceWatcher, reload_modules
+
+        self.setup_test_environment()
+        suite = self.build_suite(test_labels, extra_tests)
+        old_config = self.setup_databases()
+        watcher = SourceWatcher(getattr(settings, 'APPLICATION_ROOT', None) or os.getcwd())
+        test_modules = set()
+        result = None
+        try:
+            while True:
+                if suite is not None:
+                    test_modules.update([test.__class__.__module__ for test in suite])
+                    result = self.run_suite(suite)
+                print("Waiting for changes, press Ctrl-C to stop...")
+                changed = watcher.wait(getattr(settings, 'TEST_WATCH_INTERVAL', 0.5))
+                start = time.time()
+                fixtures_changed = [path for path in changed if not path.endswith('.py')]
+                try:
+                    skipped = reload_modules(changed, sorted(test_modules))
+                    suite = self.rebuild_suite(test_labels, extra_tests,
+                                               keep_fixtures=not fixtures_changed)
+                except Exception:
+                    # broken module - wait until it's fixed
+                    traceback.print_exc()
+                    suite = None
+                    continue
+                for name in skipped:
+                    print("%s changed - restart to use new models" % name)
+                print("Reloaded %s changed files in %.3fs" % (len(changed),
+                                                              time.time() - start))
+        except KeyboardInterrupt:
+            print("")
+        finally:
+            self.teardown_databases(old_config)
+            self.teardown_test_environment()
+        if result is None:
+            return 1
+        return self.suite_result(suite, result)
+
+    def rebuild_suite(self, test_labels, extra_tests=None, keep_fixtures=True):
+        """
+        builds the suite again keeping database templates and, unless
+        fixture files changed, fixtures left loaded by the previous run
+        """
+        templates = self.database_templates
+        database_fixtures = self.database_fixtures
+        fixture_loader = self.fixture_loader
+        suite = self.build_suite(test_labels, extra_tests)
+        self.database_templates = templates
+        if keep_fixtures:
+            self.database_fixtures = database_fixtures
+            if fixture_loader is not None:
+                self.fixture_loader = fixture_loader
+        return suite
@@ -1,3 +1,35 @@
 from colortools.tests.test import ColorTextTestResultTestCase
+from colortools.tests.test import ColorDecoratorTestCase
 from colortools.tests.test import ColorDjangoTestSuiteRunnerTestCase
 from colortools.tests.test import FixtureListFunctionTestCase
+from colortools.tests.test import FixtureLayersTestCase
+from colortools.tests.test import TransactionStateTestCase
+from colortools.tests.ordering import FixtureTrieTestCase
+from colortools.tests.ordering import SimulateFunctionTestCase
+from colortools.tests.snapshots import SnapshotCacheTestCase
+from colortools.tests.loader import FixtureLoaderTestCase
+from colortools.tests.loader import NaturalKeysFunctionTestCase
+from colortools.tests.durations import DurationHistoryTestCase
+from colortools.tests.durations import DurationReportTestCase
+from colortools.tests.profiling import MatchesLabelFunctionTestCase
+from colortools.tests.profiling import TestProfilerTestCase
+from colortools.tests.sampling import SamplingProfileTestCase
+from colortools.tests.queries import QueryLogTestCase
+from colortools.tests.flushing import WrittenTableFunctionTestCase
+from colortools.tests.flushing import TableTrackerTestCase
+from colortools.tests.parallel import ForEachDatabaseFunctionTestCase
+from colortools.tests.parallel import ThreadedDatabasesTestCase
+from colortools.tests.parallel import DatabaseTemplateTestCase
+from colortools.tests.parallel import ParallelSuiteTestCase
+from colortools.tests.parallel import WorkerDatabasesTestCase
+from colortools.tests.reuse import DatabaseFingerprintsTestCase
+from colortools.tests.reuse import SchemaFingerprintFunctionTestCase
+from colortools.tests.reports import JSONLinesWriterTestCase
+from colortools.tests.reports import JUnitXMLWriterTestCase
+from colortools.tests.sharding import ParseShardFunctionTestCase
+from colortools.tests.sharding import ShardPlanTestCase
+from colortools.tests.selection import CoverageMapTestCase
+from colortools.tests.watch import SourceWatcherTestCase
+from colortools.tests.memory import MemoryLogTestCase
+from colortools.tests.benchmark import BenchmarkTestCase
+from colortools.tests.phases import PhaseTimerTestCase
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from colortools.benchmark import (DEFAULTS, ResultsFile, compare, fixture_lists,
+                                  generate_app)
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.scenario = dict(DEFAULTS, cases=10, fixtures=4, models=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fixture_lists_should_be_reproducible(self):
+        lists = fixture_lists(self.scenario)
+        self.assertEqual(len(lists), 10)
+        self.assertEqual(lists, fixture_lists(self.scenario))
+        for fixtures in lists:
+            self.assertEqual(len(fixtures), len(set(fixtures)))
+
+    def test_app_should_be_generated(self):
+        generate_app(self.dir, self.scenario)
+        package = os.path.join(self.dir, 'colortools_benchmark')
+        self.assertEqual(sorted(os.listdir(os.path.join(package, 'fixtures'))),
+                         ['fixture0.json', 'fixture1.json', 'fixture2.json',
+                          'fixture3.json'])
+        source = open(os.path.join(package, 'tests.py')).read()
+        self.assertEqual(source.count('class Case'), 10)
+
+    def test_previous_result_of_scenario_should_be_found(self):
+        results = ResultsFile(os.path.join(self.dir, 'results.jsonl'))
+        self.assertEqual(results.previous('a'), None)
+        results.append({'scenario_id': 'a', 'wall': 1})
+        results.append({'scenario_id': 'b', 'wall': 2})
+        results.append({'scenario_id': 'a', 'wall': 3})
+        self.assertEqual(results.previous('a')['wall'], 3)
+
+    def test_compare_should_show_change(self):
+        metrics = dict(wall=1.5, fixture_setup=1, flushes=1, fixtures_loaded=1,
+                       queries=1, output_per_1000=1)
+        lines = compare(metrics, dict(metrics, wall=1.0))
+        self.assertTrue('+50.0%' in lines[0])
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from django.test import TestCase
+
+from colortools.durations import DurationHistory, DurationReport, median
+
+
+def _test(test_id):
+    test = Mock()
+    test.id.return_value = test_id
+    return test
+
+
+class DurationHistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '.durations')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_missing_file_should_give_empty_history(self):
+        self.assertEqual(DurationHistory(self.path).median('test'), None)
+
+    def test_history_should_keep_last_durations(self):
+        history = DurationHistory(self.path, size=2)
+        for seconds in (1, 2, 3):
+            history.record('test', seconds)
+        history.save()
+        self.assertEqual(DurationHistory(self.path).durations['test'], [2, 3])
+
+    def test_median(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+
+
+class DurationReportTestCase(TestCase):
+
+    def test_slower_tests_should_be_regressions(self):
+        history = Mock()
+        history.median.return_value = 0.1
+        slow, fast = _test('slow'), _test('fast')
+        report = DurationReport([(slow, 1.0), (fast, 0.12)], {}, history)
+        self.assertEqual(report.regressions, [(slow, 1.0, 0.1)])
+
+    def test_slowest_tests_should_be_sorted(self):
+        one, two = _test('one'), _test('two')
+        report = DurationReport([(one, 0.1), (two, 0.2)], {('f',): 0.3})
+        self.assertEqual(report.slowest_tests(1), [(two, 0.2)])
+        self.assertEqual(report.fixture_total(), 0.3)
@@ -0,0 +1,91 @@
+from mock import Mock
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.db import DEFAULT_DB_ALIAS
+from django.test import TestCase
+
+from colortools.flushing import TableTracker, clear_tables, written_table
+from colortools.snapshots import FixtureSnapshot, dump_tables
+
+
+class WrittenTableFunctionTestCase(TestCase):
+
+    def test_writes_should_give_table(self):
+        self.assertEqual(written_table('INSERT INTO "app_item" ("id") VALUES (%s)'),
+                         'app_item')
+        self.assertEqual(written_table('UPDATE `app_item` SET `name` = %s'),
+                         'app_item')
+        self.assertEqual(written_table(' delete from app_item WHERE id = 1'),
+                         'app_item')
+
+    def test_reads_should_give_none(self):
+        self.assertEqual(written_table('SELECT * FROM "app_item"'), None)
+
+
+class TableTrackerTestCase(TestCase):
+
+    def test_writes_should_be_tracked_between_begin_and_end(self):
+        tracker = TableTracker()
+        tracker.begin([DEFAULT_DB_ALIAS])
+        try:
+            Site.objects.create(domain='tracked.com', name='tracked')
+        finally:
+            tracker.end()
+        Site.objects.count()
+        self.assertEqual(tracker.written, {DEFAULT_DB_ALIAS: set(['django_site'])})
+
+    def test_cleared_tables_should_get_rows_of_baseline(self):
+        baseline = dict([(table, (columns, rows)) for table, columns, rows
+                         in dump_tables(DEFAULT_DB_ALIAS)])
+        Site.objects.create(domain='cleared.com', name='cleared')
+        clear_tables(DEFAULT_DB_ALIAS, ['django_site'], baseline)
+        self.assertEqual(list(Site.objects.values_list('domain', flat=True)),
+                         ['example.com'])
+
+    def test_restored_snapshot_should_mark_its_tables_written(self):
+        tracker = TableTracker()
+        tracker.written = {DEFAULT_DB_ALIAS: set(['django_site'])}
+        tracker.restored(DEFAULT_DB_ALIAS, [('app_item', ['id'], [(1,)])])
+        self.assertEqual(tracker.written[DEFAULT_DB_ALIAS],
+                         set(['django_site', 'app_item']))
+
+    def test_invalidated_database_should_be_fully_flushed(self):
+        flushed = []
+        tracker = TableTracker(full_flush=flushed.append)
+        tracker.baseline = {DEFAULT_DB_ALIAS: {}, 'other': {}}
+        tracker.invalidate(DEFAULT_DB_ALIAS)
+        self.assertEqual(tracker.baseline.keys(), ['other'])
+        tracker.flush(DEFAULT_DB_ALIAS)
+        self.assertEqual(flushed, [DEFAULT_DB_ALIAS])
+        self.assertEqual((tracker.full_flushes, tracker.partial_flushes), (1, 0))
+
+    def snapshot(self, tracker):
+        tracker.baseline = {DEFAULT_DB_ALIAS: dict([
+                (table, (columns, rows)) for table, columns, rows
+                in dump_tables(DEFAULT_DB_ALIAS)])}
+        Site.objects.create(domain='loaded.com', name='loaded')
+        tracker.written = {DEFAULT_DB_ALIAS: set(['django_site'])}
+        snapshot = FixtureSnapshot(['f1'], [DEFAULT_DB_ALIAS], tracker)
+        snapshot.restore = Mock()
+        Site.objects.create(domain='test.com', name='test')
+        ContentType.objects.create(name='test', app_label='test', model='test')
+        tracker.written[DEFAULT_DB_ALIAS].add('django_content_type')
+        return snapshot
+
+    def test_snapshot_should_restore_written_tables(self):
+        tracker = TableTracker()
+        snapshot = self.snapshot(tracker)
+        tracker.restore(snapshot, DEFAULT_DB_ALIAS)
+        self.assertFalse(snapshot.restore.called)
+        self.assertEqual(sorted(Site.objects.values_list('domain', flat=True)),
+                         ['example.com', 'loaded.com'])
+        self.assertFalse(ContentType.objects.filter(app_label='test').exists())
+        self.assertEqual(tracker.cleared_tables, 2)
+        self.assertEqual(tracker.written[DEFAULT_DB_ALIAS], set(['django_site']))
+
+    def test_snapshot_of_other_baseline_should_be_fully_restored(self):
+        tracker = TableTracker()
+        snapshot = self.snapshot(tracker)
+        tracker.baseline = {DEFAULT_DB_ALIAS: {}}
+        tracker.restore(snapshot, DEFAULT_DB_ALIAS)
+        snapshot.restore.assert_called_once_with([DEFAULT_DB_ALIAS])
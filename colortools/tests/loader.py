@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from django.utils import simplejson
+
+from colortools.loader import FixtureLoader, _uses_natural_keys
+
+
+class FixtureLoaderTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.loader = FixtureLoader(max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def fixture(self, name, content):
+        path = os.path.join(self.dir, name)
+        stream = open(path, 'w')
+        stream.write(content)
+        stream.close()
+        return path
+
+    def test_absolute_label_should_be_found(self):
+        path = self.fixture('one.json', '[]')
+        self.assertEqual(self.loader.find(path[:-len('.json')], 'default'),
+                         [(path, 'json')])
+
+    def test_unsupported_format_should_fall_back_to_loaddata(self):
+        path = self.fixture('one.xml', '<django-objects/>')
+        self.assertEqual(self.loader.find(path[:-len('.xml')], 'default'), None)
+
+    def test_compressed_fixture_should_fall_back_to_loaddata(self):
+        path = self.fixture('one.json.gz', '')
+        self.assertEqual(self.loader.find(path[:-len('.json.gz')], 'default'), None)
+
+    def test_parsed_file_should_be_cached(self):
+        path = self.fixture('one.json', '[]')
+        self.loader.parse(path, 'json')
+        self.loader.parse(path, 'json')
+        self.assertEqual((self.loader.hits, self.loader.misses), (1, 1))
+
+    def test_cache_should_respect_size_limit(self):
+        one = self.fixture('one.json', '[]' + ' ' * 60)
+        two = self.fixture('two.json', '[]' + ' ' * 60)
+        self.loader.parse(one, 'json')
+        self.loader.parse(two, 'json')
+        self.assertEqual(self.loader.cache.keys(), [two])
+
+    def test_parse_should_be_safe_in_threads(self):
+        paths = [self.fixture('one.json', '[]' + ' ' * 60),
+                 self.fixture('two.json', '[]' + ' ' * 60)]
+        errors = []
+
+        def parse():
+            try:
+                for i in range(100):
+                    self.loader.parse(paths[i % 2], 'json')
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=parse) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.loader.hits + self.loader.misses, 400)
+        self.assertEqual(len(self.loader.order), 1)
+
+    def test_objects_should_be_inserted(self):
+        permissions = list(Permission.objects.values_list('pk', flat=True)[:2])
+        path = self.fixture('data.json', simplejson.dumps([
+            {'model': 'sites.site', 'pk': 1,
+             'fields': {'domain': 'changed.com', 'name': 'changed'}},
+            {'model': 'sites.site', 'pk': 50,
+             'fields': {'domain': 'new.com', 'name': 'new'}},
+            {'model': 'auth.group', 'pk': 50,
+             'fields': {'name': 'group', 'permissions': permissions}},
+        ]))
+        self.loader.max_size = 10000
+        self.loader.load([path[:-len('.json')]], 'default', commit=False)
+        self.assertEqual(Site.objects.get(pk=1).domain, 'changed.com')
+        self.assertEqual(Site.objects.get(pk=50).domain, 'new.com')
+        self.assertEqual(sorted(Group.objects.get(pk=50).permissions.values_list(
+                                                        'pk', flat=True)),
+                         sorted(permissions))
+
+    def test_cached_objects_should_not_keep_state_of_loads(self):
+        path = self.fixture('data.json', simplejson.dumps([
+            {'model': 'sites.site', 'pk': None,
+             'fields': {'domain': 'new.com', 'name': 'new'}},
+        ]))
+        self.loader.max_size = 10000
+        label = path[:-len('.json')]
+        self.loader.load([label], 'default', commit=False)
+        self.loader.load([label], 'default', commit=False)
+        self.assertEqual(self.loader.hits, 1)
+        self.assertEqual(Site.objects.filter(domain='new.com').count(), 2)
+        self.assertEqual(self.loader.cache[path].objects[0].object.pk, None)
+
+
+class NaturalKeysFunctionTestCase(TestCase):
+
+    def test_primary_keys_are_not_natural(self):
+        self.assertFalse(_uses_natural_keys([{'model': 'auth.permission',
+                'fields': {'content_type': 1, 'codename': 'x', 'name': 'x'}}]))
+
+    def test_foreign_key_list_is_natural(self):
+        self.assertTrue(_uses_natural_keys([{'model': 'auth.permission',
+                'fields': {'content_type': ['auth', 'user']}}]))
+
+    def test_many_to_many_list_of_lists_is_natural(self):
+        self.assertTrue(_uses_natural_keys([{'model': 'auth.user',
+                'fields': {'user_permissions': [['add_user', 'auth', 'user']]}}]))
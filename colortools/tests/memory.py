@@ -0,0 +1,73 @@
+from mock import Mock, patch
+from django.test import TestCase
+
+from colortools.memory import MemoryLog, object_counts, peak_memory, resident_memory
+
+
+def _test(test_id):
+    test = Mock()
+    test.id.return_value = test_id
+    return test
+
+
+class MemoryLogTestCase(TestCase):
+
+    def test_resident_memory_should_be_positive(self):
+        self.assertTrue(resident_memory() > 0)
+
+    @patch('sys.platform', 'darwin')
+    @patch('resource.getrusage')
+    def test_peak_memory_should_be_bytes_on_mac(self, getrusage):
+        getrusage.return_value.ru_maxrss = 4096
+        self.assertEqual(peak_memory(), 4096)
+
+    @patch('sys.platform', 'linux2')
+    @patch('resource.getrusage')
+    def test_peak_memory_should_be_kilobytes_on_linux(self, getrusage):
+        getrusage.return_value.ru_maxrss = 4096
+        self.assertEqual(peak_memory(), 4096 * 1024)
+
+    def test_object_counts_should_name_types(self):
+        self.assertTrue(object_counts()['dict'] > 0)
+
+    @patch('colortools.memory.resident_memory')
+    def test_growth_should_be_recorded(self, resident_memory):
+        log = MemoryLog()
+        resident_memory.side_effect = [100, 300, 300, 350]
+        log.startTest(_test('a'))
+        log.stopTest(_test('a'))
+        log.begin(('f1',))
+        log.end()
+        self.assertEqual(log.tests, {'a': 200})
+        self.assertEqual(log.fixtures, {('f1',): 50})
+
+    def test_sampled_tests_should_count_objects(self):
+        log = MemoryLog(sample=2, keep=1)
+        retained = []
+        for test_id in ('a', 'b', 'c', 'd'):
+            log.startTest(_test(test_id))
+            retained.append(dict())
+            log.stopTest(_test(test_id))
+        self.assertEqual(len(log.objects), 1)
+        self.assertTrue(log.objects.keys()[0] in ('b', 'd'))
+
+    def test_merge_should_add_fixture_growth(self):
+        log = MemoryLog()
+        log.fixtures = {('f1',): 10}
+        log.merge({'tests': {'a': 5}, 'fixtures': {('f1',): 20}, 'objects': {}})
+        self.assertEqual(log.fixtures, {('f1',): 30})
+        self.assertEqual(log.tests, {'a': 5})
+
+    def test_report_should_list_largest_growth(self):
+        log = MemoryLog()
+        log.tests = {'a': 2048, 'b': 4096}
+        stream = Mock()
+        log.write(stream)
+        lines = [call[0][0] for call in stream.writeln.call_args_list if call[0]]
+        self.assertEqual(lines[1:3], [' b', ' a'])
+
+    @patch('colortools.memory.PEAK_ONLY', True)
+    def test_report_should_tell_peak_sizes(self):
+        stream = Mock()
+        MemoryLog().write(stream)
+        self.assertTrue('of peak size' in stream.writeln.call_args_list[1][0][0])
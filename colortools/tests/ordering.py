@@ -0,0 +1,76 @@
+from django.test import TestCase
+
+from colortools.ordering import FixtureTrie, simulate
+
+
+class _Test(object):
+
+    def __init__(self, name, fixtures=None):
+        self.name = name
+        if fixtures is not None:
+            self.fixtures = fixtures
+
+    def __repr__(self):
+        return self.name
+
+
+class FixtureTrieTestCase(TestCase):
+
+    def test_tests_sharing_prefix_should_be_grouped(self):
+        trie = FixtureTrie([_Test('a', ['one', 'two']), _Test('b', ['three']),
+                            _Test('c', ['one']), _Test('d', ['one', 'two'])])
+        self.assertEqual([t.name for t in trie.tests()], ['c', 'a', 'd', 'b'])
+
+    def test_tests_without_fixtures_should_go_first(self):
+        trie = FixtureTrie([_Test('a', ['one']), _Test('b')])
+        self.assertEqual([t.name for t in trie.tests()], ['b', 'a'])
+
+    def test_lists_and_tuples_should_share_node(self):
+        trie = FixtureTrie([_Test('a', ['one']), _Test('b', ('one', 'two')),
+                            _Test('c', ('one',))])
+        groups = list(trie.groups())
+        self.assertEqual(len(groups), 2)
+        self.assertEqual([t.name for t in groups[0][1]], ['a', 'c'])
+
+    def test_plan_should_count_flushes_and_loads(self):
+        trie = FixtureTrie([_Test('a', ['one', 'two']), _Test('b', ['three']),
+                            _Test('c', ['one']), _Test('d', ['one', 'two'])])
+        plan = trie.plan()
+        self.assertEqual(plan.flushes, 1)
+        self.assertEqual(plan.fixtures, 3)
+        self.assertEqual(plan.fixtures_prevented, 1 + 2)
+
+    def test_segments_should_split_on_flush(self):
+        trie = FixtureTrie([_Test('a', ['one', 'two']), _Test('b', ['three']),
+                            _Test('c', ['one']), _Test('d', ['one', 'four'])])
+        self.assertEqual([[t.name for t in segment] for segment in trie.segments()],
+                         [['b'], ['c', 'd'], ['a']])
+
+    def test_branches_should_go_last(self):
+        tests = [_Test('a', ['one', 'two', 'three']), _Test('b', ['one', 'two', 'four']),
+                 _Test('c', ['one', 'zero'])]
+        trie = FixtureTrie(tests, snapshots=1)
+        self.assertEqual([t.name for t in trie.tests()], ['c', 'b', 'a'])
+
+        # the old comparator sorted fixture lists
+        old = simulate(sorted([t.fixtures for t in tests]), 1, trie.branch_prefixes())
+        plan = trie.plan()
+        self.assertEqual((old.flushes, old.fixtures, old.restores), (2, 6, 1))
+        self.assertEqual((plan.flushes, plan.fixtures, plan.restores), (2, 5, 2))
+
+
+class SimulateFunctionTestCase(TestCase):
+
+    def test_empty_should_cost_nothing(self):
+        plan = simulate([])
+        self.assertEqual((plan.flushes, plan.fixtures), (0, 0))
+
+    def test_diverging_lists_should_flush(self):
+        plan = simulate([['one', 'two'], ['one', 'three']])
+        self.assertEqual(plan.flushes, 1)
+        self.assertEqual(plan.fixtures, 4)
+
+    def test_snapshots_should_be_restored(self):
+        plan = simulate([['one', 'two'], ['one', 'three']], 1, [('one',)])
+        self.assertEqual((plan.flushes, plan.fixtures, plan.restores), (1, 3, 1))
+        self.assertEqual(plan.fixtures_prevented, 1)
@@ -0,0 +1,243 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from mock import Mock, patch
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import ConnectionHandler
+from django.utils import unittest
+
+from colortools.queries import QueryLog
+from colortools.parallel import (DatabaseTemplate, ParallelSuite,
+                                 clone_test_databases, destroy_test_database_clones,
+                                 for_each_database, setup_worker_databases,
+                                 worker_database_name)
+
+
+class ForEachDatabaseFunctionTestCase(TestCase):
+
+    def test_function_should_be_called_for_every_database(self):
+        called = []
+        for_each_database(called.append, list(connections))
+        self.assertEqual(sorted(called), sorted(connections))
+
+    def test_errors_should_be_raised(self):
+        def fail(db):
+            raise ValueError(db)
+        self.assertRaises(ValueError, for_each_database, fail, list(connections))
+
+    def test_worker_database_name(self):
+        self.assertEqual(worker_database_name('test_db', 2), 'test_db_2')
+
+
+class ThreadedDatabasesTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = [os.path.join(self.dir, name) for name in ('one.db', 'two.db')]
+        self.connections = ConnectionHandler(dict([
+            (alias, {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path})
+            for alias, path in zip(('one', 'two'), self.files)]))
+        self.patchers = [patch('colortools.parallel.connections', self.connections),
+                         patch('colortools.queries.connections', self.connections)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        for alias in self.connections:
+            self.connections[alias].close()
+        shutil.rmtree(self.dir)
+
+    def test_independent_databases_should_be_processed_in_threads(self):
+        threads = []
+
+        def create(db):
+            threads.append(threading.current_thread())
+            self.connections[db].cursor().execute('CREATE TABLE t (x integer)')
+
+        for_each_database(create, ['one', 'two'])
+        self.assertEqual(len(set(threads)), 2)
+        self.assertFalse(threading.current_thread() in threads)
+        for path in self.files:
+            tables = sqlite3.connect(path).execute(
+                        "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+            self.assertEqual(tables, [(u't',)])
+
+    def test_queries_of_threads_should_be_counted(self):
+        log = QueryLog()
+        log.install()
+        try:
+            log.begin(log.fixtures, ('f1',))
+            for_each_database(lambda db: self.connections[db].cursor().execute('SELECT 1'),
+                              ['one', 'two'], [log.setup_thread])
+            log.end()
+        finally:
+            log.uninstall()
+        self.assertEqual(log.fixtures[('f1',)].count, 2)
+
+
+class DatabaseTemplateTestCase(TestCase):
+
+    def test_postgresql_restore_should_close_aliases_of_the_database(self):
+        databases = {'default': _connection('postgresql', 'test_db'),
+                     'mirror': _connection('postgresql', 'test_db'),
+                     'other': _connection('postgresql', 'test_other')}
+        patcher = patch('colortools.parallel.connections', databases)
+        patcher.start()
+        try:
+            template = DatabaseTemplate('default')
+            for connection in databases.values():
+                connection.close.reset_mock()
+            template.restore()
+        finally:
+            patcher.stop()
+        self.assertTrue(databases['mirror'].close.called)
+        self.assertFalse(databases['other'].close.called)
+        self.assertEqual(databases['default'].settings_dict['NAME'], 'test_db')
+
+    def test_restore_should_bring_back_copied_state(self):
+        template = DatabaseTemplate(DEFAULT_DB_ALIAS)
+        try:
+            Site.objects.create(domain='added.com', name='added')
+            template.restore()
+            self.assertEqual(list(Site.objects.values_list('domain', flat=True)),
+                             ['example.com'])
+        finally:
+            template.destroy()
+
+
+class _Sample(unittest.TestCase):
+
+    def test_pass(self):
+        pass
+
+    def test_fail(self):
+        self.fail('failed')
+
+    def test_exit(self):
+        os._exit(3)
+
+
+class _Result(object):
+    """records events replayed by ParallelSuite"""
+
+    def __init__(self, failfast=False):
+        self.failfast = failfast
+        self.shouldStop = False
+        self.events = []
+
+    def __getattr__(self, event):
+        def record(test, *args):
+            self.events.append((event, test._testMethodName))
+            if event == 'addFailure' and self.failfast:
+                self.shouldStop = True
+        return record
+
+
+def _runner():
+    runner = Mock()
+    runner.database_templates = {}
+    runner.test_listeners.return_value = []
+    runner.fixture_statistics.return_value = {}
+    return runner
+
+
+class ParallelSuiteTestCase(TestCase):
+
+    @patch('colortools.parallel.clone_test_databases', Mock(return_value=[]))
+    @patch('colortools.parallel.setup_worker_databases', Mock(return_value=[]))
+    def test_results_of_workers_should_be_replayed(self):
+        runner = _runner()
+        suite = ParallelSuite(runner, [[_Sample('test_pass')],
+                                       [_Sample('test_fail')]], 2)
+        result = _Result()
+        suite.run(result)
+        events = sorted([event for event in result.events
+                         if event[0] != 'addDuration'])
+        self.assertEqual(events, [('addFailure', 'test_fail'),
+                                  ('addSuccess', 'test_pass'),
+                                  ('startTest', 'test_fail'),
+                                  ('startTest', 'test_pass'),
+                                  ('stopTest', 'test_fail'),
+                                  ('stopTest', 'test_pass')])
+        self.assertEqual(runner.merge_fixture_statistics.call_count, 2)
+
+    @patch('colortools.parallel.clone_test_databases', Mock(return_value=[]))
+    @patch('colortools.parallel.setup_worker_databases', Mock(return_value=[]))
+    def test_tests_of_dead_worker_should_be_errors(self):
+        suite = ParallelSuite(_runner(), [[_Sample('test_exit'),
+                                           _Sample('test_pass')]], 1)
+        result = _Result()
+        suite.run(result)
+        self.assertEqual(result.events, [('startTest', 'test_exit'),
+                                         ('addError', 'test_exit'),
+                                         ('stopTest', 'test_exit'),
+                                         ('startTest', 'test_pass'),
+                                         ('addError', 'test_pass'),
+                                         ('stopTest', 'test_pass')])
+
+    @patch('colortools.parallel.clone_test_databases', Mock(return_value=[]))
+    @patch('colortools.parallel.setup_worker_databases', Mock(return_value=[]))
+    def test_failfast_should_stop_worker(self):
+        suite = ParallelSuite(_runner(), [[_Sample('test_fail'),
+                                           _Sample('test_pass')]], 1)
+        result = _Result(failfast=True)
+        suite.run(result)
+        self.assertEqual([event for event in result.events
+                          if event[0] != 'addDuration'],
+                         [('startTest', 'test_fail'), ('addFailure', 'test_fail')])
+
+
+def _connection(vendor, name):
+    connection = Mock()
+    connection.vendor = vendor
+    connection.settings_dict = {'NAME': name}
+    return connection
+
+
+class WorkerDatabasesTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.name = os.path.join(self.dir, 'test.db')
+        open(self.name, 'w').write('data')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sqlite_files_should_be_cloned_for_every_worker(self):
+        databases = {'default': _connection('sqlite', self.name),
+                     'mirror': _connection('sqlite', self.name),
+                     'memory': _connection('sqlite', ':memory:')}
+        patcher = patch('colortools.parallel.connections', databases)
+        patcher.start()
+        try:
+            clones = clone_test_databases(2)
+            self.assertEqual(sorted([clone for alias, clone in clones]),
+                             [self.name + '_1', self.name + '_2'])
+            self.assertEqual(open(self.name + '_2').read(), 'data')
+            destroy_test_database_clones(clones)
+            self.assertFalse(os.path.exists(self.name + '_1'))
+        finally:
+            patcher.stop()
+
+    def test_worker_should_use_its_own_databases(self):
+        sqlite = _connection('sqlite', self.name)
+        mysql = _connection('mysql', 'test_db')
+        patcher = patch('colortools.parallel.connections',
+                           {'default': sqlite, 'other': mysql})
+        patcher.start()
+        try:
+            created = setup_worker_databases(3)
+        finally:
+            patcher.stop()
+        self.assertEqual(sqlite.settings_dict['NAME'], self.name + '_3')
+        self.assertEqual(mysql.settings_dict['TEST_NAME'], 'test_db_3')
+        self.assertTrue(mysql.creation.create_test_db.called)
+        self.assertEqual(created, [('other', 'test_db')])
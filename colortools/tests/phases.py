@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock, patch
+from django.test import TestCase
+from django.utils import simplejson
+
+from colortools.phases import PhaseTimer
+
+
+class PhaseTimerTestCase(TestCase):
+
+    @patch('colortools.phases.time')
+    def test_nested_phases_should_be_stored_under_paths(self, time):
+        time.time.side_effect = [0, 1, 3, 4, 5, 10]
+        timer = PhaseTimer()
+        timer.begin('tests')
+        timer.begin('fixture setup')
+        timer.begin('flush')
+        timer.end()
+        timer.end()
+        timer.end()
+        self.assertEqual(timer.order, ['tests/fixture setup/flush',
+                                       'tests/fixture setup', 'tests'])
+        self.assertEqual(timer.seconds['tests/fixture setup'], 4)
+        self.assertEqual(timer.exclusive('tests'), 6)
+        self.assertEqual(timer.total(), 10)
+
+    def test_tests_should_time_test_bodies(self):
+        timer = PhaseTimer()
+        timer.begin('tests')
+        timer.startTest(Mock())
+        timer.stopTest(Mock())
+        timer.end()
+        self.assertEqual(timer.counts['tests/test bodies'], 1)
+
+    def test_merge_should_take_phases_inside_running_phase(self):
+        timer = PhaseTimer()
+        timer.add('discovery', 1)
+        timer.begin('tests')
+        timer.merge({'order': ['discovery', 'tests/fixture setup'],
+                     'seconds': {'discovery': 1, 'tests/fixture setup': 2},
+                     'counts': {'discovery': 1, 'tests/fixture setup': 3}})
+        self.assertEqual(timer.seconds, {'discovery': 1, 'tests/fixture setup': 2})
+        self.assertEqual(timer.counts['tests/fixture setup'], 3)
+        self.assertEqual(timer.processes, 2)
+
+    def test_report_should_show_tree(self):
+        timer = PhaseTimer()
+        timer.add('discovery', 1)
+        timer.add('tests', 3)
+        timer.add('tests/fixture setup', 2)
+        stream = Mock()
+        timer.write(stream)
+        lines = [call[0][0] for call in stream.writeln.call_args_list if call[0]]
+        self.assertEqual(lines, ['Phases (4.000s):', ' discovery', ' tests',
+                                 '     fixture setup', '     other'])
+        self.assertTrue(('FAIL',) in [call[0] for call in stream.color.call_args_list])
+
+    def test_export_should_write_json(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'phases.json')
+            timer = PhaseTimer()
+            timer.add('tests', 3)
+            timer.add('tests/test bodies', 2)
+            timer.export(path)
+            data = simplejson.load(open(path))
+            self.assertEqual(data['total'], 3)
+            self.assertEqual(data['phases'][0], {'phase': 'tests', 'seconds': 3,
+                                                 'exclusive': 1, 'count': 1})
+        finally:
+            shutil.rmtree(directory)
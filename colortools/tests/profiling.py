@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.utils import unittest
+
+from colortools.profiling import TestProfiler, matches_label
+
+
+class _Sample(unittest.TestCase):
+
+    def test_one(self):
+        sum(range(10))
+
+    def test_two(self):
+        pass
+
+
+class MatchesLabelFunctionTestCase(TestCase):
+
+    def test_app_label_should_match_module(self):
+        self.assertTrue(matches_label(_Sample('test_one'), 'colortools'))
+        self.assertFalse(matches_label(_Sample('test_one'), 'tests'))
+        self.assertFalse(matches_label(_Sample('test_one'), 'sample'))
+        self.assertFalse(matches_label(_Sample('test_one'), 'other'))
+
+    def test_class_and_method_should_match(self):
+        self.assertTrue(matches_label(_Sample('test_one'), 'colortools._Sample'))
+        self.assertTrue(matches_label(_Sample('test_one'), 'colortools._Sample.test_one'))
+        self.assertFalse(matches_label(_Sample('test_one'), 'colortools._Sample.test_two'))
+        self.assertFalse(matches_label(_Sample('test_one'), 'colortools.Other'))
+
+
+class TestProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_tests(self, profiler, selected=None):
+        tests = [_Sample('test_one'), _Sample('test_two')]
+        profiler.install(tests, selected)
+        unittest.TestSuite(tests)(unittest.TestResult())
+        return tests
+
+    def test_every_test_should_have_own_profile(self):
+        profiler = TestProfiler(self.dir)
+        tests = self.run_tests(profiler)
+        self.assertEqual(profiler.profiled, 2)
+        self.assertTrue(os.path.exists(
+                os.path.join(self.dir, '%s.pstats' % tests[0].id())))
+        self.assertTrue(os.path.exists(profiler.dump_merged()))
+
+    def test_fast_tests_should_not_be_written(self):
+        profiler = TestProfiler(self.dir, threshold=60)
+        self.run_tests(profiler)
+        self.assertEqual(profiler.profiled, 2)
+        self.assertEqual(profiler.files, [])
+
+    def test_only_selected_tests_should_be_profiled(self):
+        profiler = TestProfiler(self.dir, scope='setup')
+        self.run_tests(profiler, selected=[_Sample('test_two').id()])
+        self.assertEqual(profiler.profiled, 1)
@@ -0,0 +1,58 @@
+from mock import Mock
+from django.test import TestCase
+
+from colortools.queries import QueryLog, QueryStats, query_limit
+
+
+def _test(test_id, max_queries=None, method='test_a'):
+    test = Mock()
+    test.id.return_value = test_id
+    test.max_queries = max_queries
+    test._testMethodName = method
+    return test
+
+
+class QueryLogTestCase(TestCase):
+
+    def test_queries_should_be_counted_per_test(self):
+        log = QueryLog()
+        test = _test('a')
+        log.record('SELECT 0', 0.1)
+        log.startTest(test)
+        log.record('SELECT 1', 0.1)
+        log.record('SELECT 1', 0.2)
+        log.stopTest(test)
+        log.record('SELECT 2', 0.1)
+        self.assertEqual(log.tests['a'].count, 2)
+        self.assertEqual(log.tests['a'].repeated(2), [(2, 'SELECT 1')])
+
+    def test_fixture_queries_should_be_counted_per_fixture_set(self):
+        log = QueryLog()
+        log.begin(log.fixtures, ('f1',))
+        log.record('INSERT', 0.1)
+        log.end()
+        self.assertEqual(log.fixtures[('f1',)].count, 1)
+        self.assertEqual(log.tests, {})
+
+    def test_verify_should_fail_test_over_limit(self):
+        log = QueryLog(max_queries=1)
+        test = _test('a')
+        log.startTest(test)
+        log.record('SELECT 1', 0)
+        self.assertEqual(log.verify(test), None)
+        log.record('SELECT 1', 0)
+        self.assertTrue(log.verify(test).startswith('QueryLimitExceeded'))
+
+    def test_limit_of_test_should_override_default(self):
+        self.assertEqual(query_limit(_test('a', 3)), 3)
+        self.assertEqual(query_limit(_test('a', {'test_a': 2})), 2)
+        self.assertEqual(query_limit(_test('a', {'test_b': 2})), None)
+
+    def test_merge(self):
+        stats = QueryStats()
+        stats.add('SELECT 1', 0.5)
+        log = QueryLog()
+        log.merge({'tests': {'a': stats}, 'fixtures': {}})
+        log.merge({'tests': {'a': stats}, 'fixtures': {}})
+        self.assertEqual(log.tests['a'].count, 2)
+        self.assertEqual(log.tests['a'].time, 1.0)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+from xml.dom import minidom
+
+from mock import Mock
+from django.test import TestCase
+from django.utils import simplejson
+
+from colortools.reports import JSONLinesWriter, JUnitXMLWriter
+
+
+def _test():
+    test = Mock()
+    test.id.return_value = 'app.tests.Case.test_method'
+    test._testMethodName = 'test_method'
+    test.fixtures = ['one']
+    return test
+
+
+def _run(writer, status, *args):
+    test = _test()
+    writer.startTest(test)
+    getattr(writer, status)(test, *args)
+    writer.addDuration(test, 0.5)
+    writer.stopTest(test)
+
+
+class JSONLinesWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'results.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_every_test_should_be_written(self):
+        writer = JSONLinesWriter(self.path)
+        _run(writer, 'addSuccess')
+        _run(writer, 'addFailure', 'Traceback: failure')
+        writer.close()
+        records = [simplejson.loads(line) for line in open(self.path)]
+        self.assertEqual([r['status'] for r in records], ['success', 'failure'])
+        self.assertEqual(records[1]['traceback'], 'Traceback: failure')
+        self.assertEqual(records[1]['duration'], 0.5)
+        self.assertEqual(records[1]['fixtures'], ['one'])
+
+    def test_fixture_setup_error_should_be_written(self):
+        writer = JSONLinesWriter(self.path)
+        # _pre_setup errors come without startTest and stopTest
+        writer.addError(_test(), 'Traceback: fixture')
+        writer.close()
+        records = [simplejson.loads(line) for line in open(self.path)]
+        self.assertEqual([(r['status'], r['traceback']) for r in records],
+                         [('error', 'Traceback: fixture')])
+
+    def test_teardown_error_after_stop_should_be_written(self):
+        writer = JSONLinesWriter(self.path)
+        _run(writer, 'addSuccess')
+        writer.addError(_test(), 'Traceback: teardown')
+        _run(writer, 'addSuccess')
+        writer.close()
+        records = [simplejson.loads(line) for line in open(self.path)]
+        self.assertEqual([r['status'] for r in records],
+                         ['success', 'error', 'success'])
+
+
+    def test_every_outcome_of_test_should_be_written(self):
+        writer = JSONLinesWriter(self.path)
+        test = _test()
+        writer.startTest(test)
+        writer.addFailure(test, 'Traceback: failure')
+        writer.addError(test, 'Traceback: teardown')
+        writer.stopTest(test)
+        writer.close()
+        records = [simplejson.loads(line) for line in open(self.path)]
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['status'], records[0]['traceback']),
+                         ('error', 'Traceback: teardown'))
+        self.assertEqual([(o['status'], o['details']) for o in records[0]['outcomes']],
+                         [('failure', 'Traceback: failure'),
+                          ('error', 'Traceback: teardown')])
+
+
+class JUnitXMLWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'results.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_totals_should_be_written_on_close(self):
+        writer = JUnitXMLWriter(self.path)
+        _run(writer, 'addSuccess')
+        _run(writer, 'addError', 'Traceback: <error>\x01')
+        _run(writer, 'addSkip', 'reason')
+        writer.close()
+        suite = minidom.parse(self.path).documentElement
+        self.assertEqual(int(suite.getAttribute('tests')), 3)
+        self.assertEqual(int(suite.getAttribute('errors')), 1)
+        self.assertEqual(int(suite.getAttribute('skipped')), 1)
+        self.assertEqual(float(suite.getAttribute('time')), 1.5)
+        error = suite.getElementsByTagName('error')[0]
+        self.assertEqual(error.firstChild.data, 'Traceback: <error>?')
+
+    def test_errors_outside_of_tests_should_be_counted(self):
+        writer = JUnitXMLWriter(self.path)
+        writer.addError(_test(), 'Traceback: fixture')
+        _run(writer, 'addSuccess')
+        writer.addError(_test(), 'Traceback: teardown')
+        writer.close()
+        suite = minidom.parse(self.path).documentElement
+        self.assertEqual(int(suite.getAttribute('tests')), 3)
+        self.assertEqual(int(suite.getAttribute('errors')), 2)
+
+    def test_failure_and_error_of_test_should_be_kept(self):
+        writer = JUnitXMLWriter(self.path)
+        test = _test()
+        writer.startTest(test)
+        writer.addFailure(test, 'Traceback: failure')
+        writer.addError(test, 'Traceback: teardown')
+        writer.stopTest(test)
+        writer.close()
+        suite = minidom.parse(self.path).documentElement
+        self.assertEqual(int(suite.getAttribute('tests')), 1)
+        self.assertEqual(int(suite.getAttribute('failures')), 1)
+        self.assertEqual(int(suite.getAttribute('errors')), 1)
+        testcase = suite.getElementsByTagName('testcase')[0]
+        self.assertEqual([node.tagName for node in testcase.childNodes
+                          if node.nodeType == node.ELEMENT_NODE],
+                         ['failure', 'error'])
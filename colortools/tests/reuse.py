@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.test import TestCase
+
+from colortools.reuse import DatabaseFingerprints, reuse_test_db, schema_fingerprint
+
+
+class DatabaseFingerprintsTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '.test-databases')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fingerprints_should_be_saved(self):
+        fingerprints = DatabaseFingerprints(self.path)
+        fingerprints.set('test_db', 'abc')
+        fingerprints.save()
+        self.assertEqual(DatabaseFingerprints(self.path).get('test_db'), 'abc')
+
+    def test_discarded_fingerprint_should_be_forgotten(self):
+        fingerprints = DatabaseFingerprints(self.path)
+        fingerprints.set('test_db', 'abc')
+        fingerprints.discard('test_db')
+        self.assertEqual(fingerprints.get('test_db'), None)
+
+
+class SchemaFingerprintFunctionTestCase(TestCase):
+
+    def test_fingerprint_should_be_stable(self):
+        self.assertEqual(schema_fingerprint(DEFAULT_DB_ALIAS),
+                         schema_fingerprint(DEFAULT_DB_ALIAS))
+
+    def test_global_fixtures_should_change_fingerprint(self):
+        fingerprint = schema_fingerprint(DEFAULT_DB_ALIAS)
+        settings.TEST_GLOBAL_FIXTURES = ['one']
+        try:
+            self.assertNotEqual(schema_fingerprint(DEFAULT_DB_ALIAS), fingerprint)
+        finally:
+            settings.TEST_GLOBAL_FIXTURES = []
+
+    def test_missing_sqlite_database_should_not_be_reused(self):
+        connection = Mock()
+        connection.vendor = 'sqlite'
+        connection.settings_dict = {'NAME': 'db'}
+        connection.creation._get_test_db_name.return_value = '/nonexistent/test_db'
+        self.assertEqual(reuse_test_db(connection), None)
+        self.assertEqual(connection.settings_dict['NAME'], 'db')
@@ -0,0 +1,58 @@
+import os
+import time
+import shutil
+import StringIO
+import tempfile
+
+from django.test import TestCase
+
+from colortools.profiling import ColorStats
+from colortools.sampling import SamplingProfile
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(100))
+
+
+class SamplingProfileTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_thread_sampler_should_collect_stacks(self):
+        profile = SamplingProfile(interval=0.001, mode='thread')
+        profile.runcall(_busy, 0.05)
+        self.assertTrue(profile.samples > 0)
+
+    def test_signal_sampler_should_collect_stacks(self):
+        profile = SamplingProfile(interval=0.001, mode='signal')
+        profile.runcall(_busy, 0.05)
+        self.assertTrue(profile.samples > 0)
+
+    def test_stats_should_be_readable_by_pstats(self):
+        profile = SamplingProfile(interval=0.001)
+        profile.runcall(_busy, 0.05)
+        stream = StringIO.StringIO()
+        stats = ColorStats(profile, stream=stream)
+        stats.print_stats('_busy')
+        self.assertTrue('_busy' in stream.getvalue())
+
+    def test_collapsed_stacks_should_end_with_count(self):
+        profile = SamplingProfile()
+        profile.stacks = {(('a.py', 1, 'a'), ('b.py', 2, 'b')): 3}
+        path = os.path.join(self.dir, 'out.collapsed')
+        profile.dump_collapsed(path)
+        self.assertEqual(open(path).read(), 'a (a.py:1);b (b.py:2) 3\n')
+
+    def test_merge_should_add_samples(self):
+        stack = (('a.py', 1, 'a'),)
+        one, two = SamplingProfile(), SamplingProfile()
+        one.stacks, one.samples = {stack: 1}, 1
+        two.stacks, two.samples = {stack: 2}, 2
+        one.merge(two)
+        self.assertEqual((one.stacks[stack], one.samples), (3, 3))
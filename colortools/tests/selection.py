@@ -0,0 +1,112 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from mock import Mock, patch
+from django.test import TestCase
+
+from colortools.selection import CoverageMap, data_files, suite_fingerprint
+
+
+def _test(test_id):
+    test = Mock()
+    test.id.return_value = test_id
+    return test
+
+
+class CoverageMapTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '.test-coverage')
+        self.source = os.path.join(self.dir, 'module.py')
+        self.write(self.source, 'x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, content):
+        stream = open(path, 'w')
+        stream.write(content)
+        stream.close()
+
+    def saved_map(self, failed=()):
+        coverage_map = CoverageMap(self.path, self.dir, 'abc')
+        coverage_map.recorded = {'a': set([self.source]), 'b': set()}
+        coverage_map.save(failed)
+        return CoverageMap(self.path, self.dir, 'abc')
+
+    def test_missing_map_should_not_be_valid(self):
+        self.assertFalse(CoverageMap(self.path, self.dir, 'abc').valid)
+
+    def test_other_fingerprint_should_make_map_stale(self):
+        self.saved_map()
+        self.assertFalse(CoverageMap(self.path, self.dir, 'other').valid)
+
+    def test_tests_of_changed_files_should_be_affected(self):
+        coverage_map = self.saved_map()
+        tests = [_test('a'), _test('b'), _test('new')]
+        self.assertEqual(coverage_map.changed_files(), set())
+        self.write(self.source, 'x = 2\n')
+        os.utime(self.source, (0, 0))
+        changed = coverage_map.changed_files()
+        self.assertEqual(changed, set([self.source]))
+        self.assertEqual([test.id() for test in coverage_map.affected(tests, changed)],
+                         ['a', 'new'])
+
+    def test_touched_file_with_same_content_should_not_change(self):
+        coverage_map = self.saved_map()
+        os.utime(self.source, (0, 0))
+        self.assertEqual(coverage_map.changed_files(), set())
+
+    def test_failed_tests_should_be_affected(self):
+        coverage_map = self.saved_map(failed=['b'])
+        self.assertEqual([test.id() for test in
+                          coverage_map.affected([_test('a'), _test('b')], set())],
+                         ['b'])
+
+    def test_changed_file_should_stay_changed_until_its_tests_run(self):
+        coverage_map = self.saved_map()
+        self.write(self.source, 'x = 2\n')
+        os.utime(self.source, (0, 0))
+        coverage_map.recorded = {'b': set()}
+        coverage_map.save()
+        self.assertEqual(coverage_map.changed_files(), set([self.source]))
+
+    def test_fixture_setup_should_be_recorded_with_test(self):
+        self.write(self.source, 'def setup():\n    return 1\n')
+        namespace = {}
+        execfile(self.source, namespace)
+        coverage_map = CoverageMap(self.path, self.dir, 'abc')
+        coverage_map.startSetup()
+        namespace['setup']()
+        coverage_map.startTest(_test('a'))
+        coverage_map.stopTest(_test('a'))
+        self.assertEqual(coverage_map.recorded, {'a': set([self.source])})
+
+    def test_only_files_under_root_should_be_recorded(self):
+        coverage_map = CoverageMap(self.path, self.dir, 'abc')
+        self.assertEqual(coverage_map.source_files([self.source, os.__file__]),
+                         set([self.source]))
+
+    def test_failed_setup_should_stop_tracing(self):
+        previous = sys.gettrace()
+        coverage_map = CoverageMap(self.path, self.dir, 'abc')
+        coverage_map.startSetup()
+        coverage_map.stop()
+        self.assertTrue(sys.gettrace() is previous)
+        self.assertEqual(coverage_map.recorded, {})
+
+    @patch('colortools.selection.get_apps')
+    def test_changed_data_files_should_change_fingerprint(self, get_apps):
+        app = Mock()
+        app.__file__ = os.path.join(self.dir, 'models.py')
+        get_apps.return_value = [app]
+        os.mkdir(os.path.join(self.dir, 'templates'))
+        template = os.path.join(self.dir, 'templates', 'index.html')
+        self.write(template, '<p>one</p>')
+        self.assertEqual(data_files(self.dir), [template])
+        fingerprint = suite_fingerprint(self.dir)
+        self.write(template, '<p>two</p>')
+        self.assertNotEqual(suite_fingerprint(self.dir), fingerprint)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+from mock import Mock, patch
+from django.conf import settings
+from django.test import TestCase
+
+from colortools.durations import DurationHistory
+from colortools.sharding import ShardPlan, parse_shard
+from colortools.test import ColorDjangoTestSuiteRunner
+
+_DURATIONS = os.path.join(tempfile.gettempdir(), 'colortools-shard-durations')
+
+
+def _test(test_id, fixtures=None):
+    test = Mock()
+    test.id.return_value = test_id
+    test.fixtures = fixtures
+    return test
+
+
+class ParseShardFunctionTestCase(TestCase):
+
+    def test_shard_should_be_parsed(self):
+        self.assertEqual(parse_shard('2/4'), (2, 4))
+        self.assertEqual(parse_shard((1, 2)), (1, 2))
+
+    def test_invalid_shard_should_raise(self):
+        self.assertRaises(ValueError, parse_shard, 'two')
+        self.assertRaises(ValueError, parse_shard, '0/4')
+        self.assertRaises(ValueError, parse_shard, '5/4')
+
+
+class ShardPlanTestCase(TestCase):
+
+    def setUp(self):
+        self.history = DurationHistory('/nonexistent/.durations')
+        self.history.durations = {'a': [3], 'b': [1], 'c': [1],
+                                  'fixtures:f1': [2]}
+
+    def test_without_history_shards_should_balance_test_count(self):
+        groups = [[_test('a'), _test('b')], [_test('c')], [_test('d')]]
+        plan = ShardPlan(groups, 2)
+        self.assertEqual([test.id() for test in plan.tests(1)], ['a', 'b'])
+        self.assertEqual([test.id() for test in plan.tests(2)], ['c', 'd'])
+
+    def test_cost_should_include_fixture_setup(self):
+        plan = ShardPlan([], 1, self.history)
+        self.assertEqual(plan.cost([_test('b', ['f1']), _test('c', ['f1'])]), 4)
+
+    def test_unknown_tests_should_take_median_duration(self):
+        plan = ShardPlan([[_test('a')], [_test('b')], [_test('x')]], 2, self.history)
+        self.assertEqual(plan.costs, [3, 1, 2])
+        self.assertEqual(plan.predicted, [3, 3])
+
+    def test_groups_should_keep_original_order(self):
+        groups = [[_test('b')], [_test('a')], [_test('c')]]
+        plan = ShardPlan(groups, 2, self.history)
+        self.assertEqual([test.id() for test in plan.tests(2)], ['b', 'c'])
+
+    def test_other_history_should_balance_test_count(self):
+        groups = [[_test('a'), _test('b')], [_test('c')], [_test('d')]]
+        fingerprint = self.history.fingerprint()
+        plan = ShardPlan(groups, 2, self.history, fingerprint=fingerprint)
+        self.assertFalse(plan.by_count())
+        self.history.durations['d'] = [5]
+        plan = ShardPlan(groups, 2, self.history, fingerprint=fingerprint)
+        self.assertTrue(plan.by_count())
+        self.assertEqual([test.id() for test in plan.tests(1)], ['a', 'b'])
+        self.assertEqual([test.id() for test in plan.tests(2)], ['c', 'd'])
+
+    @patch.object(settings._wrapped, 'TEST_DURATIONS_FILE', _DURATIONS, create=True)
+    @patch.object(settings._wrapped, 'TEST_DURATIONS', 5, create=True)
+    def test_sharded_runs_should_not_write_history(self):
+        runner = ColorDjangoTestSuiteRunner()
+        runner.fixture_timings = {}
+        runner.shard_plan = ShardPlan([], 2)
+        result = Mock()
+        result.test_timings = [(_test('a'), 1.0)]
+        try:
+            runner.report_durations(result, Mock())
+            self.assertFalse(os.path.exists(_DURATIONS))
+            runner.shard_plan = None
+            runner.report_durations(result, Mock())
+            self.assertTrue(os.path.exists(_DURATIONS))
+        finally:
+            if os.path.exists(_DURATIONS):
+                os.remove(_DURATIONS)
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from django.db import DEFAULT_DB_ALIAS
+
+from colortools.snapshots import SnapshotCache
+
+
+class SnapshotCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = SnapshotCache(size=1, targets=[('one',), ('one', 'two')])
+
+    def test_only_targets_should_be_wanted(self):
+        self.assertTrue(self.cache.wants(['one']))
+        self.assertFalse(self.cache.wants(['two']))
+
+    def test_disabled_cache_should_not_want_anything(self):
+        self.assertFalse(SnapshotCache(size=0, targets=[('one',)]).wants(['one']))
+
+    def test_lookup_should_return_longest_prefix(self):
+        self.cache.size = 2
+        self.cache.store(['one'], [DEFAULT_DB_ALIAS])
+        self.cache.store(['one', 'two'], [DEFAULT_DB_ALIAS])
+        snapshot = self.cache.lookup(['one', 'two', 'three'])
+        self.assertEqual(snapshot.fixtures, ('one', 'two'))
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_lookup_should_count_misses(self):
+        self.assertEqual(self.cache.lookup(['one']), None)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_least_recently_used_should_be_evicted(self):
+        self.cache.store(['one'], [DEFAULT_DB_ALIAS])
+        self.cache.store(['one', 'two'], [DEFAULT_DB_ALIAS])
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.lookup(['one']), None)
+
+    def test_lookup_should_skip_snapshots_of_other_databases(self):
+        self.cache.store(['one'], [DEFAULT_DB_ALIAS])
+        self.assertEqual(self.cache.lookup(['one'], ['other']), None)
+        self.assertEqual(self.cache.lookup(['one'], [DEFAULT_DB_ALIAS]).fixtures,
+                         ('one',))
@@ -1,11 +1,17 @@
 
+import StringIO
+
 from mock import Mock, patch
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.utils import unittest
 from django.utils.unittest.runner import TextTestResult
 from django.conf import settings
 
+from colortools.memory import MemoryLog
+from colortools.ordering import FixtureTrie
+from colortools.phases import PhaseTimer
 from colortools.test import (ColorTextTestResult, ColorDjangoTestSuiteRunner,
-                             fixture_list)
+                             fixture_list, _ColorDecorator)
 
 class ColorTextTestResultTestCase(TestCase):
 
@@ -58,6 +64,104 @@ class ColorTextTestResultTestCase(TestCase):
 
         self.assertEqual(mock_method.call_count, 2)
 
+    def test_formatted_error_should_be_kept(self):
+        self.result.addError(Mock(), 'Traceback: error')
+        self.assertEqual(self.result.errors[0][1], 'Traceback: error')
+
+    def test_listener_should_fail_passed_test(self):
+        listener = Mock()
+        listener.verify.return_value = 'QueryLimitExceeded: test'
+        self.result.listeners = [listener]
+        test = Mock()
+        self.result.addSuccess(test)
+        self.result.stream.color.assert_called_once_with('FAIL')
+        self.assertEqual(self.result.failures[0][1], 'QueryLimitExceeded: test')
+        listener.addFailure.assert_called_once_with(test, 'QueryLimitExceeded: test')
+
+    def test_progress_should_replace_dots(self):
+        self.result.progress = True
+        self.result.dots = False
+        self.result.total = 1
+        test = Mock()
+        test.id.return_value = 'app.tests.A.test_a'
+        self.result.startTest(test)
+        self.result.addSuccess(test)
+        self.result.stopTest(test)
+        self.assertFalse(self.result.stream.write.called)
+        self.result.stream.progress.assert_called_once_with('[1/1] app.tests.A.test_a')
+
+    @patch('colortools.test.time')
+    def test_progress_should_be_written_every_flush_interval(self, time):
+        clock = [100.0]
+        time.time.side_effect = lambda: clock[0]
+        output = StringIO.StringIO()
+        result = ColorTextTestResult(_ColorDecorator(output, flush_interval=0.5), True, 1)
+        result.progress = True
+        result.dots = False
+        # total isn't known
+        for i in range(10):
+            test = Mock()
+            test.id.return_value = 'app.tests.A.test_%d' % i
+            result.startTest(test)
+            clock[0] += 0.2
+            result.addSuccess(test)
+            result.stopTest(test)
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines],
+                         ['[1/?]', '[4/?]', '[7/?]', '[10/?]'])
+
+class ColorDecoratorTestCase(TestCase):
+
+    def setUp(self):
+        self.stream = Mock()
+        self.stream.isatty.return_value = False
+        self.decorator = _ColorDecorator(self.stream, flush_interval=60)
+
+    def test_output_should_be_buffered(self):
+        self.decorator.write('.')
+        self.decorator.color('SUCCESS')
+        self.decorator.write('.')
+        self.decorator.colorClear()
+        self.assertFalse(self.stream.write.called)
+        self.decorator.flush()
+        self.assertFalse(self.stream.write.called)
+        self.decorator._flush()
+        self.stream.write.assert_called_once_with('..')
+
+    def test_dots_should_not_flush_stream_per_test(self):
+        result = ColorTextTestResult(self.decorator, True, 1)
+        for i in range(10):
+            test = Mock()
+            result.startTest(test)
+            result.addSuccess(test)
+            result.stopTest(test)
+        self.assertFalse(self.stream.flush.called)
+        self.decorator._flush()
+        self.stream.write.assert_called_once_with('.' * 10)
+        self.assertEqual(self.stream.flush.call_count, 1)
+
+    def test_full_buffer_should_be_flushed(self):
+        self.decorator.buffer_size = 2
+        self.decorator.write('.')
+        self.decorator.write('.')
+        self.stream.write.assert_called_once_with('..')
+
+    def test_failure_should_be_flushed(self):
+        self.decorator.color('FAIL')
+        self.decorator.write('F')
+        self.decorator.colorClear()
+        self.stream.write.assert_called_once_with('F')
+
+    def test_colors_should_be_used_on_terminals(self):
+        self.stream.isatty.return_value = True
+        decorator = _ColorDecorator(self.stream)
+        self.assertTrue(decorator.escapes['FAIL'].startswith('\x1b['))
+        self.assertEqual(decorator.reset, '\x1b[0m')
+
+    def test_colors_can_be_forced(self):
+        decorator = _ColorDecorator(self.stream, colors=True)
+        self.assertTrue(decorator.escapes['FAIL'])
+
 class ColorDjangoTestSuiteRunnerTestCase(TestCase):
 
     def test_fixture_list(self):
@@ -68,6 +172,137 @@ class ColorDjangoTestSuiteRunnerTestCase(TestCase):
     def test_fixture_list_no_settings(self):
         self.assertEqual(ColorDjangoTestSuiteRunner.fixture_list('one'), ['one'])
 
+
+class FixtureLayersTestCase(TestCase):
+
+    def setUp(self):
+        self.runner = ColorDjangoTestSuiteRunner()
+        self.runner.reset_fixture_state()
+        self.runner.flush_databases = Mock()
+        self.runner._loaddata = Mock()
+
+    def tearDown(self):
+        self.runner.fixture_layers = None
+
+    @patch('colortools.test.transaction')
+    def test_shared_layers_should_be_kept(self, transaction):
+        transaction.savepoint.side_effect = ['s1', 's2', 's3']
+        self.runner.setup_fixture_layers(['one', 'two'])
+        self.runner.setup_fixture_layers(['one', 'three'])
+        transaction.savepoint_rollback.assert_called_once_with('s2', using='default')
+        self.runner._loaddata.assert_called_with(['three'], commit=False)
+        self.assertEqual(self.runner.rollbacks, 1)
+        self.assertEqual(self.runner.flushes, 0)
+        self.assertEqual([f for f, sids in self.runner.fixture_layers],
+                         ['one', 'three'])
+
+    @patch('colortools.test.transaction')
+    def test_prefix_should_not_load_anything(self, transaction):
+        self.runner.setup_fixture_layers(['one', 'two'])
+        self.runner.setup_fixture_layers(['one'])
+        self.assertEqual(self.runner._loaddata.call_count, 2)
+        self.assertEqual(self.runner.rollbacks, 1)
+
+    @patch('colortools.test.transaction')
+    def test_different_fixtures_should_roll_back_everything(self, transaction):
+        transaction.savepoint.side_effect = ['s1', 's2']
+        self.runner.setup_fixture_layers(['one'])
+        self.runner.setup_fixture_layers(['two'])
+        transaction.savepoint_rollback.assert_called_once_with('s1', using='default')
+        self.assertEqual(self.runner.flushes, 1)
+        self.assertEqual(self.runner.flush_databases.call_count, 1)
+
+
+class TransactionStateTestCase(TestCase):
+
+    def setUp(self):
+        self.runner = ColorDjangoTestSuiteRunner()
+        self.runner.reset_fixture_state()
+        self.runner.table_tracker = Mock()
+        self.runner.table_tracker.baseline = {'default': {'site': (['id'], [(1,)])}}
+        self.runner.table_tracker.written = {'default': set(['item'])}
+        self.runner._loaddata = Mock()
+
+    @patch('colortools.test.dump_tables')
+    @patch('colortools.test.clear_tables')
+    def test_same_fixtures_should_clear_only_dirty_tables(self, clear_tables, dump_tables):
+        dump_tables.return_value = [('item', ['id'], [(3,)])]
+        self.runner.restore_transaction_state('default', ['f3'])
+        self.runner._loaddata.assert_called_once_with(['f3'], databases=['default'])
+        self.runner.transaction_written = {'default': set(['item', 'tag'])}
+        self.runner.end_transaction_tracking()
+        self.assertEqual(self.runner.database_fixtures['default'], None)
+
+        self.runner.restore_transaction_state('default', ['f3'])
+        clear_tables.assert_called_once_with('default', ['item', 'tag'], {
+                'site': (['id'], [(1,)]), 'item': (['id'], [(3,)])})
+        self.assertEqual(self.runner._loaddata.call_count, 1)
+        self.assertEqual(self.runner.table_tracker.flush.call_count, 1)
+        self.assertEqual(self.runner.transaction_restores, 1)
+        self.assertEqual(self.runner.database_fixtures['default'], ['f3'])
+
+    @patch('colortools.test.connections', ['default', 'other'])
+    def test_untracked_databases_should_be_invalidated(self):
+        self.runner.transaction_written = {'default': set()}
+        self.runner.database_fixtures['other'] = ['f1']
+        self.runner.end_transaction_tracking()
+        self.runner.table_tracker.invalidate.assert_called_once_with('other')
+        self.assertEqual(self.runner.database_fixtures['other'], None)
+
+    @patch('colortools.test.dump_tables')
+    def test_loaded_fixtures_should_not_be_flushed(self, dump_tables):
+        dump_tables.return_value = []
+        self.runner.database_fixtures['default'] = ['f3']
+        self.runner.restore_transaction_state('default', ['f3'])
+        self.assertFalse(self.runner.table_tracker.flush.called)
+        self.assertFalse(self.runner._loaddata.called)
+
+    @patch('colortools.test.dump_tables')
+    def test_loaded_fixtures_without_baseline_should_be_flushed(self, dump_tables):
+        dump_tables.return_value = []
+        self.runner.table_tracker.baseline = {}
+        self.runner.database_fixtures['default'] = ['f3']
+        self.runner.restore_transaction_state('default', ['f3'])
+        self.assertEqual(self.runner.table_tracker.flush.call_count, 1)
+        self.runner._loaddata.assert_called_once_with(['f3'], databases=['default'])
+
+    @patch('colortools.test._transaction_fixture_setup')
+    @patch('colortools.test.connections_support_transactions')
+    @patch('colortools.memory.resident_memory')
+    def test_setup_without_transactions_should_be_measured_once(
+            self, resident_memory, support, transaction_setup):
+        support.return_value = False
+        resident_memory.side_effect = [100, 300]
+        self.runner.phase_timer = PhaseTimer()
+        patched = [(cls, name, cls.__dict__[name])
+                   for cls in (TestCase, TransactionTestCase)
+                   for name in ('_fixture_setup', '_fixture_teardown', '_post_teardown')
+                   if name in cls.__dict__]
+        try:
+            self.runner.wrap_tests(unittest.TestSuite())
+            self.runner.memory_log = MemoryLog()
+            self.runner.table_tracker = None
+            self.runner.database_templates = {}
+            instance = Mock()
+            instance.fixtures = ['f1']
+            instance.multi_db = False
+            TestCase.__dict__['_fixture_setup'](instance)
+        finally:
+            for cls, name, method in patched:
+                setattr(cls, name, method)
+        transaction_setup.assert_called_once_with(instance)
+        self.assertEqual(self.runner.memory_log.fixtures, {('f1',): 200})
+        self.assertEqual(self.runner.phase_timer.order, ['fixture setup'])
+
+    def test_transaction_tests_should_be_grouped_by_fixtures(self):
+        first, second, third = Mock(), Mock(), Mock()
+        first.fixtures = third.fixtures = ['f1']
+        second.fixtures = ['f2']
+        groups = ColorDjangoTestSuiteRunner.group_tests(
+                    FixtureTrie(), FixtureTrie([first, second, third]), [])
+        self.assertEqual(groups, [[first, third], [second]])
+
+
 class FixtureListFunctionTestCase(TestCase):
 
     def test_empty_should_return_empty(self):
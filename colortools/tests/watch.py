@@ -0,0 +1,43 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from django.test import TestCase
+
+from colortools.watch import SourceWatcher, reload_modules
+
+
+class SourceWatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'colortools_watched.py')
+        self.write('value = 1\n')
+        sys.path.insert(0, self.dir)
+        import colortools_watched
+        self.module = colortools_watched
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        del sys.modules['colortools_watched']
+        shutil.rmtree(self.dir)
+
+    def write(self, content):
+        stream = open(self.path, 'w')
+        stream.write(content)
+        stream.close()
+
+    def test_loaded_modules_under_root_should_be_watched(self):
+        watcher = SourceWatcher(self.dir)
+        self.assertEqual(watcher.changes(), set())
+        os.utime(self.path, (0, 0))
+        self.assertEqual(watcher.changes(), set([self.path]))
+        self.assertEqual(watcher.changes(), set())
+
+    def test_changed_modules_should_be_reloaded(self):
+        self.write('value = 2\n')
+        # compiled module would be used within the same second
+        os.utime(self.path, (0, 0))
+        self.assertEqual(reload_modules(set([self.path])), [])
+        self.assertEqual(self.module.value, 2)
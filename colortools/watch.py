@@ -0,0 +1,89 @@
+#
+# Copyright 2011 by Neubloc, LLC. All rights reserved.
+# Author: Szymon Rajchman
+#
+
+import os
+import sys
+import time
+
+from django.db.models import get_apps
+
+from colortools.reuse import _data_files
+
+
+def module_source(module):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return os.path.abspath(path)
+
+
+class SourceWatcher(object):
+    """
+    Polls modification times of loaded modules under ``root`` and of
+    fixture and custom SQL files of installed apps.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root) + os.sep
+        self.mtimes = self.scan()
+
+    def files(self):
+        files = set(_data_files())
+        for module in sys.modules.values():
+            path = module_source(module)
+            if (path and path.startswith(self.root)
+                    and 'site-packages' not in path):
+                files.add(path)
+        return files
+
+    def scan(self):
+        mtimes = {}
+        for path in self.files():
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def changes(self):
+        """returns files changed since the last call"""
+        mtimes = self.scan()
+        changed = set([path for path, mtime in mtimes.items()
+                       if self.mtimes.get(path, mtime) != mtime])
+        self.mtimes = mtimes
+        return changed
+
+    def wait(self, interval=0.5):
+        """blocks until some of the files change and returns them"""
+        while True:
+            changed = self.changes()
+            if changed:
+                return changed
+            time.sleep(interval)
+
+
+def reload_modules(paths, names=()):
+    """
+    reloads modules loaded from given files and then modules named in
+    ``names``. Models can't be reloaded - Django keeps the classes registered
+    first - so their modules are returned instead.
+    """
+    models = set([module_source(app) for app in get_apps()])
+    skipped = []
+    reloaded = set()
+    for name, module in sorted(sys.modules.items()):
+        path = module is not None and module_source(module)
+        if path and path in paths:
+            if path in models:
+                skipped.append(name)
+            else:
+                reload(module)
+                reloaded.add(name)
+    for name in names:
+        if name in sys.modules and name not in reloaded:
+            reload(sys.modules[name])
+    return skipped